@@ -38,6 +38,31 @@ if __name__ == '__main__':
                         help='Learning rate (default: %(default)s)')
     parser.add_argument('--mem_len', type=int, default=10000,
                         help='Learning rate (default: %(default)s)')
+    parser.add_argument('--mem_storage', default='array', choices=['list', 'array', 'dedup', 'memmap', 'tensor'],
+                        help='Storage backend of the replay memory (default: %(default)s)')
+    parser.add_argument('--mem_obs_dtype', default='float32', choices=['float32', 'float16', 'int8', 'uint8'],
+                        help='Observation dtype in the replay memory; int8/uint8 are quantized per feature '
+                             '(default: %(default)s)')
+    parser.add_argument('--n_step', type=int, default=1,
+                        help='No. of steps of the bootstrapped returns of value based algorithms (default: %(default)s)')
+    parser.add_argument('--save_replay', action='store_true', default=False,
+                        help='Saves the last model and a replay snapshot after every test')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='Resumes training from the last model and replay snapshot')
+    parser.add_argument('--prefetch', action='store_true', default=False,
+                        help='Samples replay batches on a background thread (vdn, idqn, sic)')
+    parser.add_argument('--batched_net', action='store_true', default=False,
+                        help='Stacks the weights of all agents to evaluate them at once (maddpg, vdn, idqn); needs '
+                             'the same observation and action size for all agents')
+    parser.add_argument('--shared_net', default=None, choices=['onehot', 'embedding'],
+                        help='Shares the weights of all agents, told apart by a one-hot or learned agent-ID input '
+                             '(vdn, idqn); needs the same observation and action size for all agents')
+    parser.add_argument('--compiled_actions', action='store_true', default=False,
+                        help='Selects greedy actions with a TorchScript compiled forward of all agents '
+                             '(maddpg, vdn, idqn)')
+    parser.add_argument('--comm_k', type=int, default=None,
+                        help='Communicates with the k nearest agents only, over a sparse neighbour graph (acc); '
+                             'every other agent if not set')
     parser.add_argument('--seed', type=int, default=0,
                         help='seed (default: %(default)s)')
     parser.add_argument('--test_interval', type=int, default=50,
@@ -61,8 +86,13 @@ if __name__ == '__main__':
         from networks_no_lstm import MADDPGNet, VDNet, IDQNet, SIHANet, SICNet, ACCNet, ACHACNet, SIHCANet
     else:
         from networks import MADDPGNet, VDNet, IDQNet, SIHANet, SICNet, ACCNet, ACHACNet, SIHCANet, DQNConsensusNet
+    if args.batched_net:
+        from networks import BatchedMADDPGNet as MADDPGNet, BatchedVDNet as VDNet, BatchedIDQNet as IDQNet
+    if args.shared_net is not None:
+        from networks import SharedVDNet, SharedIDQNet
 
-    if args.train and os.path.exists(_path) and os.listdir(_path):
+    # a resumed run continues from the model and replay snapshot of the run directory, hence keeps it as is
+    if args.train and not args.resume and os.path.exists(_path) and os.listdir(_path):
         if not args.force:
             raise FileExistsError('{} is not empty. Please use --force to override it'.format(_path))
         else:
@@ -89,30 +119,43 @@ if __name__ == '__main__':
         maddpg_net = lambda: MADDPGNet(obs_n, action_space_n)
         algo = MADDPG(env_fn, maddpg_net, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
                       device=device, mem_len=50000, tau=0.01, path=_path, discrete_action_space=True,
+                      mem_storage=args.mem_storage,
+                      mem_obs_dtype=args.mem_obs_dtype, compiled_actions=args.compiled_actions,
                       train_episodes=args.train_episodes, episode_max_steps=5000)
     elif args.algo == 'vdn':
         vdnet_fn = lambda: VDNet(obs_n, action_space_n)
+        if args.shared_net is not None:
+            vdnet_fn = lambda: SharedVDNet(obs_n, action_space_n, agent_id=args.shared_net)
         algo = VDN(env_fn, vdnet_fn, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
-                   device=device, mem_len=args.mem_len, tau=0.01, path=_path,
-                   train_episodes=args.train_episodes, episode_max_steps=5000)
+                   device=device, mem_len=args.mem_len, tau=0.01, path=_path, mem_storage=args.mem_storage,
+                   mem_obs_dtype=args.mem_obs_dtype, compiled_actions=args.compiled_actions,
+                   n_step=args.n_step,
+                   train_episodes=args.train_episodes, episode_max_steps=5000, prefetch=args.prefetch)
     elif args.algo == 'idqn':
         iqnet_fn = lambda: IDQNet(obs_n, action_space_n)
+        if args.shared_net is not None:
+            iqnet_fn = lambda: SharedIDQNet(obs_n, action_space_n, agent_id=args.shared_net)
         algo = IDQN(env_fn, iqnet_fn, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
-                    device=device, mem_len=args.mem_len, tau=0.01, path=_path,
-                    train_episodes=args.train_episodes, episode_max_steps=5000)
+                    device=device, mem_len=args.mem_len, tau=0.01, path=_path, mem_storage=args.mem_storage,
+                    mem_obs_dtype=args.mem_obs_dtype, compiled_actions=args.compiled_actions,
+                    n_step=args.n_step,
+                    train_episodes=args.train_episodes, episode_max_steps=5000, prefetch=args.prefetch)
     elif args.algo == 'sic':
         from marl.algo.communicate import SIC
 
         sicnet_fn = lambda: SICNet(obs_n, action_space_n)
         algo = SIC(env_fn, sicnet_fn, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
-                   device=device, mem_len=args.mem_len, tau=0.01, path=_path,
-                   train_episodes=args.train_episodes, episode_max_steps=5000)
+                   device=device, mem_len=args.mem_len, tau=0.01, path=_path, mem_storage=args.mem_storage,
+                   mem_obs_dtype=args.mem_obs_dtype, n_step=args.n_step,
+                   train_episodes=args.train_episodes, episode_max_steps=5000, prefetch=args.prefetch)
     elif args.algo == 'acc':
         from marl.algo.communicate import ACC
 
+        if args.comm_k is not None:
+            from networks import GraphACCNet as ACCNet
         accnet_fn = lambda: ACCNet(obs_n, action_space_n)
         algo = ACC(env_fn, accnet_fn, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
-                   device=device, mem_len=args.mem_len, tau=0.01, path=_path,
+                   device=device, mem_len=args.mem_len, tau=0.01, path=_path, comm_k=args.comm_k,
                    train_episodes=args.train_episodes, episode_max_steps=5000)
     elif args.algo == 'achac':
         from marl.algo.communicate import ACHAC
@@ -141,19 +184,28 @@ if __name__ == '__main__':
     elif args.algo == 'dqn_consensus':
         iqnet_fn = lambda: DQNConsensusNet(obs_n, action_space_n)
         algo = DQNConsensus(env_fn, iqnet_fn, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
-                            device=device, mem_len=args.mem_len, tau=0.01, path=_path,
+                            device=device, mem_len=args.mem_len, tau=0.01, path=_path, mem_storage=args.mem_storage,
+                            mem_obs_dtype=args.mem_obs_dtype, n_step=args.n_step,
                             train_episodes=args.train_episodes, episode_max_steps=5000)
 
     elif args.algo == 'dqn_share_noconsensus':
         iqnet_fn = lambda: DQNConsensusNet(obs_n, action_space_n)
         algo = DQNShareNoConsensus(env_fn, iqnet_fn, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
-                                   device=device, mem_len=args.mem_len, tau=0.01, path=_path,
+                                   device=device, mem_len=args.mem_len, tau=0.01, path=_path, mem_storage=args.mem_storage,
+                                   mem_obs_dtype=args.mem_obs_dtype, n_step=args.n_step,
                                    train_episodes=args.train_episodes, episode_max_steps=5000)
 
     # The real game begins!! Broom, Broom, Broommmm!!
     try:
         if args.train:
-            algo.train(test_interval=args.test_interval)
+            if args.resume:
+                for resume_path in (algo.last_model_path, algo.replay_path):
+                    if not os.path.exists(resume_path):
+                        raise FileNotFoundError('cannot resume, {} does not exist ( train with --save_replay first)'
+                                                .format(resume_path))
+                algo.restore(algo.last_model_path)
+                algo.restore_replay()
+            algo.train(test_interval=args.test_interval, save_replay=args.save_replay)
         if args.test:
             algo.restore()
             test_score = algo.test(episodes=args.test_episodes, render=True, log=False, record=True)
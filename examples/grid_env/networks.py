@@ -1,5 +1,9 @@
 import torch
 import torch.nn as nn
+from torch.func import functional_call
+
+from marl.utils import AgentBatchedLinear, AgentBatchedMLP, AgentSharedMLP, AgentBatchedNet
+from marl.algo.communicate.graph import NeighbourAggregation
 
 
 class DDPGCritic(nn.Module):
@@ -94,6 +98,76 @@ class IDQNet(VDNet):
         super().__init__(*args, **kwargs)
 
 
+# ****************************************************************
+# Agent-batched networks ( per-agent weights stacked, all agents evaluated at once)
+# ****************************************************************
+
+
+class BatchedDDPGCritic(nn.Module):
+    def __init__(self, n_agents, comb_obs_space, comb_action_space):
+        super().__init__()
+        self.n_agents = n_agents
+        self.obs_x = AgentBatchedLinear(n_agents, comb_obs_space, 128)
+        self._critic = AgentBatchedMLP(n_agents, [comb_action_space + 128, 1])
+
+        self._critic.layers[-1].weight.data.fill_(0)
+        self._critic.layers[-1].bias.data.fill_(0)
+
+    def forward(self, obs_n, action_n, agent=None):
+        x = torch.relu(self.obs_x(obs_n, agent=agent))
+        if agent is None and action_n.dim() == 2:  # the joint action is shared by the critics of all agents
+            action_n = action_n.unsqueeze(1).expand(-1, self.n_agents, -1)
+        return self._critic(torch.cat((action_n, x), dim=-1), agent=agent)
+
+
+class BatchedMADDPGNet(AgentBatchedNet):
+    def __init__(self, obs_space_n, action_space_n):
+        super().__init__([len(o) for o in obs_space_n], [a.n for a in action_space_n])
+
+        comb_obs_space = sum(len(o) for o in obs_space_n)
+        comb_action_space = sum(a.n for a in action_space_n)
+        self.actor = AgentBatchedMLP(self.n_agents, [self.obs_size, 32, self.action_space])
+        self.critic = BatchedDDPGCritic(self.n_agents, comb_obs_space, comb_action_space)
+
+        self.actor.layers[-1].bias.data.fill_(0)
+
+
+class BatchedVDNet(AgentBatchedNet):
+    def __init__(self, obs_space_n, action_space_n):
+        super().__init__([len(o) for o in obs_space_n], [a.n for a in action_space_n])
+
+        self._critic = AgentBatchedMLP(self.n_agents, [self.obs_size, 64, self.action_space])
+
+        self._critic.layers[-1].weight.data.fill_(0)
+        self._critic.layers[-1].bias.data.fill_(0)
+
+    def forward(self, x, agent=None):
+        return self._critic(x, agent=agent)
+
+
+class BatchedIDQNet(BatchedVDNet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+class SharedVDNet(AgentBatchedNet):
+    def __init__(self, obs_space_n, action_space_n, agent_id='onehot'):
+        super().__init__([len(o) for o in obs_space_n], [a.n for a in action_space_n])
+
+        self._critic = AgentSharedMLP(self.n_agents, [self.obs_size, 64, self.action_space], agent_id=agent_id)
+
+        self._critic.layers[-1].weight.data.fill_(0)
+        self._critic.layers[-1].bias.data.fill_(0)
+
+    def forward(self, x, agent=None):
+        return self._critic(x, agent=agent)
+
+
+class SharedIDQNet(SharedVDNet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
 class CommAgent(nn.Module):
     def __init__(self, obs_space, n_agents, action_space):
         super().__init__()
@@ -125,6 +199,50 @@ class SICNet(nn.Module):
         return getattr(self, 'agent_{}'.format(i))
 
 
+_fused_lstms = {}
+
+
+def fused_lstm(x, weights, hidden=None):
+    """
+    Runs (T, batch, input_size) inputs through a single-layer `nn.LSTM` with the given weights of a `nn.LSTMCell`
+    ( weight_ih, weight_hh, bias_ih, bias_hh), i.e. in one fused pass instead of one cell call per step
+
+    Args:
+        x: inputs shaped (T, batch, input_size)
+        weights: (weight_ih, weight_hh, bias_ih, bias_hh) as in `nn.LSTMCell`
+        hidden (optional): (hx, cx) at the first step, each shaped (batch, hidden_size), zeros if None
+    Returns:
+        outputs of every step shaped (T, batch, hidden_size)
+    """
+    weight_ih, weight_hh, bias_ih, bias_hh = weights
+    hidden_size = weight_hh.shape[1]
+    if hidden is None:
+        hidden = (x.new_zeros(x.shape[1], hidden_size), x.new_zeros(x.shape[1], hidden_size))
+    # the module only provides the computation, its own parameters are replaced by the given weights
+    key = (weight_ih.shape[1], hidden_size)
+    if key not in _fused_lstms:
+        _fused_lstms[key] = nn.LSTM(*key)
+    params = {'weight_ih_l0': weight_ih, 'weight_hh_l0': weight_hh, 'bias_ih_l0': bias_ih, 'bias_hh_l0': bias_hh}
+    outputs, _ = functional_call(_fused_lstms[key], params, (x, (hidden[0][None], hidden[1][None])))
+    return outputs
+
+
+def block_diagonal_lstm_weights(cells):
+    """
+    Weights of one `nn.LSTMCell` equivalent to the given cells side by side: their hidden states are concatenated,
+    and every gate uses block-diagonal weights, hence each part of the state only sees its own cell
+    """
+    weights = []
+    for name in ('weight_ih', 'weight_hh', 'bias_ih', 'bias_hh'):
+        # gates in the order of nn.LSTMCell: input, forget, cell, output
+        gates = zip(*[getattr(cell, name).chunk(4) for cell in cells])
+        if name.startswith('weight'):
+            weights.append(torch.cat([torch.block_diag(*gate) for gate in gates]))
+        else:
+            weights.append(torch.cat([torch.cat(gate) for gate in gates]))
+    return weights
+
+
 class LSTMAgentBase(nn.Module):
     def __init__(self, hidden_size):
         super().__init__()
@@ -146,11 +264,70 @@ class LSTMAgentBase(nn.Module):
         self.hx = self.hx.detach()
         self.cx = self.cx.detach()
 
+    def get_thoughts(self, input, hidden=None):
+        """
+        Sequence counterpart of `get_thought`: runs (T, batch, obs) inputs through the LSTM in a single fused pass
+        ( see `fused_lstm`), starting from `hidden` ( (hx, cx), zeros if None). Returns the (T, batch, hidden_size)
+        thoughts of every step and leaves `hx` and `cx` untouched.
+        """
+        lstm = self.lstm
+        return fused_lstm(self.x_layer(input), (lstm.weight_ih, lstm.weight_hh, lstm.bias_ih, lstm.bias_hh), hidden)
+
+
+class LSTMNetBase(nn.Module):
+    """ Container of `LSTMAgentBase` agents ( `agent_0`, ...), handling their recurrent state together"""
+
+    def agent(self, i):
+        return getattr(self, 'agent_{}'.format(i))
+
+    def init_hidden(self, batch=1, device=None):
+        for i in range(self.n_agents):
+            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
+
+    def hidden_detach(self):
+        for i in range(self.n_agents):
+            getattr(self, 'agent_{}'.format(i)).hidden_detach()
+
+    def get_hidden(self):
+        """ returns (hx, cx) of all agents, each shaped (n_agents, hidden_size) for batch size 1"""
+        hx = torch.cat([self.agent(i).hx for i in range(self.n_agents)])
+        cx = torch.cat([self.agent(i).cx for i in range(self.n_agents)])
+        return hx, cx
+
+    def get_thoughts(self, obs, hidden=None):
+        """
+        Sequence counterpart of `get_thought` for all agents ( see `LSTMAgentBase.get_thoughts`). On GPU the cells
+        of all agents run as one LSTM over their concatenated hidden states ( see `block_diagonal_lstm_weights`),
+        since the small steps are bound by kernel launches; on CPU the zero blocks cost more than they save, hence
+        every agent gets its own fused pass
+
+        Args:
+            obs: observations shaped (T, batch, n_agents, obs_size)
+            hidden (optional): (hx, cx) at the first step, each shaped (batch, n_agents, hidden_size)
+        Returns:
+            thoughts shaped (T, batch, n_agents, hidden_size)
+        """
+        agents = [self.agent(i) for i in range(self.n_agents)]
+        if not obs.is_cuda:
+            thoughts = []
+            for i, agent in enumerate(agents):
+                hidden_i = None if hidden is None else (hidden[0][:, i], hidden[1][:, i])
+                thoughts.append(agent.get_thoughts(obs[:, :, i], hidden_i))
+            return torch.stack(thoughts, dim=2)
+
+        x = torch.stack([agent.x_layer(obs[:, :, i]) for i, agent in enumerate(agents)], dim=2)
+        if hidden is not None:
+            hidden = (hidden[0].flatten(1), hidden[1].flatten(1))
+        weights = block_diagonal_lstm_weights([agent.lstm for agent in agents])
+        thoughts = fused_lstm(x.flatten(2), weights, hidden)
+        return thoughts.view(thoughts.shape[:2] + (self.n_agents, -1))
+
 
 class ACCAgent(LSTMAgentBase):
-    def __init__(self, obs_space, n_agents, action_space):
+    def __init__(self, obs_space, n_agents, action_space, n_neighbours=None):
         super().__init__(hidden_size=32)
-        self.neighbours_n = n_agents - 1
+        # hidden states received besides its own: all other agents unless given
+        self.neighbours_n = n_agents - 1 if n_neighbours is None else n_neighbours
         self.action_space = action_space
 
         self.x_layer = nn.Sequential(nn.Linear(obs_space, 64),
@@ -158,8 +335,8 @@ class ACCAgent(LSTMAgentBase):
                                      nn.Linear(64, 32),
                                      nn.ReLU())
 
-        self.critic = nn.Sequential(nn.Linear(self.hidden_size * n_agents, 1))
-        self.pi = nn.Sequential(nn.Linear(self.hidden_size * n_agents, action_space, bias=False))
+        self.critic = nn.Sequential(nn.Linear(self.hidden_size * (self.neighbours_n + 1), 1))
+        self.pi = nn.Sequential(nn.Linear(self.hidden_size * (self.neighbours_n + 1), action_space, bias=False))
 
         self.critic[-1].weight.data.fill_(0)
         self.critic[-1].bias.data.fill_(0)
@@ -169,35 +346,39 @@ class ACCAgent(LSTMAgentBase):
         self.hx, self.cx = self.lstm(x, (self.hx, self.cx))
         return self.hx
 
-    def forward(self, neighbours_hx):
+    def forward(self, neighbours_hx, hx=None):
         assert len(neighbours_hx) == self.neighbours_n
+        hx = self.hx if hx is None else hx
 
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, neighbours_hx.flatten().unsqueeze(0)), dim=1)
+            x = torch.cat((hx, neighbours_hx.transpose(0, 1).flatten(1)), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self.pi(x), self.critic(x)
 
 
-class ACCNet(nn.Module):
-    def __init__(self, obs_space_n, action_space_n):
+class ACCNet(LSTMNetBase):
+    def __init__(self, obs_space_n, action_space_n, n_neighbours=None):
         super().__init__()
 
         self.n_agents = len(obs_space_n)
         for i in range(self.n_agents):
             agent_i = 'agent_{}'.format(i)
-            setattr(self, agent_i, ACCAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n))
+            setattr(self, agent_i, ACCAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n, n_neighbours))
 
-    def agent(self, i):
-        return getattr(self, 'agent_{}'.format(i))
 
-    def init_hidden(self, batch=1, device=None):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
+class GraphACCNet(ACCNet):
+    """
+    ACCNet communicating over a sparse neighbour graph ( ACC with `comm_k`): every agent receives the mean hidden
+    state of its neighbours as a single neighbour input, hence its input width does not grow with the no. of agents
+    """
 
-    def hidden_detach(self):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).hidden_detach()
+    def __init__(self, obs_space_n, action_space_n):
+        super().__init__(obs_space_n, action_space_n, n_neighbours=1)
+        self.comm = NeighbourAggregation(self.agent(0).hidden_size)
+
+    def communicate(self, thoughts, edges):
+        return self.comm(thoughts, edges)
 
 
 # *********************************************************************
@@ -225,25 +406,27 @@ class ACHACAgent(LSTMAgentBase):
         self.hx, self.cx = self.lstm(x, (self.hx, self.cx))
         return self.hx
 
-    def forward(self, neighbours_hx):
+    def forward(self, neighbours_hx, hx=None):
         assert len(neighbours_hx) == self.neighbours_n
+        hx = self.hx if hx is None else hx
 
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, neighbours_hx.flatten().unsqueeze(0)), dim=1)
+            x = torch.cat((hx, neighbours_hx.transpose(0, 1).flatten(1)), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self.pi(x)
 
-    def critic(self, neighbours_hx, neighbours_action):
+    def critic(self, neighbours_hx, neighbours_action, hx=None):
+        hx = self.hx if hx is None else hx
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, neighbours_hx.flatten().unsqueeze(0)), dim=1)
-            x = torch.cat((x, neighbours_action.unsqueeze(0)), dim=1)
+            x = torch.cat((hx, neighbours_hx.transpose(0, 1).flatten(1)), dim=1)
+            x = torch.cat((x, neighbours_action.reshape(len(x), -1)), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self._critic(x)
 
 
-class ACHACNet(nn.Module):
+class ACHACNet(LSTMNetBase):
     def __init__(self, obs_space_n, action_space_n):
         super().__init__()
 
@@ -252,17 +435,6 @@ class ACHACNet(nn.Module):
             agent_i = 'agent_{}'.format(i)
             setattr(self, agent_i, ACHACAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n))
 
-    def agent(self, i):
-        return getattr(self, 'agent_{}'.format(i))
-
-    def init_hidden(self, batch=1, device=None):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
-
-    def hidden_detach(self):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).hidden_detach()
-
 
 # *********************************************************************
 
@@ -292,23 +464,25 @@ class SIHAAgent(LSTMAgentBase):
         self.hx, self.cx = self.lstm(x, (self.hx, self.cx))
         return self.hx
 
-    def forward(self, global_thought):
+    def forward(self, global_thought, hx=None):
+        hx = self.hx if hx is None else hx
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, global_thought), dim=1)
+            x = torch.cat((hx, global_thought), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self.pi(x)
 
-    def critic(self, global_thought, neighbours_action):
+    def critic(self, global_thought, neighbours_action, hx=None):
+        hx = self.hx if hx is None else hx
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, global_thought), dim=1)
-            x = torch.cat((x, neighbours_action.unsqueeze(0)), dim=1)
+            x = torch.cat((hx, global_thought), dim=1)
+            x = torch.cat((x, neighbours_action.reshape(len(x), -1)), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self._critic(x)
 
 
-class SIHANet(nn.Module):
+class SIHANet(LSTMNetBase):
     def __init__(self, obs_space_n, action_space_n):
         super().__init__()
 
@@ -317,17 +491,6 @@ class SIHANet(nn.Module):
             agent_i = 'agent_{}'.format(i)
             setattr(self, agent_i, SIHAAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n))
 
-    def agent(self, i):
-        return getattr(self, 'agent_{}'.format(i))
-
-    def init_hidden(self, batch=1, device=None):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
-
-    def hidden_detach(self):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).hidden_detach()
-
 
 # *********************************************************************
 
@@ -368,19 +531,20 @@ class SIHCAAgent(LSTMAgentBase):
         self.hx, self.cx = self.lstm(x, (self.hx, self.cx))
         return self.hx
 
-    def forward(self, global_thought):
+    def forward(self, global_thought, hx=None):
+        hx = self.hx if hx is None else hx
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, global_thought), dim=1)
+            x = torch.cat((hx, global_thought), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self.pi(x)
 
     def critic(self, global_thought, global_action):
-        x = torch.cat((global_thought, global_action.unsqueeze(0)), dim=1)
+        x = torch.cat((global_thought, global_action.reshape(len(global_thought), -1)), dim=1)
         return self._critic(x)
 
 
-class SIHCANet(nn.Module):
+class SIHCANet(LSTMNetBase):
     def __init__(self, obs_space_n, action_space_n):
         super().__init__()
 
@@ -389,17 +553,6 @@ class SIHCANet(nn.Module):
             agent_i = 'agent_{}'.format(i)
             setattr(self, agent_i, SIHCAAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n))
 
-    def agent(self, i):
-        return getattr(self, 'agent_{}'.format(i))
-
-    def init_hidden(self, batch=1, device=None):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
-
-    def hidden_detach(self):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).hidden_detach()
-
 # *********************************************************************
 
 # *********************************************************************
@@ -134,6 +134,34 @@ class LSTMAgentBase(nn.Module):
     def hidden_detach(self):
         pass
 
+    def get_thoughts(self, input, hidden=None):
+        """ Sequence counterpart of `get_thought`, for (T, batch, obs) inputs"""
+        return self.x_layer(input)
+
+
+class LSTMNetBase(nn.Module):
+    """ Container of `LSTMAgentBase` agents ( `agent_0`, ...), handling their recurrent state together"""
+
+    def agent(self, i):
+        return getattr(self, 'agent_{}'.format(i))
+
+    def init_hidden(self, batch=1, device=None):
+        for i in range(self.n_agents):
+            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
+
+    def hidden_detach(self):
+        for i in range(self.n_agents):
+            getattr(self, 'agent_{}'.format(i)).hidden_detach()
+
+    def get_hidden(self):
+        """ returns (hx, cx) of all agents, each shaped (n_agents, hidden_size): zeros as there is no recurrence"""
+        hx = next(self.parameters()).new_zeros(self.n_agents, self.agent(0).hidden_size)
+        return hx, hx
+
+    def get_thoughts(self, obs, hidden=None):
+        """ Sequence counterpart of `get_thought` for all agents, for (T, batch, n_agents, obs_size) observations"""
+        return torch.stack([self.agent(i).get_thoughts(obs[:, :, i]) for i in range(self.n_agents)], dim=2)
+
 
 class ACCAgent(LSTMAgentBase):
     def __init__(self, obs_space, n_agents, action_space):
@@ -157,17 +185,18 @@ class ACCAgent(LSTMAgentBase):
         self.hx, self.cx = self.lstm(x, (self.hx, self.cx))
         return self.hx
 
-    def forward(self, neighbours_hx):
+    def forward(self, neighbours_hx, hx=None):
         assert len(neighbours_hx) == self.neighbours_n
+        hx = self.hx if hx is None else hx
 
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, neighbours_hx.flatten().unsqueeze(0)), dim=1)
+            x = torch.cat((hx, neighbours_hx.transpose(0, 1).flatten(1)), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self.pi(x), self.critic(x)
 
 
-class ACCNet(nn.Module):
+class ACCNet(LSTMNetBase):
     def __init__(self, obs_space_n, action_space_n):
         super().__init__()
 
@@ -176,17 +205,6 @@ class ACCNet(nn.Module):
             agent_i = 'agent_{}'.format(i)
             setattr(self, agent_i, ACCAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n))
 
-    def agent(self, i):
-        return getattr(self, 'agent_{}'.format(i))
-
-    def init_hidden(self, batch=1, device=None):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
-
-    def hidden_detach(self):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).hidden_detach()
-
 
 # *********************************************************************
 
@@ -213,25 +231,27 @@ class ACHACAgent(LSTMAgentBase):
         self.hx, self.cx = self.lstm(x, (self.hx, self.cx))
         return self.hx
 
-    def forward(self, neighbours_hx):
+    def forward(self, neighbours_hx, hx=None):
         assert len(neighbours_hx) == self.neighbours_n
+        hx = self.hx if hx is None else hx
 
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, neighbours_hx.flatten().unsqueeze(0)), dim=1)
+            x = torch.cat((hx, neighbours_hx.transpose(0, 1).flatten(1)), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self.pi(x)
 
-    def critic(self, neighbours_hx, neighbours_action):
+    def critic(self, neighbours_hx, neighbours_action, hx=None):
+        hx = self.hx if hx is None else hx
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, neighbours_hx.flatten().unsqueeze(0)), dim=1)
-            x = torch.cat((x, neighbours_action.unsqueeze(0)), dim=1)
+            x = torch.cat((hx, neighbours_hx.transpose(0, 1).flatten(1)), dim=1)
+            x = torch.cat((x, neighbours_action.reshape(len(x), -1)), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self._critic(x)
 
 
-class ACHACNet(nn.Module):
+class ACHACNet(LSTMNetBase):
     def __init__(self, obs_space_n, action_space_n):
         super().__init__()
 
@@ -240,17 +260,6 @@ class ACHACNet(nn.Module):
             agent_i = 'agent_{}'.format(i)
             setattr(self, agent_i, ACHACAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n))
 
-    def agent(self, i):
-        return getattr(self, 'agent_{}'.format(i))
-
-    def init_hidden(self, batch=1, device=None):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
-
-    def hidden_detach(self):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).hidden_detach()
-
 
 # *********************************************************************
 
@@ -280,23 +289,25 @@ class SIHAAgent(LSTMAgentBase):
         self.hx, self.cx = self.lstm(x, (self.hx, self.cx))
         return self.hx
 
-    def forward(self, global_thought):
+    def forward(self, global_thought, hx=None):
+        hx = self.hx if hx is None else hx
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, global_thought), dim=1)
+            x = torch.cat((hx, global_thought), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self.pi(x)
 
-    def critic(self, global_thought, neighbours_action):
+    def critic(self, global_thought, neighbours_action, hx=None):
+        hx = self.hx if hx is None else hx
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, global_thought), dim=1)
-            x = torch.cat((x, neighbours_action.unsqueeze(0)), dim=1)
+            x = torch.cat((hx, global_thought), dim=1)
+            x = torch.cat((x, neighbours_action.reshape(len(x), -1)), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self._critic(x)
 
 
-class SIHANet(nn.Module):
+class SIHANet(LSTMNetBase):
     def __init__(self, obs_space_n, action_space_n):
         super().__init__()
 
@@ -305,17 +316,6 @@ class SIHANet(nn.Module):
             agent_i = 'agent_{}'.format(i)
             setattr(self, agent_i, SIHAAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n))
 
-    def agent(self, i):
-        return getattr(self, 'agent_{}'.format(i))
-
-    def init_hidden(self, batch=1, device=None):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
-
-    def hidden_detach(self):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).hidden_detach()
-
 
 # *********************************************************************
 
@@ -356,19 +356,20 @@ class SIHCAAgent(LSTMAgentBase):
         self.hx, self.cx = self.lstm(x, (self.hx, self.cx))
         return self.hx
 
-    def forward(self, global_thought):
+    def forward(self, global_thought, hx=None):
+        hx = self.hx if hx is None else hx
         if self.neighbours_n >= 1:
-            x = torch.cat((self.hx, global_thought), dim=1)
+            x = torch.cat((hx, global_thought), dim=1)
         else:
-            x = self.hx
+            x = hx
         return self.pi(x)
 
     def critic(self, global_thought, global_action):
-        x = torch.cat((global_thought, global_action.unsqueeze(0)), dim=1)
+        x = torch.cat((global_thought, global_action.reshape(len(global_thought), -1)), dim=1)
         return self._critic(x)
 
 
-class SIHCANet(nn.Module):
+class SIHCANet(LSTMNetBase):
     def __init__(self, obs_space_n, action_space_n):
         super().__init__()
 
@@ -376,14 +377,3 @@ class SIHCANet(nn.Module):
         for i in range(self.n_agents):
             agent_i = 'agent_{}'.format(i)
             setattr(self, agent_i, SIHCAAgent(len(obs_space_n[i]), self.n_agents, action_space_n[i].n))
-
-    def agent(self, i):
-        return getattr(self, 'agent_{}'.format(i))
-
-    def init_hidden(self, batch=1, device=None):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).init_hidden(batch, device)
-
-    def hidden_detach(self):
-        for i in range(self.n_agents):
-            getattr(self, 'agent_{}'.format(i)).hidden_detach()
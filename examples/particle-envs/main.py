@@ -8,7 +8,7 @@ import marl
 from marl.algo import MADDPG, VDN
 
 from make_env import make_env
-from networks import MADDPGNet, VDNet, IQNet
+from networks import MADDPGNet, VDNet, IQNet, SharedVDNet
 
 if __name__ == '__main__':
     # Lets gather arguments
@@ -35,10 +35,34 @@ if __name__ == '__main__':
                         help='Learning rate (default: %(default)s)')
     parser.add_argument('--run_i', type=int, default=1,
                         help='running iteration (default: %(default)s)')
+    parser.add_argument('--mem_storage', default='array', choices=['list', 'array', 'dedup', 'memmap', 'tensor'],
+                        help='Storage backend of the replay memory (default: %(default)s)')
+    parser.add_argument('--mem_obs_dtype', default='float32', choices=['float32', 'float16', 'int8', 'uint8'],
+                        help='Observation dtype in the replay memory; int8/uint8 are quantized per feature '
+                             '(default: %(default)s)')
+    parser.add_argument('--n_step', type=int, default=1,
+                        help='No. of steps of the bootstrapped returns of value based algorithms (default: %(default)s)')
+    parser.add_argument('--save_replay', action='store_true', default=False,
+                        help='Saves the last model and a replay snapshot after every test')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='Resumes training from the last model and replay snapshot')
+    parser.add_argument('--batched_net', action='store_true', default=False,
+                        help='Stacks the weights of all agents to evaluate them at once (maddpg, vdn); needs '
+                             'the same observation and action size for all agents')
+    parser.add_argument('--shared_net', default=None, choices=['onehot', 'embedding'],
+                        help='Shares the weights of all agents, told apart by a one-hot or learned agent-ID input '
+                             '(vdn); needs the same observation and action size for all agents')
+    parser.add_argument('--compiled_actions', action='store_true', default=False,
+                        help='Selects greedy actions with a TorchScript compiled forward of all agents '
+                             '(maddpg, vdn)')
+    parser.add_argument('--vectorized_world', action='store_true', default=False,
+                        help='Steps the physics of all entities with array operations')
     parser.add_argument('--seed', type=int, default=0,
                         help='seed (default: %(default)s)')
 
     args = parser.parse_args()
+    if args.batched_net:
+        from networks import BatchedMADDPGNet as MADDPGNet, BatchedVDNet as VDNet
     device = 'cuda' if ((not args.no_cuda) and torch.cuda.is_available()) else 'cpu'
     args.env_result_dir = os.path.join(args.result_dir, args.env)
     if not os.path.exists(args.env_result_dir):
@@ -49,7 +73,7 @@ if __name__ == '__main__':
     np.random.seed(args.seed)
 
     # initialize environment
-    env_fn = lambda: make_env(args.env)
+    env_fn = lambda: make_env(args.env, vectorized=args.vectorized_world)
     env = env_fn()
     obs_n = env.reset()
     action_space_n = env.action_space
@@ -58,11 +82,17 @@ if __name__ == '__main__':
     if args.algo == 'maddpg':
         maddpg_net = lambda: MADDPGNet(obs_n, action_space_n)
         algo = MADDPG(env_fn, maddpg_net, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
-                      device=device, mem_len=10000, tau=0.01, path=args.env_result_dir)
+                      device=device, mem_len=10000, tau=0.01, path=args.env_result_dir,
+                      mem_storage=args.mem_storage,
+                      mem_obs_dtype=args.mem_obs_dtype, compiled_actions=args.compiled_actions)
     elif args.algo == 'vdn':
         vdnet_fn = lambda: VDNet(obs_n, action_space_n)
+        if args.shared_net is not None:
+            vdnet_fn = lambda: SharedVDNet(obs_n, action_space_n, agent_id=args.shared_net)
         algo = VDN(env_fn, vdnet_fn, lr=args.lr, discount=args.discount, batch_size=args.batch_size,
-                    device=device, mem_len=10000, tau=0.01, path=args.env_result_dir,
+                    device=device, mem_len=10000, tau=0.01, path=args.env_result_dir, mem_storage=args.mem_storage,
+                    mem_obs_dtype=args.mem_obs_dtype, compiled_actions=args.compiled_actions,
+                    n_step=args.n_step,
                     train_episodes=args.train_episodes, episode_max_steps=50)  # original is 1000 maximum episode
     elif args.algo == 'iql':
         iqnet = lambda: IQNet()
@@ -71,7 +101,14 @@ if __name__ == '__main__':
     # The real game begins!! Broom, Broom, Broommmm!!
     try:
         if args.train:
-            algo.train()
+            if args.resume:
+                for resume_path in (algo.last_model_path, algo.replay_path):
+                    if not os.path.exists(resume_path):
+                        raise FileNotFoundError('cannot resume, {} does not exist ( train with --save_replay first)'
+                                                .format(resume_path))
+                algo.restore(algo.last_model_path)
+                algo.restore_replay()
+            algo.train(save_replay=args.save_replay)
         if args.test:
             algo.restore()
             test_score = algo.test(episodes=10, render=True, log=False)
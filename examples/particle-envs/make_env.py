@@ -13,7 +13,7 @@ communication actions in this array. See environment.py for more details.
 """
 
 
-def make_env(scenario_name, benchmark=False):
+def make_env(scenario_name, benchmark=False, vectorized=False, **world_kwargs):
     '''
     Creates a MultiAgentEnv object as env. This can be used similar to a gym
     environment by calling env.reset() and env.step().
@@ -24,6 +24,10 @@ def make_env(scenario_name, benchmark=False):
                             (without the .py extension)
         benchmark       :   whether you want to produce benchmarking data
                             (usually only done during evaluation)
+        vectorized      :   whether the physics runs on arrays of all entities
+                            (see multiagent.core.VectorizedWorld)
+        world_kwargs    :   arguments of the scenario's make_world, e.g. the
+                            no. of agents of simple_spread (num_agents=...)
 
     Some useful env properties (see environment.py):
         .observation_space  :   Returns the observation space for each agent
@@ -36,10 +40,38 @@ def make_env(scenario_name, benchmark=False):
     # load scenario from script
     scenario = scenarios.load(scenario_name + ".py").Scenario()
     # create world
-    world = scenario.make_world()
+    world = scenario.make_world(**world_kwargs)
+    if vectorized:
+        from multiagent.core import VectorizedWorld
+        world = VectorizedWorld.from_world(world)
     # create multiagent environment
+    # vectorized callbacks of all agents at once, when the scenario has them
+    rewards = getattr(scenario, 'rewards', None)
+    observations = getattr(scenario, 'observations', None)
     if benchmark:
-        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation, scenario.benchmark_data)
+        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation, scenario.benchmark_data,
+                            rewards_callback=rewards, observations_callback=observations)
     else:
-        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation)
+        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation,
+                            rewards_callback=rewards, observations_callback=observations)
     return env
+
+
+def make_batch_env(scenario_name, n_envs, episode_len=None, benchmark=False, **world_kwargs):
+    '''
+    Creates a BatchMultiAgentEnv object stepping n_envs environments of the
+    scenario at once; finished environments are reset automatically.
+
+    Input:
+        scenario_name   :   name of the scenario from ./scenarios/
+                            (without the .py extension)
+        n_envs          :   no. of independent environments (worlds)
+        episode_len     :   no. of steps after which an environment is reset
+                            (None to reset on done only)
+        benchmark       :   whether you want to produce benchmarking data
+        world_kwargs    :   arguments of the scenario's make_world
+    '''
+    from multiagent.environment import BatchMultiAgentEnv
+
+    env_batch = [make_env(scenario_name, benchmark=benchmark, **world_kwargs) for _ in range(n_envs)]
+    return BatchMultiAgentEnv(env_batch, episode_len=episode_len)
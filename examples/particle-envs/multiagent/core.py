@@ -1,3 +1,5 @@
+import copy
+import itertools
 import numpy as np
 import seaborn as sns
 
@@ -327,3 +329,373 @@ class World(object):
         force[perp_dim] = np.cos(theta) * force_mag
         force[prll_dim] = np.sin(theta) * np.abs(force_mag)
         return force
+
+
+# worlds with at least this many entities find contacts with a spatial hash instead of over all pairs
+BROADPHASE_MIN_ENTITIES = 64
+# pairs further apart than their sizes plus this many contact margins get no contact force ( at most ~1e-17 of a
+# full contact force)
+BROADPHASE_MARGINS = 40
+
+
+def neighbour_pairs(p_pos, cell_size, group=None):
+    """
+    Candidate pairs (ia, ib), ia < ib, of the points within `cell_size` of each other, found with a spatial hash:
+    points are bucketed into a uniform grid of `cell_size` cells, and pairs are formed with the points of the same
+    and adjacent cells only. Pairs may be further apart than `cell_size`, but no closer pair is left out.
+
+    Args:
+        p_pos: (n_points, dim_p) positions
+        cell_size: size of the grid cells
+        group: (n_points,) ids of independent groups of points ( e.g. worlds), pairs are formed within groups only
+    Returns:
+        indices of the first and second points of the pairs
+    """
+    n_points, dim_p = p_pos.shape
+    cells = np.floor(p_pos / cell_size).astype(np.int64)
+    cells -= cells.min(axis=0, initial=0)
+    # linear cell keys, padded by one cell on every side so that adjacent cells do not wrap around
+    extent = cells.max(axis=0, initial=0) + 3
+    key = np.zeros(n_points, dtype=np.int64) if group is None else np.asarray(group, dtype=np.int64)
+    for dim in range(dim_p):
+        key = key * extent[dim] + cells[:, dim] + 1
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+
+    ia, ib = [], []
+    strides = np.cumprod(np.append(1, extent[:0:-1]))[::-1]
+    for offset in itertools.product((-1, 0, 1), repeat=dim_p):
+        neighbour_key = key + np.dot(offset, strides)
+        start = np.searchsorted(sorted_key, neighbour_key, side='left')
+        counts = np.searchsorted(sorted_key, neighbour_key, side='right') - start
+        # points of the neighbour cell, as ranges of the sorted points
+        first = np.repeat(start - np.cumsum(counts) + counts, counts)
+        ia.append(np.repeat(np.arange(n_points), counts))
+        ib.append(order[np.arange(len(first)) + first])
+    ia, ib = np.concatenate(ia), np.concatenate(ib)
+    keep = ia < ib
+    return ia[keep], ib[keep]
+
+
+def contact_forces(p_pos, size, mass, movable, collide, contact_force, contact_margin):
+    """
+    Softmax penetration forces on every entity from all the others, as in `World.get_entity_collision_force`.
+    Arrays have the entities on the second to last axis of the positions ( and the last axis of the properties),
+    leading axes are batch axes ( e.g. several worlds).
+
+    Worlds of `BROADPHASE_MIN_ENTITIES` entities or more only consider the pairs within contact range
+    ( see `neighbour_pairs`), others all pairs at once.
+    """
+    if p_pos.shape[-2] >= BROADPHASE_MIN_ENTITIES:
+        return broadphase_contact_forces(p_pos, size, mass, movable, collide, contact_force, contact_margin)
+
+    delta_pos = p_pos[..., :, None, :] - p_pos[..., None, :, :]
+    dist = np.sqrt(np.sum(np.square(delta_pos), axis=-1))
+    dist_min = size[..., :, None] + size[..., None, :]
+    # colliding pairs of different entities, where at least one of them moves
+    contact = collide[..., :, None] & collide[..., None, :] & (movable[..., :, None] | movable[..., None, :])
+    contact &= ~np.eye(p_pos.shape[-2], dtype=bool)
+    k = contact_margin
+    penetration = np.logaddexp(0, -(dist - dist_min) / k) * k
+    with np.errstate(divide='ignore', invalid='ignore'):
+        force = contact_force * delta_pos / dist[..., None] * penetration[..., None]
+    # consider mass in collisions of two movable entities
+    force_ratio = np.where(movable[..., None, :], mass[..., None, :] / mass[..., :, None], 1.0)
+    force = np.where(contact[..., None], force_ratio[..., None] * force, 0.0).sum(axis=-2)
+    return np.where(movable[..., None], force, 0.0)
+
+
+def broadphase_contact_forces(p_pos, size, mass, movable, collide, contact_force, contact_margin):
+    """ Same as `contact_forces`, over the pairs of colliders within contact range only"""
+    shape = p_pos.shape
+    n_entities, dim_p = shape[-2:]
+    p_pos = p_pos.reshape(-1, dim_p)
+    size, mass, movable, collide = size.ravel(), mass.ravel(), movable.ravel(), collide.ravel()
+    p_force = np.zeros_like(p_pos)
+    colliders = np.flatnonzero(collide)
+    if len(colliders) < 2:
+        return p_force.reshape(shape)
+
+    cell_size = 2 * size[colliders].max() + BROADPHASE_MARGINS * contact_margin
+    ia, ib = neighbour_pairs(p_pos[colliders], cell_size, group=colliders // n_entities)
+    ia, ib = colliders[ia], colliders[ib]
+    # pairs where at least one entity moves
+    moving = movable[ia] | movable[ib]
+    ia, ib = ia[moving], ib[moving]
+
+    delta_pos = p_pos[ia] - p_pos[ib]
+    dist = np.sqrt(np.sum(np.square(delta_pos), axis=1))
+    dist_min = size[ia] + size[ib]
+    k = contact_margin
+    penetration = np.logaddexp(0, -(dist - dist_min) / k) * k
+    with np.errstate(divide='ignore', invalid='ignore'):
+        force = contact_force * delta_pos / dist[:, None] * penetration[:, None]
+    # consider mass in collisions of two movable entities
+    both_movable = movable[ia] & movable[ib]
+    force_a = np.where(both_movable, mass[ib] / mass[ia], 1.0)[:, None] * force
+    force_b = np.where(both_movable, mass[ia] / mass[ib], 1.0)[:, None] * force
+    for dim in range(dim_p):
+        p_force[:, dim] = (np.bincount(ia, weights=force_a[:, dim], minlength=len(p_pos))
+                           - np.bincount(ib, weights=force_b[:, dim], minlength=len(p_pos)))
+    p_force[~movable] = 0.0
+    return p_force.reshape(shape)
+
+
+def integrate_states(p_pos, p_vel, p_force, mass, max_speed, movable, damping, dt):
+    """ Integrates the velocities and positions of the movable entities in place ( same layout as `contact_forces`)"""
+    vel = p_vel[movable] * (1 - damping)
+    vel += (p_force[movable] / mass[movable][:, None]) * dt
+    speed = np.sqrt(np.sum(np.square(vel), axis=1))
+    max_speed = max_speed[movable]
+    too_fast = speed > max_speed  # False without a max speed ( nan)
+    vel[too_fast] = vel[too_fast] / speed[too_fast, None] * max_speed[too_fast, None]
+    p_vel[movable] = vel
+    p_pos[movable] += vel * dt
+
+
+# multi-agent world with the physics computed on arrays of all entities
+class VectorizedWorld(World):
+    """
+    World keeping the positions and velocities of all entities in contiguous (n_entities, dim_p) arrays ( struct of
+    arrays), with sizes, masses, max speeds and movable/collide flags alongside. Contact forces of all pairs, damping,
+    max speed clipping and integration are NumPy array operations, instead of loops over the entities.
+
+    `entity.state.p_pos` and `entity.state.p_vel` are row views of the arrays, hence scenarios read and write them as
+    usual; states replaced by a scenario ( e.g. in `reset_world`) are gathered again on the next step.
+    """
+
+    def __init__(self):
+        super(VectorizedWorld, self).__init__()
+        self._entities = None
+        self._entities_key = None
+        self.p_pos = None
+        self.p_vel = None
+        self._state_views = None
+
+    @classmethod
+    def from_world(cls, world):
+        """ Returns a vectorized world with the entities and settings of `world` ( e.g. made by a scenario)"""
+        vectorized_world = cls()
+        vectorized_world.__dict__.update(world.__dict__)
+        return vectorized_world
+
+    # return all entities in the world, rebuilt only when the agents or landmarks change
+    @property
+    def entities(self):
+        key = (id(self.agents), len(self.agents), id(self.landmarks), len(self.landmarks))
+        if key != self._entities_key:
+            self._entities_key = key
+            self._entities = self.agents + self.landmarks
+            self._state_views = None
+        return self._entities
+
+    def sync_states(self):
+        """ Gathers the entity states and properties into the arrays, unless the states are still views on them"""
+        entities = self.entities
+        if self._state_views is not None and all(entity.state.p_pos is p_pos and entity.state.p_vel is p_vel
+                                                 for entity, (p_pos, p_vel) in zip(entities, self._state_views)):
+            return
+
+        self.p_pos = np.array([entity.state.p_pos for entity in entities], dtype=float).reshape(-1, self.dim_p)
+        self.p_vel = np.array([entity.state.p_vel if entity.state.p_vel is not None else np.zeros(self.dim_p)
+                               for entity in entities], dtype=float).reshape(-1, self.dim_p)
+        for i, entity in enumerate(entities):
+            entity.state.p_pos = self.p_pos[i]
+            entity.state.p_vel = self.p_vel[i]
+        self._state_views = [(entity.state.p_pos, entity.state.p_vel) for entity in entities]
+
+        # properties are gathered along, as scenarios may change them on reset
+        self.size = np.array([entity.size for entity in entities], dtype=float)
+        self.mass = np.array([entity.mass for entity in entities], dtype=float)
+        self.max_speed = np.array([np.nan if entity.max_speed is None else entity.max_speed for entity in entities],
+                                  dtype=float)
+        self.movable = np.array([entity.movable for entity in entities], dtype=bool)
+        self.collide = np.array([entity.collide for entity in entities], dtype=bool)
+
+    def calculate_distances(self):
+        self.sync_states()
+        self.min_dists = self.size[:, None] + self.size[None, :]
+        np.fill_diagonal(self.min_dists, 0)
+        self.cached_dist_vect = self.p_pos[:, None, :] - self.p_pos[None, :, :]
+        self.cached_dist_mag = np.linalg.norm(self.cached_dist_vect, axis=2)
+        self.cached_collisions = (self.cached_dist_mag <= self.min_dists)
+
+    # update state of the world
+    def step(self):
+        # set actions for scripted agents
+        for agent in self.scripted_agents:
+            agent.action = agent.action_callback(agent, self)
+        self.sync_states()
+        # gather forces applied to entities
+        p_force = np.zeros_like(self.p_pos)
+        # apply agent physical controls
+        p_force = self.apply_action_force(p_force)
+        # apply environment forces
+        p_force = self.apply_environment_force(p_force)
+        # integrate physical state
+        self.integrate_state(p_force)
+        # update agent state
+        for agent in self.agents:
+            self.update_agent_state(agent)
+        # calculate and store distances between all entities
+        if self.cache_dists:
+            self.calculate_distances()
+
+    # gather physical forces acting on entities
+    def apply_environment_force(self, p_force):
+        p_force = p_force + contact_forces(self.p_pos, self.size, self.mass, self.movable, self.collide,
+                                           self.contact_force, self.contact_margin)
+        for a, entity_a in enumerate(self.entities):
+            if entity_a.movable:
+                for wall in self.walls:
+                    wf = self.get_wall_collision_force(entity_a, wall)
+                    if wf is not None:
+                        p_force[a] = p_force[a] + wf
+        return p_force
+
+    # integrate physical state
+    def integrate_state(self, p_force):
+        integrate_states(self.p_pos, self.p_vel, p_force, self.mass, self.max_speed, self.movable, self.damping,
+                         self.dt)
+
+
+# independent copies of a world, stepped at once
+class BatchedWorld(object):
+    """
+    Batch of independent worlds of the same scenario, whose physics is stepped at once on (n_worlds, n_entities,
+    dim_p) arrays. Settings ( dt, damping, ...) and the agent properties driving actions are the ones of the first
+    world.
+
+    Entity states ( `p_pos`, `p_vel`, `c`) and the actions of the policy agents ( `u`, `c`) are views of the
+    arrays, hence scenario callbacks on a single world work as usual; worlds whose states get replaced ( e.g. by a
+    scenario reset) have to be gathered again with `sync_states`.
+
+    `world_view` is a copy of the first world whose entity states and sizes are (n_worlds, ...) views of the arrays,
+    for the scenario hooks that take all worlds at once ( see multiagent.scenario.BaseScenario).
+    """
+
+    def __init__(self, worlds):
+        self.worlds = list(worlds)
+        world = self.worlds[0]
+        self.n_worlds = len(self.worlds)
+        self.dim_p = world.dim_p
+        self.dim_c = world.dim_c
+        self.dt = world.dt
+        self.damping = world.damping
+        self.contact_force = world.contact_force
+        self.contact_margin = world.contact_margin
+        self.cache_dists = world.cache_dists
+        self.walls = world.walls
+
+        # the entity list of every world is fixed, agents come first
+        self.entities = [world.entities for world in self.worlds]
+        self.agents = world.agents
+        self.n_agents = len(world.agents)
+        n_entities = len(self.entities[0])
+        self.accel = np.array([1.0 if agent.accel is None else agent.accel for agent in self.agents])
+
+        self.p_pos = np.zeros((self.n_worlds, n_entities, self.dim_p))
+        self.p_vel = np.zeros((self.n_worlds, n_entities, self.dim_p))
+        self.size = np.zeros((self.n_worlds, n_entities))
+        self.mass = np.ones((self.n_worlds, n_entities))
+        self.max_speed = np.full((self.n_worlds, n_entities), np.nan)
+        self.movable = np.zeros((self.n_worlds, n_entities), dtype=bool)
+        self.collide = np.zeros((self.n_worlds, n_entities), dtype=bool)
+        self.action_u = np.zeros((self.n_worlds, self.n_agents, self.dim_p))
+        self.action_c = np.zeros((self.n_worlds, self.n_agents, self.dim_c))
+        self.state_c = np.zeros((self.n_worlds, self.n_agents, self.dim_c))
+        for b, world in enumerate(self.worlds):
+            for i, agent in enumerate(world.agents):
+                agent.action.u = self.action_u[b, i]
+                agent.action.c = self.action_c[b, i]
+        self.sync_states(range(self.n_worlds))
+        self.world_view = self._make_world_view()
+
+    def sync_states(self, indices):
+        """ Gathers the entity states and properties of the given worlds into the arrays, and makes them views"""
+        for b in indices:
+            for i, entity in enumerate(self.entities[b]):
+                self.p_pos[b, i] = entity.state.p_pos
+                self.p_vel[b, i] = 0.0 if entity.state.p_vel is None else entity.state.p_vel
+                entity.state.p_pos = self.p_pos[b, i]
+                entity.state.p_vel = self.p_vel[b, i]
+                self.size[b, i] = entity.size
+                self.mass[b, i] = entity.mass
+                self.max_speed[b, i] = np.nan if entity.max_speed is None else entity.max_speed
+                self.movable[b, i] = entity.movable
+                self.collide[b, i] = entity.collide
+            for i, agent in enumerate(self.worlds[b].agents):
+                self.state_c[b, i] = 0.0 if agent.state.c is None else agent.state.c
+                agent.state.c = self.state_c[b, i]
+
+    def _make_world_view(self):
+        world = self.worlds[0]
+        entity_views = {}
+        for i, entity in enumerate(self.entities[0]):
+            entity_view = copy.copy(entity)
+            entity_view.state = copy.copy(entity.state)
+            entity_view.state.p_pos = self.p_pos[:, i]
+            entity_view.state.p_vel = self.p_vel[:, i]
+            entity_view.size = self.size[:, i]
+            if i < self.n_agents:
+                entity_view.state.c = self.state_c[:, i]
+            entity_views[id(entity)] = entity_view
+        # entity lists of the scenario ( agents, landmarks, food, ...) hold the views instead
+        world_view = copy.copy(world)
+        for name, value in vars(world).items():
+            if isinstance(value, list) and value and all(id(entity) in entity_views for entity in value):
+                setattr(world_view, name, [entity_views[id(entity)] for entity in value])
+        return world_view
+
+    def calculate_distances(self):
+        min_dists = self.size[:, :, None] + self.size[:, None, :]
+        min_dists[:, np.arange(min_dists.shape[1]), np.arange(min_dists.shape[1])] = 0
+        dist_vect = self.p_pos[:, :, None, :] - self.p_pos[:, None, :, :]
+        dist_mag = np.linalg.norm(dist_vect, axis=3)
+        collisions = dist_mag <= min_dists
+        for b, world in enumerate(self.worlds):
+            world.min_dists = min_dists[b]
+            world.cached_dist_vect = dist_vect[b]
+            world.cached_dist_mag = dist_mag[b]
+            world.cached_collisions = collisions[b]
+
+    # update state of all worlds
+    def step(self):
+        # set actions for scripted agents
+        for b, world in enumerate(self.worlds):
+            for agent in world.scripted_agents:
+                agent.action = agent.action_callback(agent, world)
+                i = world.agents.index(agent)
+                self.action_u[b, i] = agent.action.u
+                self.action_c[b, i] = agent.action.c
+        # apply agent physical controls
+        n_agents = self.n_agents
+        p_force = np.zeros_like(self.p_pos)
+        p_force[:, :n_agents] = (self.mass[:, :n_agents] * self.accel)[:, :, None] * self.action_u
+        for i, agent in enumerate(self.agents):
+            if agent.u_noise:
+                p_force[:, i] += np.random.randn(self.n_worlds, self.dim_p) * agent.u_noise
+        p_force[:, :n_agents] *= self.movable[:, :n_agents, None]
+        # apply environment forces
+        p_force += contact_forces(self.p_pos, self.size, self.mass, self.movable, self.collide, self.contact_force,
+                                  self.contact_margin)
+        for b, world in enumerate(self.worlds):
+            for a, entity_a in enumerate(self.entities[b]):
+                if entity_a.movable:
+                    for wall in self.walls:
+                        wf = world.get_wall_collision_force(entity_a, wall)
+                        if wf is not None:
+                            p_force[b, a] += wf
+        # integrate physical state
+        integrate_states(self.p_pos, self.p_vel, p_force, self.mass, self.max_speed, self.movable, self.damping,
+                         self.dt)
+        # update agent state ( communication)
+        for i, agent in enumerate(self.agents):
+            if agent.silent:
+                self.state_c[:, i] = 0.0
+            else:
+                noise = np.random.randn(self.n_worlds, self.dim_c) * agent.c_noise if agent.c_noise else 0.0
+                self.state_c[:, i] = self.action_c[:, i] + noise
+        # calculate and store distances between all entities
+        if self.cache_dists:
+            self.calculate_distances()
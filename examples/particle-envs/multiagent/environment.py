@@ -13,7 +13,8 @@ class MultiAgentEnv(gym.Env):
     def __init__(self, world, reset_callback=None, reward_callback=None,
                  observation_callback=None, info_callback=None,
                  done_callback=None, post_step_callback=None,
-                 shared_viewer=True, discrete_action=True):
+                 shared_viewer=True, discrete_action=True, rewards_callback=None,
+                 observations_callback=None):
 
         self.world = world
         self.agents = self.world.policy_agents
@@ -22,7 +23,11 @@ class MultiAgentEnv(gym.Env):
         # scenario callbacks
         self.reset_callback = reset_callback
         self.reward_callback = reward_callback
+        # rewards of all agents at once, preferred over reward_callback
+        self.rewards_callback = rewards_callback
         self.observation_callback = observation_callback
+        # observations of all agents at once, preferred over observation_callback
+        self.observations_callback = observations_callback
         self.info_callback = info_callback
         self.done_callback = done_callback
         self.post_step_callback = post_step_callback
@@ -83,8 +88,6 @@ class MultiAgentEnv(gym.Env):
 
 
     def step(self, action_n):
-        obs_n = []
-        reward_n = []
         done_n = []
         info_n = {'n': []}
         self.agents = self.world.policy_agents
@@ -93,13 +96,13 @@ class MultiAgentEnv(gym.Env):
             self._set_action(action_n[i], agent, self.action_space[i])
         # advance world state
         self.world.step()
-        # record observation for each agent
+        # record done and info for each agent, observations and rewards of all agents
         for agent in self.agents:
-            obs_n.append(self._get_obs(agent))
-            reward_n.append(self._get_reward(agent))
             done_n.append(self._get_done(agent))
 
             info_n['n'].append(self._get_info(agent))
+        obs_n = self._get_observations()
+        reward_n = self._get_rewards()
 
         # all agents get total reward in cooperative case
         reward = np.sum(reward_n)
@@ -115,11 +118,8 @@ class MultiAgentEnv(gym.Env):
         # reset renderer
         self._reset_render()
         # record observations for each agent
-        obs_n = []
         self.agents = self.world.policy_agents
-        for agent in self.agents:
-            obs_n.append(self._get_obs(agent))
-        return obs_n
+        return self._get_observations()
 
     # get info used for benchmarking
     def _get_info(self, agent):
@@ -127,6 +127,15 @@ class MultiAgentEnv(gym.Env):
             return {}
         return self.info_callback(agent, self.world)
 
+    # get observations for all policy agents
+    def _get_observations(self):
+        if self.observations_callback is None:
+            return [self._get_obs(agent) for agent in self.agents]
+        obs_n = self.observations_callback(self.world)
+        if len(self.agents) == len(self.world.agents):
+            return obs_n
+        return [obs_n[i] for i, agent in enumerate(self.world.agents) if agent.action_callback is None]
+
     # get observation for a particular agent
     def _get_obs(self, agent):
         if self.observation_callback is None:
@@ -140,6 +149,13 @@ class MultiAgentEnv(gym.Env):
             return False
         return self.done_callback(agent, self.world)
 
+    # get rewards for all policy agents
+    def _get_rewards(self):
+        if self.rewards_callback is None:
+            return [self._get_reward(agent) for agent in self.agents]
+        rewards = self.rewards_callback(self.world)
+        return [rewards[i] for i, agent in enumerate(self.world.agents) if agent.action_callback is None]
+
     # get reward for a particular agent
     def _get_reward(self, agent):
         if self.reward_callback is None:
@@ -340,17 +356,37 @@ class MultiAgentEnv(gym.Env):
 # vectorized wrapper for a batch of multi-agent environments
 # assumes all environments have the same observation and action space
 class BatchMultiAgentEnv(gym.Env):
+    """
+    Batch of independent environments of the same scenario, stepped at once: the physics of all worlds runs on
+    (n_envs, n_entities, dim_p) arrays ( see multiagent.core.BatchedWorld), and environments whose episode is over
+    are reset automatically.
+
+    Actions are given as a list over agents of (n_envs, action_size) arrays; observations are returned alike, while
+    rewards and dones are (n_envs, n_agents) arrays. Scenarios with `batched_hooks` compute the rewards and
+    observations of all worlds at once ( see multiagent.scenario.BaseScenario), others once per world.
+    """
     metadata = {
         'runtime.vectorized': True,
         'render.modes' : ['human', 'rgb_array']
     }
 
-    def __init__(self, env_batch):
+    def __init__(self, env_batch, episode_len=None):
+        from multiagent.core import BatchedWorld
+
         self.env_batch = env_batch
+        self.episode_len = episode_len
+        self.world = BatchedWorld([env.world for env in env_batch])
+        self.num_envs = len(env_batch)
+        env = env_batch[0]
+        self.agents = env.agents
+        self.agent_index = [env.world.agents.index(agent) for agent in env.agents]
+        self.steps = np.zeros(self.num_envs, dtype=int)
+        scenario = getattr(env.rewards_callback, '__self__', None)
+        self.batched_hooks = getattr(scenario, 'batched_hooks', False)
 
     @property
     def n(self):
-        return np.sum([env.n for env in self.env_batch])
+        return self.env_batch[0].n
 
     @property
     def action_space(self):
@@ -360,26 +396,105 @@ class BatchMultiAgentEnv(gym.Env):
     def observation_space(self):
         return self.env_batch[0].observation_space
 
-    def _step(self, action_n, time):
-        obs_n = []
-        reward_n = []
-        done_n = []
+    def step(self, action_n):
+        self._set_actions(action_n)
+        # advance the state of all worlds
+        self.world.step()
+        self.steps += 1
+        obs_n = self._get_obs(range(self.num_envs))
+        reward_n = self._get_rewards()
+        done_n = np.zeros((self.num_envs, self.n), dtype=bool)
         info_n = {'n': []}
-        i = 0
-        for env in self.env_batch:
-            obs, reward, done, _ = env.step(action_n[i:(i+env.n)], time)
-            i += env.n
-            obs_n += obs
-            # reward = [r / len(self.env_batch) for r in reward]
-            reward_n += reward
-            done_n += done
+        for b, env in enumerate(self.env_batch):
+            if env.done_callback is not None:
+                done_n[b] = [env._get_done(agent) for agent in env.agents]
+            info_n['n'].append([env._get_info(agent) for agent in env.agents])
+            if env.post_step_callback is not None:
+                env.post_step_callback(env.world)
+
+        # all agents get total reward in cooperative case
+        if self.env_batch[0].shared_reward:
+            reward_n[:] = reward_n.sum(axis=1, keepdims=True)
+
+        # reset the finished environments, keeping the last observation of their episode
+        finished = done_n.all(axis=1)
+        if self.episode_len is not None:
+            finished |= self.steps >= self.episode_len
+        indices = np.flatnonzero(finished)
+        info_n['reset'] = indices
+        info_n['terminal_obs'] = [obs[indices] for obs in obs_n]
+        if len(indices) > 0:
+            reset_obs = self._reset(indices)
+            for obs, reset in zip(obs_n, reset_obs):
+                obs[indices] = reset
         return obs_n, reward_n, done_n, info_n
 
-    def _reset(self):
-        obs_n = []
-        for env in self.env_batch:
-            obs_n += env.reset()
-        return obs_n
+    def reset(self):
+        return self._reset(range(self.num_envs))
+
+    def _reset(self, indices):
+        for b in indices:
+            # as MultiAgentEnv.reset, whose observations are built below for all worlds at once
+            env = self.env_batch[b]
+            env.reset_callback(env.world)
+            env._reset_render()
+        # scenario resets replace the entity states, gather them into the arrays again
+        self.world.sync_states(indices)
+        self.steps[indices] = 0
+        return self._get_obs(indices)
+
+    # get observations of the policy agents, as a list over agents of (len(indices), obs_dim) arrays
+    def _get_obs(self, indices):
+        if not self.batched_hooks:
+            obs = [self.env_batch[b]._get_observations() for b in indices]
+            return [np.array([env_obs[i] for env_obs in obs], dtype=np.float32).reshape(len(indices), -1)
+                    for i in range(self.n)]
+        obs_n = self.env_batch[0].observations_callback(self.world.world_view)
+        if isinstance(obs_n, np.ndarray):
+            return [obs_n[indices, i] for i in self.agent_index]
+        return [obs_n[i][indices] for i in self.agent_index]
+
+    # get rewards of the policy agents, as a (n_envs, n_agents) array
+    def _get_rewards(self):
+        if not self.batched_hooks:
+            return np.array([env._get_rewards() for env in self.env_batch], dtype=float).reshape(self.num_envs, -1)
+        return self.env_batch[0].rewards_callback(self.world.world_view)[:, self.agent_index]
+
+    # set env actions of every agent, in all environments at once ( see MultiAgentEnv._set_action)
+    def _set_actions(self, action_n):
+        env = self.env_batch[0]
+        for i, agent in enumerate(self.agents):
+            action = np.asarray(action_n[i], dtype=float).reshape(self.num_envs, -1)
+            action_space = self.action_space[i]
+            if isinstance(action_space, spaces.MultiDiscrete):
+                size = action_space.high - action_space.low + 1
+                action = np.split(action, np.cumsum(size)[:-1], axis=1)
+            else:
+                action = [action]
+
+            index = self.agent_index[i]
+            u = self.world.action_u[:, index]
+            c = self.world.action_c[:, index]
+            u[:] = 0.0
+            c[:] = 0.0
+            if agent.movable:
+                # physical action
+                physical = action[0]
+                if env.force_discrete_action:
+                    physical = np.eye(physical.shape[1])[physical.argmax(axis=1)]
+                if env.discrete_action_space:
+                    u[:, 0] = physical[:, 1] - physical[:, 2]
+                    u[:, 1] = physical[:, 3] - physical[:, 4]
+                else:
+                    u[:] = physical
+                u *= 5.0 if agent.accel is None else agent.accel
+                action = action[1:]
+            if not agent.silent:
+                # communication action
+                c[:] = action[0]
+                action = action[1:]
+            # make sure we used all elements of action
+            assert len(action) == 0
 
     # render environment
     def _render(self, mode='human', close=True):
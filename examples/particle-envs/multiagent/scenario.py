@@ -8,3 +8,63 @@ class BaseScenario(object):
     # create initial conditions of the world
     def reset_world(self, world):
         raise NotImplementedError()
+    # optionally, `rewards(world)` returns the rewards of all agents ( world.agents) at once as an array, and is then
+    # used by the environment instead of `reward(agent, world)`; likewise `observations(world)` returns the
+    # observations of all agents, as a (n_agents, obs_dim) float32 array ( or a list of arrays if their sizes differ)
+    # hooks written over leading batch axes of the states and sizes ( see the helpers below) set `batched_hooks`, then
+    # BatchMultiAgentEnv calls them once for all its worlds ( see multiagent.core.BatchedWorld.world_view)
+    batched_hooks = False
+
+
+def _stack(values, n_entities):
+    """ Stacks per-entity (dim,) or batched (n_worlds, dim) values along the entity axis, after the batch axis"""
+    x = np.array(values, dtype=float)
+    return np.moveaxis(x, 0, -2) if x.ndim > 2 else x.reshape(n_entities, -1)
+
+
+def positions(entities):
+    """ Positions of the entities as a (n_entities, dim_p) array ( or (n_worlds, n_entities, dim_p) when batched)"""
+    return _stack([entity.state.p_pos for entity in entities], len(entities))
+
+
+def velocities(entities):
+    """ Velocities of the entities as a (n_entities, dim_p) array ( or (n_worlds, n_entities, dim_p) when batched)"""
+    return _stack([entity.state.p_vel for entity in entities], len(entities))
+
+
+def communications(agents):
+    """ Communication states of the agents as a (n_agents, dim_c) array ( or (n_worlds, n_agents, dim_c) when
+    batched)"""
+    return _stack([agent.state.c for agent in agents], len(agents))
+
+
+def sizes(entities):
+    """ Sizes of the entities as a (n_entities,) array ( or (n_worlds, n_entities) when batched)"""
+    return np.moveaxis(np.array([entity.size for entity in entities], dtype=float), 0, -1)
+
+
+def distances(pos_a, pos_b):
+    """ Distances between all positions of `pos_a` (..., n_a, dim_p) and `pos_b` (..., n_b, dim_p), as a
+    (..., n_a, n_b) array"""
+    return np.sqrt(np.sum(np.square(pos_a[..., :, None, :] - pos_b[..., None, :, :]), axis=-1))
+
+
+def collisions(entities_a, entities_b, dists):
+    """ Collisions between all entities of `entities_a` and `entities_b` given their `distances`, as in the
+    `is_collision` of the scenarios"""
+    return dists < sizes(entities_a)[..., :, None] + sizes(entities_b)[..., None, :]
+
+
+def relative_positions(pos, other_pos):
+    """ Positions of `other_pos` (..., n_b, dim_p) in the reference frame of every position of `pos` (..., n_a,
+    dim_p), as a (..., n_a, n_b, dim_p) array"""
+    return other_pos[..., None, :, :] - pos[..., :, None, :]
+
+
+def others(x, batch_shape=()):
+    """ Drops the entries of the agents themselves from per-pair values (*batch_shape, n_agents, n_agents, ...),
+    i.e. returns the values of all other agents for every agent, as a (*batch_shape, n_agents, (n_agents - 1) *
+    ...) array"""
+    n_agents = x.shape[len(batch_shape)]
+    index = (slice(None),) * len(batch_shape) + (~np.eye(n_agents, dtype=bool),)
+    return x[index].reshape(tuple(batch_shape) + (n_agents, -1))
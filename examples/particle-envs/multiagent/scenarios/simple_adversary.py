@@ -1,6 +1,6 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, positions, relative_positions, others
 import random
 
 
@@ -119,6 +119,14 @@ class Scenario(BaseScenario):
             return adv_rew
 
 
+    def rewards(self, world):
+        # same as `reward` for all agents, from the distances of all agents to their goal
+        adversary = np.array([agent.adversary for agent in world.agents])
+        goal_pos = positions([agent.goal_a for agent in world.agents])
+        goal_dists = np.sqrt(np.sum(np.square(positions(world.agents) - goal_pos), axis=1))
+        agent_rew = -goal_dists[~adversary].min() + goal_dists[adversary].sum()
+        return np.where(adversary, -np.square(goal_dists), agent_rew)
+
     def observation(self, agent, world):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
@@ -138,3 +146,14 @@ class Scenario(BaseScenario):
             return np.concatenate([agent.goal_a.state.p_pos - agent.state.p_pos] + entity_pos + other_pos)
         else:
             return np.concatenate(entity_pos + other_pos)
+
+    def observations(self, world):
+        # same as `observation` for all agents; good agents also observe their goal, hence a list
+        n_agents = len(world.agents)
+        adversary = np.array([agent.adversary for agent in world.agents])
+        agent_pos = positions(world.agents)
+        entity_pos = relative_positions(agent_pos, positions(world.landmarks)).reshape(n_agents, -1)
+        other_pos = others(relative_positions(agent_pos, agent_pos))
+        goal_pos = positions([agent.goal_a for agent in world.agents]) - agent_pos
+        obs = np.concatenate([goal_pos, entity_pos, other_pos], axis=1).astype(np.float32)
+        return [obs[i, goal_pos.shape[1]:] if adversary[i] else obs[i] for i in range(n_agents)]
@@ -1,15 +1,17 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, positions, velocities, distances, collisions
+from multiagent.scenario import relative_positions, others, communications
 
 
 class Scenario(BaseScenario):
-    def make_world(self):
+    # rewards and observations also take all worlds of a BatchMultiAgentEnv at once
+    batched_hooks = True
+
+    def make_world(self, num_agents=3, num_landmarks=3):
         world = World()
         # set any world properties first
         world.dim_c = 2
-        num_agents = 3  # was 3
-        num_landmarks = 3  # was 3
         # add agents
         world.agents = [Agent() for i in range(num_agents)]
         for i, agent in enumerate(world.agents):
@@ -82,6 +84,15 @@ class Scenario(BaseScenario):
                     rew -= 1
         return rew
 
+    def rewards(self, world):
+        # same as `reward` for all agents, from the distances between all entities
+        agent_pos = positions(world.agents)
+        rew = -distances(agent_pos, positions(world.landmarks)).min(axis=-2).sum(axis=-1)
+        # collisions count the agent itself, as in `reward`
+        n_collisions = collisions(world.agents, world.agents, distances(agent_pos, agent_pos)).sum(axis=-1)
+        collide = np.array([agent.collide for agent in world.agents])
+        return rew[..., None] - n_collisions * collide
+
     def observation(self, agent, world):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
@@ -99,3 +110,16 @@ class Scenario(BaseScenario):
             comm.append(other.state.c)
             other_pos.append(other.state.p_pos - agent.state.p_pos)
         return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + comm)
+
+    def observations(self, world):
+        # same as `observation` for all agents, as a (n_agents, obs_dim) array
+        n_agents = len(world.agents)
+        agent_pos = positions(world.agents)
+        batch_shape = agent_pos.shape[:-2]
+        entity_pos = relative_positions(agent_pos, positions(world.landmarks)).reshape(batch_shape + (n_agents, -1))
+        other_pos = others(relative_positions(agent_pos, agent_pos), batch_shape)
+        comm = communications(world.agents)
+        other_comm = others(np.broadcast_to(comm[..., None, :, :], batch_shape + (n_agents,) + comm.shape[-2:]),
+                            batch_shape)
+        return np.concatenate([velocities(world.agents), agent_pos, entity_pos, other_pos, other_comm],
+                              axis=-1).astype(np.float32)
@@ -1,17 +1,18 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, positions, velocities, distances, collisions
+from multiagent.scenario import relative_positions, others
 
 
 class Scenario(BaseScenario):
-    def make_world(self):
+    # rewards and observations also take all worlds of a BatchMultiAgentEnv at once
+    batched_hooks = True
+
+    def make_world(self, num_good_agents=1, num_adversaries=3, num_landmarks=2):
         world = World()
         # set any world properties first
         world.dim_c = 2
-        num_good_agents = 1
-        num_adversaries = 3
         num_agents = num_adversaries + num_good_agents
-        num_landmarks = 2
         # add agents
         world.agents = [Agent() for i in range(num_agents)]
         for i, agent in enumerate(world.agents):
@@ -128,6 +129,31 @@ class Scenario(BaseScenario):
                         rew += 10
         return rew
 
+    def rewards(self, world):
+        # same as `reward` for all agents, from the distances between all agents
+        adversary = np.array([agent.adversary for agent in world.agents])
+        collide = np.array([agent.collide for agent in world.agents])
+        agent_pos = positions(world.agents)
+        dists = distances(agent_pos, agent_pos)
+        caught = collisions(world.agents, world.agents, dists) & adversary[:, None] & ~adversary[None, :]
+        rew = np.zeros(dists.shape[:-1])
+
+        # agents: shaped by the distance to the adversaries, penalized when caught and for exiting the screen
+        rew += np.where(adversary, 0, 0.1 * dists[..., adversary].sum(axis=-1))
+        rew -= np.where(adversary, 0, 10 * caught.sum(axis=-2) * collide)
+        x = np.abs(agent_pos)
+        with np.errstate(over='ignore'):
+            bound = np.where(x < 0.9, 0, np.where(x < 1.0, (x - 0.9) * 10, np.minimum(np.exp(2 * x - 2), 10)))
+        rew -= np.where(adversary, 0, bound.sum(axis=-1))
+
+        # adversaries: shaped by the distances of all adversaries to the closest agent, rewarded for all catches
+        if adversary.any():
+            closest = dists[..., adversary, :][..., ~adversary].min(axis=-1).sum(axis=-1)
+            n_caught = caught.sum(axis=(-2, -1))
+            adversary_rew = -0.1 * closest[..., None] + 10 * n_caught[..., None] * collide
+            rew = np.where(adversary, adversary_rew, rew)
+        return rew
+
     def observation(self, agent, world):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
@@ -145,3 +171,32 @@ class Scenario(BaseScenario):
             if not other.adversary:
                 other_vel.append(other.state.p_vel)
         return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel)
+
+    def observations(self, world):
+        # same as `observation` for all agents; adversaries observe the velocity of one more agent, hence a list
+        n_agents = len(world.agents)
+        adversary = np.array([agent.adversary for agent in world.agents])
+        agent_pos = positions(world.agents)
+        agent_vel = velocities(world.agents)
+        batch_shape = agent_pos.shape[:-2]
+        landmarks = [entity for entity in world.landmarks if not entity.boundary]
+        entity_pos = relative_positions(agent_pos, positions(landmarks)).reshape(batch_shape + (n_agents, -1))
+        other_pos = others(relative_positions(agent_pos, agent_pos), batch_shape)
+        obs = np.concatenate([agent_vel, agent_pos, entity_pos, other_pos], axis=-1)
+
+        # velocities of the other good agents: all of them for adversaries
+        n_adversaries = adversary.sum()
+        good_vel = agent_vel[..., ~adversary, :]
+        all_good_vel = good_vel.reshape(batch_shape + (1, -1))
+        adversary_obs = np.concatenate([obs[..., adversary, :], np.broadcast_to(
+            all_good_vel, batch_shape + (n_adversaries, all_good_vel.shape[-1]))], axis=-1)
+        n_good = good_vel.shape[-2]
+        good_vel_pairs = np.broadcast_to(good_vel[..., None, :, :], batch_shape + (n_good,) + good_vel.shape[-2:])
+        other_good_vel = others(good_vel_pairs, batch_shape)
+        good_obs = np.concatenate([obs[..., ~adversary, :], other_good_vel], axis=-1)
+        obs_n = [None] * n_agents
+        for k, i in enumerate(np.flatnonzero(adversary)):
+            obs_n[i] = adversary_obs[..., k, :].astype(np.float32)
+        for k, i in enumerate(np.flatnonzero(~adversary)):
+            obs_n[i] = good_obs[..., k, :].astype(np.float32)
+        return obs_n
@@ -1,9 +1,13 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, positions, velocities, distances, collisions
+from multiagent.scenario import relative_positions, others
 
 
 class Scenario(BaseScenario):
+    # rewards and observations also take all worlds of a BatchMultiAgentEnv at once
+    batched_hooks = True
+
     def make_world(self):
         world = World()
         # set any world properties first
@@ -200,6 +204,70 @@ class Scenario(BaseScenario):
         return rew
 
 
+    def rewards(self, world):
+        # same as `reward` for all agents, from the distances between all agents and food
+        adversary = np.array([agent.adversary for agent in world.agents])
+        collide = np.array([agent.collide for agent in world.agents])
+        agent_pos = positions(world.agents)
+        dists = distances(agent_pos, agent_pos)
+        caught = collisions(world.agents, world.agents, dists) & adversary[:, None] & ~adversary[None, :]
+        rew = np.zeros(dists.shape[:-1])
+
+        # agents: penalized when caught and for exiting the screen, rewarded for food
+        rew -= np.where(adversary, 0, 5 * caught.sum(axis=-2) * collide)
+        x = np.abs(agent_pos)
+        with np.errstate(over='ignore'):
+            bound = np.where(x < 0.9, 0, np.where(x < 1.0, (x - 0.9) * 10, np.minimum(np.exp(2 * x - 2), 10)))
+        rew -= np.where(adversary, 0, 2 * bound.sum(axis=-1))
+        food_dists = distances(agent_pos, positions(world.food))
+        rew += np.where(adversary, 0, 2 * collisions(world.agents, world.food, food_dists).sum(axis=-1))
+        rew += np.where(adversary, 0, 0.05 * food_dists.min(axis=-1))
+
+        # adversaries: shaped by the distance to the closest agent, rewarded for all catches
+        if adversary.any():
+            n_caught = caught.sum(axis=(-2, -1))
+            adversary_rew = -0.1 * dists[..., ~adversary].min(axis=-1) + 5 * n_caught[..., None] * collide
+            rew = np.where(adversary, adversary_rew, rew)
+        return rew
+
+    def observations(self, world):
+        # same as `observation` for all agents; adversaries also observe the leader's communication, hence a list
+        n_agents = len(world.agents)
+        adversary = np.array([agent.adversary for agent in world.agents])
+        leader = np.array([agent.leader for agent in world.agents])
+        agent_pos = positions(world.agents)
+        agent_vel = velocities(world.agents)
+        batch_shape = agent_pos.shape[:-2]
+        landmarks = [entity for entity in world.landmarks if not entity.boundary]
+        entity_pos = relative_positions(agent_pos, positions(landmarks)).reshape(batch_shape + (n_agents, -1))
+        in_forest = collisions(world.agents, world.forests, distances(agent_pos, positions(world.forests)))
+
+        # other agents are seen in the same forest or when both are out of the forests ( always by the leader)
+        outside = ~in_forest.any(axis=-1)
+        visible = (in_forest[..., :, None, :] & in_forest[..., None, :, :]).any(axis=-1)
+        visible |= outside[..., :, None] & outside[..., None, :]
+        visible |= leader[:, None]
+        other_pos = others(relative_positions(agent_pos, agent_pos) * visible[..., None], batch_shape)
+        other_vel = (agent_vel[..., None, :, :] * visible[..., None])[..., ~adversary, :]
+        forest_flags = np.where(in_forest, 1.0, -1.0)
+        obs = np.concatenate([agent_vel, agent_pos, entity_pos, other_pos], axis=-1)
+
+        # velocities of the other good agents: all of them for adversaries
+        n_adversaries = adversary.sum()
+        comm = world.agents[0].state.c
+        comm = np.broadcast_to(comm[..., None, :], batch_shape + (n_adversaries, comm.shape[-1]))
+        adversary_obs = np.concatenate([obs[..., adversary, :],
+                                        other_vel[..., adversary, :, :].reshape(batch_shape + (n_adversaries, -1)),
+                                        forest_flags[..., adversary, :], comm], axis=-1)
+        good_obs = np.concatenate([obs[..., ~adversary, :], forest_flags[..., ~adversary, :],
+                                   others(other_vel[..., ~adversary, :, :], batch_shape)], axis=-1)
+        obs_n = [None] * n_agents
+        for k, i in enumerate(np.flatnonzero(adversary)):
+            obs_n[i] = adversary_obs[..., k, :].astype(np.float32)
+        for k, i in enumerate(np.flatnonzero(~adversary)):
+            obs_n[i] = good_obs[..., k, :].astype(np.float32)
+        return obs_n
+
     def observation2(self, agent, world):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
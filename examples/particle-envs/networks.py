@@ -1,6 +1,8 @@
 import torch
 import torch.nn as nn
 
+from marl.utils import AgentBatchedLinear, AgentBatchedMLP, AgentSharedMLP, AgentBatchedNet
+
 
 class DDPGCritic(nn.Module):
     def __init__(self, obs_space_n, action_space_n):
@@ -92,6 +94,66 @@ class VDNet(nn.Module):
         return getattr(self, 'agent_{}'.format(i))
 
 
+# ****************************************************************
+# Agent-batched networks ( per-agent weights stacked, all agents evaluated at once)
+# ****************************************************************
+
+
+class BatchedDDPGCritic(nn.Module):
+    def __init__(self, n_agents, comb_obs_space, comb_action_space):
+        super().__init__()
+        self.n_agents = n_agents
+        self.obs_x = AgentBatchedLinear(n_agents, comb_obs_space, 1024)
+        self._critic = AgentBatchedMLP(n_agents, [comb_action_space + 1024, 512, 256, 128, 1],
+                                       activation=nn.LeakyReLU)
+
+        self._critic.layers[-1].weight.data.fill_(0)
+        self._critic.layers[-1].bias.data.fill_(0)
+
+    def forward(self, obs_n, action_n, agent=None):
+        x = torch.relu(self.obs_x(obs_n, agent=agent))
+        if agent is None and action_n.dim() == 2:  # the joint action is shared by the critics of all agents
+            action_n = action_n.unsqueeze(1).expand(-1, self.n_agents, -1)
+        return self._critic(torch.cat((action_n, x), dim=-1), agent=agent)
+
+
+class BatchedMADDPGNet(AgentBatchedNet):
+    def __init__(self, obs_space_n, action_space_n):
+        super().__init__([len(o) for o in obs_space_n], [a.n for a in action_space_n])
+
+        comb_obs_space = sum(len(o) for o in obs_space_n)
+        comb_action_space = sum(a.n for a in action_space_n)
+        self.actor = AgentBatchedMLP(self.n_agents, [self.obs_size, 128, 64, self.action_space],
+                                     activation=nn.LeakyReLU)
+        self.critic = BatchedDDPGCritic(self.n_agents, comb_obs_space, comb_action_space)
+
+
+class BatchedVDNet(AgentBatchedNet):
+    def __init__(self, obs_space_n, action_space_n):
+        super().__init__([len(o) for o in obs_space_n], [a.n for a in action_space_n])
+
+        self.layers = AgentBatchedMLP(self.n_agents, [self.obs_size, 128, 64, self.action_space])
+
+        self.layers.layers[-1].weight.data.fill_(0)
+        self.layers.layers[-1].bias.data.fill_(0)
+
+    def forward(self, x, agent=None):
+        return self.layers(x, agent=agent)
+
+
+class SharedVDNet(AgentBatchedNet):
+    def __init__(self, obs_space_n, action_space_n, agent_id='onehot'):
+        super().__init__([len(o) for o in obs_space_n], [a.n for a in action_space_n])
+
+        self.layers = AgentSharedMLP(self.n_agents, [self.obs_size, 128, 64, self.action_space], agent_id=agent_id)
+
+        self.layers.layers[-1].weight.data.fill_(0)
+        self.layers.layers[-1].bias.data.fill_(0)
+
+    def forward(self, x, agent=None):
+        return self.layers(x, agent=agent)
+
+
 class IQNet(nn.Module):
     def __init__(self, input, actions):
         super().__init__()
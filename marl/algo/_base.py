@@ -2,6 +2,7 @@ import os
 import torch
 from torch.utils.tensorboard import SummaryWriter
 import numpy as np
+from marl.utils import BatchPrefetcher, LinearDecay, RaggedLayout, CompiledPolicy
 # from ma_gym.wrappers import Monitor
 
 
@@ -41,8 +42,13 @@ class _Base:
         self.path = path
         self.best_model_path = os.path.join(self.path, 'model.p')
         self.last_model_path = os.path.join(self.path, 'last_model.p')
+        self.replay_path = os.path.join(self.path, 'replay_snapshot')
         self.writer = None
         self._step_iter = 0  # total environment steps
+        self._ep_iter = 0  # total training episodes
+        self.obs_layout = None  # RaggedLayout of the observations, set from the first ones
+        self.compiled_actions = False  # greedy actions from a TorchScript graph ( see `_compiled_actions`)
+        self._compiled = {}  # id(model) -> CompiledPolicy
 
     def save(self, path):
         """ save relevant properties in given path"""
@@ -58,6 +64,40 @@ class _Base:
         """
         path = self.best_model_path if path is None else path
         self.model.load_state_dict(torch.load(path))
+        self.refresh_compiled()
+
+    def save_replay(self, path=None):
+        """
+        Saves a snapshot of the replay memory ( contents, priorities, write position and beta schedule) along with
+        the training counters, so that `train()` can be resumed after `restore()` and `restore_replay()`.
+
+        Args:
+            path (optional) : snapshot directory
+        """
+        path = self.replay_path if path is None else path
+        self.memory.save(path)
+        counters = {'step_iter': self._step_iter, 'ep_iter': self._ep_iter}
+        exploration = getattr(self, 'exploration', None)
+        if isinstance(exploration, LinearDecay):
+            counters.update(exploration_episodes=exploration.curr_episodes, exploration_eps=exploration.eps)
+        np.savez(os.path.join(path, 'counters.npz'), **counters)
+
+    def restore_replay(self, path=None, mmap=True):
+        """
+        Restores the replay memory and training counters saved by `save_replay`
+
+        Args:
+            path (optional) : snapshot directory
+            mmap: if True, the replay contents are memory-mapped from the snapshot ( copy-on-write)
+        """
+        path = self.replay_path if path is None else path
+        with np.load(os.path.join(path, 'counters.npz')) as counters:
+            self._step_iter = int(counters['step_iter'])
+            self._ep_iter = int(counters['ep_iter'])
+            if 'exploration_episodes' in counters.files:
+                self.exploration.curr_episodes = int(counters['exploration_episodes'])
+                self.exploration.eps = float(counters['exploration_eps'])
+        self.memory.load(path, mmap)
 
     def __writer_close(self):
         self.writer.export_scalars_to_json(os.path.join(self.path, 'summary.json'))
@@ -67,6 +107,26 @@ class _Base:
     def close(self):
         """ It should be called after one is done with the usage"""
         self.env.close()
+        if isinstance(getattr(self, 'memory', None), BatchPrefetcher):
+            self.memory.close()
+
+    def _pack_obs(self, obs_n):
+        """ Returns the observations of all agents as a single float32 array ( see `RaggedLayout`)"""
+        if self.obs_layout is None:
+            self.obs_layout = RaggedLayout.from_obs(obs_n)
+        return self.obs_layout.pack(obs_n)
+
+    def refresh_compiled(self):
+        """ Traces the compiled policies again on their next call, e.g. after the model parameters were replaced"""
+        for policy in self._compiled.values():
+            policy.refresh()
+
+    def _compiled_actions(self, model, obs_n, action='argmax', head=None):
+        """ Returns the greedy actions of all agents of the model as one tensor ( see `CompiledPolicy`)"""
+        policy = self._compiled.get(id(model))
+        if policy is None:
+            policy = self._compiled[id(model)] = CompiledPolicy(model, self.obs_layout, action, head)
+        return policy(obs_n)
 
     def _select_action(self, model, obs_n, explore=False):
         """ selects epsilon greedy action for the state """
@@ -75,14 +135,22 @@ class _Base:
     def _train(self, test_interval):
         raise NotImplementedError
 
-    def train(self, test_interval=50):
+    def train(self, test_interval=50, save_replay=False):
+        """
+        Trains for the remaining training episodes ( all of them, unless resumed with `restore_replay`)
+
+        Args:
+            test_interval: no. of training episodes between tests
+            save_replay: if True, the last model and a replay snapshot are saved after every test
+        """
         self.writer = SummaryWriter(self.path, flush_secs=10)
 
         print('Training......')
         test_scores = []
         best_score = None
-        for ep in range(0, self.train_episodes, test_interval):
+        for ep in range(self._ep_iter, self.train_episodes, test_interval):
             train_score, train_loss = self._train(test_interval)  # run for 50 steps?
+            self._ep_iter = ep + test_interval
             test_score = self.test(5, log=True)  # test for 5 episodes?
             test_scores.append(test_score)
 
@@ -99,6 +167,9 @@ class _Base:
                                                                          train_loss,
                                                                          train_score,
                                                                          test_score))
+            if save_replay:
+                self.save(self.last_model_path)
+                self.save_replay()
         # keeping a copy of last trained model
         self.save(self.last_model_path)
         self.__writer_close()
@@ -121,7 +192,7 @@ class _Base:
                     if render:
                         env.render()
 
-                    torch_obs_n = torch.FloatTensor(np.array(obs_n)).to(self.device).unsqueeze(0)
+                    torch_obs_n = torch.from_numpy(self._pack_obs(obs_n)).to(self.device).unsqueeze(0)
                     action_n = self._select_action(self.model, torch_obs_n, explore=False)
 
                     # -------- amend action_n to one-hot form ---------
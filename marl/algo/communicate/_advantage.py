@@ -0,0 +1,40 @@
+import torch
+
+
+def reverse_discounted_sum(x, discount):
+    """ Reverse scan over the steps of `x` (T, ...): out[t] = x[t] + discount * out[t + 1], with out[T] = 0"""
+    out = torch.empty_like(x)
+    running = torch.zeros_like(x[0])
+    for step in reversed(range(len(x))):
+        running = discount * running + x[step]
+        out[step] = running
+    return out
+
+
+def actor_critic_losses(rewards, critic, log_probs, entropies, discount, gae_lambda, entropy_coef):
+    """
+    Critic and policy losses of an episode for all agents, each agent maximizing the team reward ( sum of the rewards
+    of all agents). Discounted returns and Generalized Advantage Estimates are computed by reverse scans over the
+    (T, n_agents) tensors, and the losses are summed over the steps of the episode.
+
+    Args:
+        rewards: (T, n_agents) rewards
+        critic: (T, n_agents) critic values ( the episode ends with a value of 0)
+        log_probs: (T, n_agents) log prob. of the taken actions
+        entropies: (T, n_agents) policy entropies
+        discount: discount factor ( aka gamma)
+        gae_lambda: lambda of the Generalized Advantage Estimation
+        entropy_coef: weight of the entropy bonus
+    Returns:
+        critic loss and policy loss of every agent, each shaped (n_agents,)
+    """
+    team_reward = rewards.sum(dim=1, keepdim=True)
+    with torch.no_grad():
+        returns = reverse_discounted_sum(team_reward, discount)
+        values = torch.cat((critic, torch.zeros_like(critic[:1])))
+        deltas = team_reward + (discount * values[1:] - values[:-1])
+        gae = reverse_discounted_sum(deltas, discount * gae_lambda)
+
+    critic_loss = (0.5 * (returns - critic).pow(2)).sum(dim=0)
+    policy_loss = -(log_probs * gae - entropy_coef * entropies).sum(dim=0)
+    return critic_loss, policy_loss
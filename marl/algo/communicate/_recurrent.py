@@ -0,0 +1,31 @@
+import math
+import torch
+
+
+def episode_thoughts(model, obs, truncate_n=None, hidden=None):
+    """
+    Recomputes the thoughts of all agents over an episode with the sequence API of the model ( `get_thoughts`),
+    equivalent to the per-step `get_thought` calls made while acting, with the recurrent state detached every
+    `truncate_n` steps. Truncated chunks of the episode are batched, hence the whole episode is a single
+    `get_thoughts` call.
+
+    Args:
+        model: network container with `get_thoughts`
+        obs: observations of the episode, shaped (T, n_agents, obs_size)
+        truncate_n: no. of steps between detaches of the recurrent state ( None for back-propagation through the
+            whole episode)
+        hidden: (hx, cx) at the first step of every truncated chunk ( i.e. steps 0, truncate_n, ...), each shaped
+            (n_chunks, n_agents, hidden_size); required with `truncate_n`
+    Returns:
+        thoughts shaped (T, n_agents, hidden_size)
+    """
+    steps = obs.shape[0]
+    if truncate_n is None:
+        return model.get_thoughts(obs.unsqueeze(1))[:, 0]
+
+    n_chunks = math.ceil(steps / truncate_n)
+    padding = obs.new_zeros((n_chunks * truncate_n - steps,) + obs.shape[1:])
+    obs = torch.cat((obs, padding)).view((n_chunks, truncate_n) + obs.shape[1:]).transpose(0, 1)
+    hidden = tuple(state.detach() for state in hidden)
+    thoughts = model.get_thoughts(obs, hidden).transpose(0, 1)
+    return thoughts.reshape((n_chunks * truncate_n,) + thoughts.shape[2:])[:steps]
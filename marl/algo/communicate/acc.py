@@ -5,6 +5,9 @@
 """
 import torch
 from .._base import _Base
+from ._recurrent import episode_thoughts
+from ._advantage import actor_critic_losses
+from .graph import agent_positions, knn_edges, batch_edges
 import numpy as np
 import torch.nn.functional as F
 from ma_gym.wrappers import Monitor
@@ -13,7 +16,7 @@ import os
 class ACC(_Base):
 
     def __init__(self, env_fn, model_fn, lr, discount, batch_size, device, mem_len, tau, train_episodes,
-                 episode_max_steps, path):
+                 episode_max_steps, path, comm_k=None):
         """
         Actor Critic With Communication of hidden state
 
@@ -30,6 +33,8 @@ class ACC(_Base):
             episode_max_steps: Max. number of steps to be executed in the environment
             path: Path to store results
             log_suffix: Running index for logging
+            comm_k: No. of nearest agents ( positions from the environment) each agent communicates with, over the
+                `communicate` layer of the model; every other agent, with concatenated hidden states, if None
         """
         super().__init__(env_fn, model_fn, lr, discount, batch_size, device, train_episodes, episode_max_steps, path)
         self.tau = tau
@@ -39,39 +44,28 @@ class ACC(_Base):
         self.critic_loss_coef = 0.5
         self.truncate_n = 1
         self.gae_lambda = 1
+        self.comm_k = comm_k
 
         self.n_trajectory_info = []
 
     def _update(self):
-        critic_loss = [0 for _ in range(self.model.n_agents)]
-        policy_loss = [0 for _ in range(self.model.n_agents)]
+        critic_loss, policy_loss = 0, 0
 
         for trajectory_info in self.n_trajectory_info:
-            obs, _rewards, _critic, _log_probs, _entropies = trajectory_info
+            _rewards = torch.FloatTensor(trajectory_info[1]).to(self.device)
+            _critic, _log_probs, _entropies = self._evaluate(*trajectory_info)
 
-            R = torch.zeros(1, 1).to(self.device)
-            gae = [torch.zeros(1, 1).to(self.device) for _ in range(self.model.n_agents)]
-            _critic.append([torch.zeros(1, 1).to(self.device) for _ in range(self.model.n_agents)])
-            for step in reversed(range(len(_rewards))):
-                step_reward = sum(_rewards[step])  # each agent maximizes team reward rather than local reward
-                R = self.discount * R + step_reward
-                for agent_i in range(self.model.n_agents):
-                    advantage = R - _critic[step][agent_i]
-                    critic_loss[agent_i] += 0.5 * advantage.pow(2)
+            # each agent maximizes team reward rather than local reward
+            _critic_loss, _policy_loss = actor_critic_losses(_rewards, _critic, _log_probs, _entropies, self.discount,
+                                                             self.gae_lambda, self.entropy_coef)
+            critic_loss = critic_loss + _critic_loss
+            policy_loss = policy_loss + _policy_loss
 
-                    # Generalized Advantage Estimation
-                    delta_t = step_reward
-                    delta_t += self.discount * _critic[step + 1][agent_i].data - _critic[step][agent_i].data
-                    gae[agent_i] = gae[agent_i] * self.discount * self.gae_lambda + delta_t
-
-                    policy_loss[agent_i] -= _log_probs[step][agent_i] * gae[agent_i].detach() - \
-                                            self.entropy_coef * _entropies[step][agent_i]
-
-        critic_loss = [c / self.batch_size for c in critic_loss]
-        policy_loss = [p / self.batch_size for p in policy_loss]
+        critic_loss = critic_loss / self.batch_size
+        policy_loss = policy_loss / self.batch_size
 
         self.optimizer.zero_grad()
-        loss = (sum(policy_loss) + self.critic_loss_coef * sum(critic_loss))
+        loss = (policy_loss.sum() + self.critic_loss_coef * critic_loss.sum())
         loss.backward()
         self.optimizer.step()
 
@@ -81,22 +75,72 @@ class ACC(_Base):
                                    self._step_iter)
             self.writer.add_scalar('agent_{}/critic_loss'.format(agent_i), critic_loss[agent_i].item(),
                                    self._step_iter)
-        self.writer.add_scalar('_overall/critic_loss', sum(critic_loss).item(),
+        self.writer.add_scalar('_overall/critic_loss', critic_loss.sum().item(),
                                self._step_iter)
-        self.writer.add_scalar('_overall/actor_loss', sum(policy_loss).item(),
+        self.writer.add_scalar('_overall/actor_loss', policy_loss.sum().item(),
                                self._step_iter)
         self.writer.add_scalar('_overall/loss', loss.item(),
                                self._step_iter)
 
         return loss.item()
 
+    def _edges(self):
+        """ Returns the neighbour graph of the current step ( None for full connectivity)"""
+        if self.comm_k is None:
+            return None
+        return knn_edges(agent_positions(self.env), self.comm_k).to(self.device)
+
+    def _communicate(self, thoughts, edges=None):
+        """
+        Returns the neighbour input of every agent: the hidden states of all other agents, or the messages
+        aggregated over the neighbour graphs of every step
+
+        Args:
+            thoughts: (n_agents, steps, hidden_size) hidden states
+            edges: list of the edge index of every step ( see `_edges`), None for full connectivity
+        """
+        n_agents = self.model.n_agents
+        if edges is None:
+            return [thoughts[[j for j in range(n_agents) if j != i]] for i in range(n_agents)]
+
+        nodes = thoughts.transpose(0, 1).flatten(0, 1)
+        messages = self.model.communicate(nodes, batch_edges(edges, n_agents))
+        messages = messages.view(thoughts.shape[1], n_agents, -1).transpose(0, 1)
+        return list(messages.unsqueeze(1).unbind(0))
+
+    def _evaluate(self, obs, rewards, actions, hidden, edges):
+        """
+        Recomputes the forward pass of an episode, with one LSTM pass over the whole episode ( see
+        `episode_thoughts`) and all steps of an agent evaluated at once
+
+        Returns:
+            critic, log prob. of the taken actions and entropy, each shaped (T, n_agents)
+        """
+        obs = torch.FloatTensor(obs).to(self.device)
+        actions = torch.LongTensor(actions).to(self.device)
+        hidden = tuple(torch.stack(state) for state in zip(*hidden)) if len(hidden) > 0 else None
+        thoughts = episode_thoughts(self.model, obs, self.truncate_n, hidden).transpose(0, 1)
+        neighbours_hx = self._communicate(thoughts, edges if len(edges) > 0 else None)
+
+        critic_info, log_probs, entropies = [], [], []
+        for agent_i in range(self.model.n_agents):
+            logits, critic = self.model.agent(agent_i)(neighbours_hx[agent_i], hx=thoughts[agent_i])
+            prob = F.softmax(logits, dim=1)
+            log_prob = F.log_softmax(logits, dim=1)
+
+            critic_info.append(critic)
+            log_probs.append(log_prob.gather(1, actions[:, agent_i].unsqueeze(1)))
+            entropies.append(-(log_prob * prob).sum(1, keepdim=True))
+
+        return tuple(torch.cat(x, dim=1) for x in (critic_info, log_probs, entropies))
+
     def _train(self, episodes):
 
         train_rewards = []
         train_loss = []
 
         for ep in range(episodes):
-            ep_log_probs, ep_rewards, ep_critic_info, ep_entropies, ep_obs = [], [], [], [], []
+            ep_rewards, ep_actions, ep_obs, ep_hidden, ep_edges = [], [], [], [], []
 
             terminal = False
             obs_n = self.env.reset()
@@ -106,32 +150,25 @@ class ACC(_Base):
             self.model.init_hidden(device=self.device)
             while not terminal:
                 ep_obs.append(obs_n)
+                if (self.truncate_n is not None) and (step % self.truncate_n == 0):
+                    ep_hidden.append(self.model.get_hidden())  # start of a truncated chunk
                 torch_obs_n = torch.FloatTensor(obs_n).to(self.device).unsqueeze(0)
 
-                thoughts = []
-                for agent_i in range(self.model.n_agents):
-                    thoughts.append(self.model.agent(agent_i).get_thought(torch_obs_n[:, agent_i]))
-                thoughts = torch.stack(thoughts)
-
-                action_n = []
-                log_probs, critic_info, entropies, = [], [], []
-                for agent_i in range(self.model.n_agents):
-                    # assuming every other agent is a neighbour as of now
-                    _neighbours = list(range(self.model.n_agents))
-                    _neighbours.remove(agent_i)
-
-                    logits, critic = self.model.agent(agent_i)(thoughts[_neighbours])
-                    prob = F.softmax(logits, dim=1)
-                    log_prob = F.log_softmax(logits, dim=1)
-                    entropy = -(log_prob * prob).sum(1)
-
-                    action = prob.multinomial(num_samples=1).detach()
-                    log_prob = log_prob.gather(1, action)
-                    action_n.append(action.item())
+                # acting only: the forward pass of the episode is recomputed at once by `_evaluate`
+                with torch.no_grad():
+                    thoughts = []
+                    for agent_i in range(self.model.n_agents):
+                        thoughts.append(self.model.agent(agent_i).get_thought(torch_obs_n[:, agent_i]))
+                    thoughts = torch.stack(thoughts)
+                    edges = self._edges()
+                    neighbours_hx = self._communicate(thoughts, None if edges is None else [edges])
 
-                    log_probs.append(log_prob)
-                    critic_info.append(critic)
-                    entropies.append(entropy)
+                    action_n = []
+                    for agent_i in range(self.model.n_agents):
+                        logits, critic = self.model.agent(agent_i)(neighbours_hx[agent_i])
+                        prob = F.softmax(logits, dim=1)
+                        action = prob.multinomial(num_samples=1)
+                        action_n.append(action.item())
 
                 next_obs_n, reward_n, done_n, info = self.env.step(action_n)
                 terminal = all(done_n) or step >= self.episode_max_steps
@@ -142,18 +179,15 @@ class ACC(_Base):
                 for i, r_n in enumerate(reward_n):
                     log_ep_reward[i] += r_n
 
-                ep_log_probs.append(log_probs)
-                ep_critic_info.append(critic_info)
-                ep_entropies.append(entropies)
+                ep_actions.append(action_n)
                 ep_rewards.append(reward_n)
-
-                if (self.truncate_n is not None) and (step % self.truncate_n == 0):
-                    self.model.hidden_detach()
+                if edges is not None:
+                    ep_edges.append(edges)
 
             train_rewards.append(log_ep_reward)
             self.__episode_iter += 1
 
-            self.n_trajectory_info.append((ep_obs, ep_rewards, ep_critic_info, ep_log_probs, ep_entropies))
+            self.n_trajectory_info.append((ep_obs, ep_rewards, ep_actions, ep_hidden, ep_edges))
             if self.__episode_iter % self.batch_size == 0:
                 train_loss.append(self._update())
                 self.n_trajectory_info = []  # empty the trajectory info
@@ -196,14 +230,12 @@ class ACC(_Base):
                     for agent_i in range(self.model.n_agents):
                         thoughts.append(self.model.agent(agent_i).get_thought(torch_obs_n[:, agent_i]))
                     thoughts = torch.stack(thoughts)
+                    edges = self._edges()
+                    neighbours_hx = self._communicate(thoughts, None if edges is None else [edges])
 
                     action_n = []
                     for agent_i in range(self.model.n_agents):
-                        # assuming every other agent is a neighbour as of now
-                        _neighbours = list(range(self.model.n_agents))
-                        _neighbours.remove(agent_i)
-
-                        logits, critic = self.model.agent(agent_i)(thoughts[_neighbours])
+                        logits, critic = self.model.agent(agent_i)(neighbours_hx[agent_i])
                         prob = F.softmax(logits, dim=1)
                         action = prob.argmax(1).item()
                         # action = prob.multinomial(num_samples=1).detach()
@@ -0,0 +1,97 @@
+"""
+    Sparse communication between agents over a neighbour graph.
+
+    A graph is an edge index, i.e. a (2, n_edges) long tensor of (source, target) agents: messages flow from the
+    source to the target. Aggregation is a scatter ( `index_add_`) of the messages into fixed-size per-agent slots,
+    hence the input width of the agent networks does not grow with the no. of agents.
+"""
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def agent_positions(env):
+    """
+    Returns the agent positions tracked by the environment, as a (n_agents, dim) float tensor
+
+    Supports the particle environments ( `world.agents`) and the ma_gym grid environments ( `agent_pos`).
+    """
+    env = getattr(env, 'unwrapped', env)
+    if hasattr(env, 'world'):
+        positions = [agent.state.p_pos for agent in env.world.agents]
+    elif hasattr(env, 'agent_pos'):
+        positions = [env.agent_pos[i] for i in range(len(env.agent_pos))]
+    else:
+        raise ValueError('{} does not track agent positions ( `world.agents` or `agent_pos`)'
+                         .format(type(env).__name__))
+    return torch.as_tensor(np.array(positions, dtype=np.float32))
+
+
+def full_edges(n_agents, device=None):
+    """ Edge index of the complete graph: every agent receives from every other agent"""
+    source, target = torch.meshgrid(torch.arange(n_agents, device=device), torch.arange(n_agents, device=device),
+                                    indexing='ij')
+    mask = source != target
+    return torch.stack((source[mask], target[mask]))
+
+
+def knn_edges(positions, k):
+    """
+    Edge index where every agent receives from its k nearest agents ( all other agents if there are fewer)
+
+    Args:
+        positions: (n_agents, dim) agent positions
+        k: no. of neighbours of every agent
+    Returns:
+        (2, n_agents * k) edge index, grouped by target agent
+    """
+    n_agents = len(positions)
+    k = min(k, n_agents - 1)
+    distances = torch.cdist(positions, positions)
+    distances.fill_diagonal_(float('inf'))
+    source = distances.topk(k, dim=1, largest=False).indices
+    target = torch.arange(n_agents, device=positions.device).unsqueeze(1).expand(-1, k)
+    return torch.stack((source.flatten(), target.flatten()))
+
+
+def batch_edges(edges, n_agents):
+    """
+    Joins the graphs of several steps ( or environments) into one over their (n_graphs * n_agents) nodes, so that
+    a single aggregation handles them all; node t * n_agents + i is agent i of graph t
+    """
+    offsets = [graph + t * n_agents for t, graph in enumerate(edges)]
+    return torch.cat(offsets, dim=1)
+
+
+class NeighbourAggregation(nn.Module):
+    """
+    Mean of the messages each agent receives over a neighbour graph ( see `knn_edges`), as a fixed-size
+    (n_nodes, ..., out_size) tensor; agents without neighbours receive zeros.
+
+    Messages are the node features, optionally transformed by a linear layer ( shared by all agents).
+    """
+
+    def __init__(self, in_size, out_size=None):
+        """
+
+        Args:
+            in_size: size of the node features ( e.g. hidden size of the agents)
+            out_size: size of the messages ( node features sent as they are if None)
+        """
+        super().__init__()
+        self.message = nn.Identity() if out_size is None else nn.Linear(in_size, out_size)
+
+    def forward(self, x, edges):
+        """
+
+        Args:
+            x: node features, shaped (n_nodes, ..., in_size)
+            edges: (2, n_edges) edge index over the nodes
+        Returns:
+            aggregated messages, shaped (n_nodes, ..., out_size)
+        """
+        source, target = edges
+        messages = self.message(x)
+        out = messages.new_zeros(messages.shape).index_add_(0, target, messages[source])
+        degree = torch.bincount(target, minlength=len(x)).clamp(min=1).to(out.dtype)
+        return out / degree.view((-1,) + (1,) * (out.dim() - 1))
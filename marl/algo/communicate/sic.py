@@ -5,7 +5,7 @@ import torch
 import random
 from .._base import _Base
 from marl.utils import ReplayMemory, Transition, PrioritizedReplayMemory, soft_update, hard_update
-from marl.utils import LinearDecay
+from marl.utils import LinearDecay, NStepAccumulator, to_tensor, BatchPrefetcher
 from torch.nn import MSELoss
 import numpy as np
 
@@ -15,7 +15,7 @@ class SIC(_Base):
         + Double DQN + Prioritized Replay + Soft Target Updates"""
 
     def __init__(self, env_fn, model_fn, lr, discount, batch_size, device, mem_len, tau, train_episodes,
-                 episode_max_steps, path):
+                 episode_max_steps, path, mem_storage='array', mem_obs_dtype='float32', n_step=1, prefetch=False):
         """
 
         Args:
@@ -31,9 +31,17 @@ class SIC(_Base):
             episode_max_steps: Max. number of steps to be executed in the environment
             path: Path to store results
             log_suffix: Running index for logging
+            mem_storage: Storage backend of the replay memory ('list', 'array', 'dedup', 'memmap' or 'tensor')
+            mem_obs_dtype: Observation dtype of the replay memory ('float32', 'float16', 'int8' or 'uint8')
+            n_step: No. of steps of the bootstrapped returns
+            prefetch: if True, batches are sampled and moved to device on a background thread
         """
+        self.n_step = NStepAccumulator(n_step, discount, storage=mem_storage)
         super().__init__(env_fn, model_fn, lr, discount, batch_size, device, train_episodes, episode_max_steps, path)
-        self.memory = PrioritizedReplayMemory(mem_len)
+        self.memory = PrioritizedReplayMemory(mem_len, storage=mem_storage, path=self.path,
+                                              device=self.device, obs_dtype=mem_obs_dtype)
+        if prefetch:
+            self.memory = BatchPrefetcher(self.memory, self.batch_size, self.device, pin_memory=True)
         self.tau = tau
 
         self.target_model = model_fn().to(device)
@@ -46,25 +54,24 @@ class SIC(_Base):
     def __update(self, obs_n, action_n, next_obs_n, reward_n, done):
         self.model.train()
 
-        self.memory.push(obs_n, action_n, next_obs_n, reward_n, done)
+        for transition in self.n_step.push(obs_n, action_n, next_obs_n, reward_n, done):
+            self.memory.push(*transition)
 
         if self.batch_size > len(self.memory):
             self.model.eval()
             return None
 
-        # Todo: move this beta in the Prioritized Replay memory
-        beta_start = 0.4
-        beta = min(1.0, beta_start + (self.__update_iter + 1) * (1.0 - beta_start) / 5000)
+        beta = self.memory.beta
 
-        transitions, indices, weights = self.memory.sample(self.batch_size, beta)
-        batch = Transition(*zip(*transitions))
+        batch, indices, weights = self.memory.sample(self.batch_size)
 
-        obs_batch = torch.FloatTensor(list(batch.state)).to(self.device)
-        action_batch = torch.FloatTensor(list(batch.action)).to(self.device)
-        reward_batch = torch.FloatTensor(list(batch.reward)).to(self.device)
-        next_obs_batch = torch.FloatTensor(list(batch.next_state)).to(self.device)
-        weights = torch.FloatTensor(weights).to(self.device)
-        non_final_mask = 1 - torch.ByteTensor(list(batch.done)).to(self.device)
+        obs_batch = to_tensor(batch.state, self.device)
+        action_batch = to_tensor(batch.action, self.device)
+        reward_batch = to_tensor(batch.reward, self.device)
+        discount_batch = to_tensor(batch.discount, self.device).unsqueeze(1)
+        next_obs_batch = to_tensor(batch.next_state, self.device)
+        weights = to_tensor(weights, self.device)
+        non_final_mask = ~to_tensor(batch.done, self.device, dtype=torch.bool)
 
         # calc loss
         prios = 0
@@ -113,7 +120,7 @@ class SIC(_Base):
 
                 target_q = target_next_obs_q.detach()
 
-            target_q = (self.discount * target_q) + reward_batch.sum(dim=1, keepdim=True)
+            target_q = (discount_batch * target_q) + reward_batch.sum(dim=1, keepdim=True)
             loss = (pred_q - target_q).pow(2) * weights.unsqueeze(1)
             prios += loss + 1e-5
             loss = loss.mean()
@@ -124,7 +131,7 @@ class SIC(_Base):
         self.optimizer.zero_grad()
         overall_loss.backward()
         torch.nn.utils.clip_grad_norm_(self.model.parameters(), 5)
-        self.memory.update_priorities(indices, prios.data.cpu().numpy())
+        self.memory.update_priorities(indices, prios.detach())
         self.optimizer.step()
 
         # update target network
@@ -5,8 +5,11 @@
 """
 import torch
 from .._base import _Base
+from ._recurrent import episode_thoughts
+from ._advantage import actor_critic_losses
 import numpy as np
 import torch.nn.functional as F
+from marl.utils import share_thoughts
 from ma_gym.wrappers import Monitor
 import os
 
@@ -45,35 +48,23 @@ class SIHA(_Base):
         self.n_trajectory_info = []
 
     def _update(self):
-        critic_loss = [0 for _ in range(self.model.n_agents)]
-        policy_loss = [0 for _ in range(self.model.n_agents)]
+        critic_loss, policy_loss = 0, 0
 
         for trajectory_info in self.n_trajectory_info:
-            obs, _rewards, _critic, _log_probs, _entropies = trajectory_info
+            _rewards = torch.FloatTensor(trajectory_info[1]).to(self.device)
+            _critic, _log_probs, _entropies = self._evaluate(*trajectory_info)
 
-            R = torch.zeros(1, 1).to(self.device)
-            gae = [torch.zeros(1, 1).to(self.device) for _ in range(self.model.n_agents)]
-            _critic.append([torch.zeros(1, 1).to(self.device) for _ in range(self.model.n_agents)])
-            for step in reversed(range(len(_rewards))):
-                step_reward = sum(_rewards[step])  # each agent maximizes team reward rather than local reward
-                R = self.discount * R + step_reward
-                for agent_i in range(self.model.n_agents):
-                    advantage = R - _critic[step][agent_i]
-                    critic_loss[agent_i] += 0.5 * advantage.pow(2)
+            # each agent maximizes team reward rather than local reward
+            _critic_loss, _policy_loss = actor_critic_losses(_rewards, _critic, _log_probs, _entropies, self.discount,
+                                                             self.gae_lambda, self.entropy_coef)
+            critic_loss = critic_loss + _critic_loss
+            policy_loss = policy_loss + _policy_loss
 
-                    # Generalized Advantage Estimation
-                    delta_t = step_reward
-                    delta_t += self.discount * _critic[step + 1][agent_i].data - _critic[step][agent_i].data
-                    gae[agent_i] = gae[agent_i] * self.discount * self.gae_lambda + delta_t
-
-                    policy_loss[agent_i] -= _log_probs[step][agent_i] * gae[agent_i].detach() - \
-                                            self.entropy_coef * _entropies[step][agent_i]
-
-        critic_loss = [c / self.batch_size for c in critic_loss]
-        policy_loss = [p / self.batch_size for p in policy_loss]
+        critic_loss = critic_loss / self.batch_size
+        policy_loss = policy_loss / self.batch_size
 
         self.optimizer.zero_grad()
-        loss = (sum(policy_loss) + self.critic_loss_coef * sum(critic_loss))
+        loss = (policy_loss.sum() + self.critic_loss_coef * critic_loss.sum())
         loss.backward()
         self.optimizer.step()
 
@@ -83,22 +74,55 @@ class SIHA(_Base):
                                    self._step_iter)
             self.writer.add_scalar('agent_{}/critic_loss'.format(agent_i), critic_loss[agent_i].item(),
                                    self._step_iter)
-        self.writer.add_scalar('_overall/critic_loss', sum(critic_loss).item(),
+        self.writer.add_scalar('_overall/critic_loss', critic_loss.sum().item(),
                                self._step_iter)
-        self.writer.add_scalar('_overall/actor_loss', sum(policy_loss).item(),
+        self.writer.add_scalar('_overall/actor_loss', policy_loss.sum().item(),
                                self._step_iter)
         self.writer.add_scalar('_overall/loss', loss.item(),
                                self._step_iter)
 
         return loss.item()
 
+    def _evaluate(self, obs, rewards, actions, hidden):
+        """
+        Recomputes the forward pass of an episode, with one LSTM pass over the whole episode ( see
+        `episode_thoughts`) and all steps of an agent evaluated at once
+
+        Returns:
+            critic, log prob. of the taken actions and entropy, each shaped (T, n_agents)
+        """
+        obs = torch.FloatTensor(obs).to(self.device)
+        actions = torch.LongTensor(actions).to(self.device)
+        hidden = tuple(torch.stack(state) for state in zip(*hidden)) if len(hidden) > 0 else None
+        hx_n = episode_thoughts(self.model, obs, self.truncate_n, hidden)
+        float_actions = actions.float()
+
+        thoughts = share_thoughts(hx_n.transpose(0, 1), self.share_iter)
+
+        critic_info, log_probs, entropies = [], [], []
+        for agent_i in range(self.model.n_agents):
+            # assuming every other agent is a neighbour as of now
+            _neighbours = list(range(self.model.n_agents))
+            _neighbours.remove(agent_i)
+
+            agent = self.model.agent(agent_i)
+            logits = agent(thoughts[agent_i], hx=hx_n[:, agent_i])
+            prob = F.softmax(logits, dim=1)
+            log_prob = F.log_softmax(logits, dim=1)
+
+            critic_info.append(agent.critic(thoughts[agent_i], float_actions[:, _neighbours], hx=hx_n[:, agent_i]))
+            log_probs.append(log_prob.gather(1, actions[:, agent_i].unsqueeze(1)))
+            entropies.append(-(log_prob * prob).sum(1, keepdim=True))
+
+        return tuple(torch.cat(x, dim=1) for x in (critic_info, log_probs, entropies))
+
     def _train(self, episodes):
 
         train_rewards = []
         train_loss = []
 
         for ep in range(episodes):
-            ep_log_probs, ep_rewards, ep_critic_info, ep_entropies, ep_obs = [], [], [], [], []
+            ep_rewards, ep_actions, ep_obs, ep_hidden = [], [], [], []
 
             terminal = False
             obs_n = self.env.reset()
@@ -109,45 +133,24 @@ class SIHA(_Base):
             while not terminal:
                 # self.env.render()
                 ep_obs.append(obs_n)
+                if (self.truncate_n is not None) and (step % self.truncate_n == 0):
+                    ep_hidden.append(self.model.get_hidden())  # start of a truncated chunk
                 torch_obs_n = torch.FloatTensor(obs_n).to(self.device).unsqueeze(0)
 
-                thoughts = []
-                for agent_i in range(self.model.n_agents):
-                    thoughts.append(self.model.agent(agent_i).get_thought(torch_obs_n[:, agent_i]))
+                # acting only: the forward pass of the episode is recomputed at once by `_evaluate`
+                with torch.no_grad():
+                    thoughts = []
+                    for agent_i in range(self.model.n_agents):
+                        thoughts.append(self.model.agent(agent_i).get_thought(torch_obs_n[:, agent_i]))
+
+                    thoughts = share_thoughts(thoughts, self.share_iter)
 
-                for i in range(self.share_iter):
+                    action_n = []
                     for agent_i in range(self.model.n_agents):
-                        thoughts[agent_i] = (thoughts[agent_i] + thoughts[(agent_i + 1) % len(thoughts)]) / 2
-                thoughts = torch.stack(thoughts)
-
-                action_n = []
-                log_probs, critic_info, entropies, = [], [], []
-                for agent_i in range(self.model.n_agents):
-                    # assuming every other agent is a neighbour as of now
-                    _neighbours = list(range(self.model.n_agents))
-                    _neighbours.remove(agent_i)
-
-                    logits = self.model.agent(agent_i)(thoughts[agent_i])
-                    prob = F.softmax(logits, dim=1)
-                    log_prob = F.log_softmax(logits, dim=1)
-                    entropy = -(log_prob * prob).sum(1)
-
-                    action = prob.multinomial(num_samples=1).detach()
-                    log_prob = log_prob.gather(1, action)
-                    action_n.append(action.item())
-
-                    log_probs.append(log_prob)
-                    entropies.append(entropy)
-
-                torch_action = torch.Tensor(action_n).to(self.device)
-                for agent_i in range(self.model.n_agents):
-                    # assuming every other agent is a neighbour as of now
-                    _neighbours = list(range(self.model.n_agents))
-                    _neighbours.remove(agent_i)
-
-                    critic = self.model.agent(agent_i).critic(thoughts[agent_i],
-                                                              torch_action[_neighbours])
-                    critic_info.append(critic)
+                        logits = self.model.agent(agent_i)(thoughts[agent_i])
+                        prob = F.softmax(logits, dim=1)
+                        action = prob.multinomial(num_samples=1)
+                        action_n.append(action.item())
 
                 next_obs_n, reward_n, done_n, info = self.env.step(action_n)
                 terminal = all(done_n) or step >= self.episode_max_steps
@@ -158,18 +161,13 @@ class SIHA(_Base):
                 for i, r_n in enumerate(reward_n):
                     log_ep_reward[i] += r_n
 
-                ep_log_probs.append(log_probs)
-                ep_critic_info.append(critic_info)
-                ep_entropies.append(entropies)
+                ep_actions.append(action_n)
                 ep_rewards.append(reward_n)
 
-                if (self.truncate_n is not None) and (step % self.truncate_n == 0):
-                    self.model.hidden_detach()
-
             train_rewards.append(log_ep_reward)
             self.__episode_iter += 1
 
-            self.n_trajectory_info.append((ep_obs, ep_rewards, ep_critic_info, ep_log_probs, ep_entropies))
+            self.n_trajectory_info.append((ep_obs, ep_rewards, ep_actions, ep_hidden))
             if self.__episode_iter % self.batch_size == 0:
                 train_loss.append(self._update())
                 self.n_trajectory_info = []  # empty the trajectory info
@@ -211,10 +209,7 @@ class SIHA(_Base):
                     for agent_i in range(self.model.n_agents):
                         thoughts.append(self.model.agent(agent_i).get_thought(torch_obs_n[:, agent_i]))
 
-                    for i in range(self.share_iter):
-                        for agent_i in range(self.model.n_agents):
-                            thoughts[agent_i] = (thoughts[agent_i] + thoughts[(agent_i + 1) % len(thoughts)]) / 2
-                    thoughts = torch.stack(thoughts)
+                    thoughts = share_thoughts(thoughts, self.share_iter)
 
                     action_n = []
                     for agent_i in range(self.model.n_agents):
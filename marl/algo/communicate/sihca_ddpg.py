@@ -7,6 +7,8 @@ import torch
 from .._base import _Base
 import numpy as np
 import torch.nn.functional as F
+from marl.utils import share_thoughts
+from ._advantage import actor_critic_losses
 from ma_gym.wrappers import Monitor
 import os
 
@@ -45,35 +47,26 @@ class SIHCADDPG(_Base):
         self.n_trajectory_info = []
 
     def _update(self):
-        critic_loss = [0 for _ in range(self.model.n_agents)]
-        policy_loss = [0 for _ in range(self.model.n_agents)]
+        critic_loss, policy_loss = 0, 0
 
         for trajectory_info in self.n_trajectory_info:
             obs, _rewards, _critic, _log_probs, _entropies = trajectory_info
+            _rewards = torch.FloatTensor(_rewards).to(self.device)
+            _critic = torch.cat([torch.cat(step_critic, dim=1) for step_critic in _critic])
+            _log_probs = torch.cat([torch.cat(step_log_probs, dim=1) for step_log_probs in _log_probs])
+            _entropies = torch.stack([torch.cat(step_entropies) for step_entropies in _entropies])
 
-            R = torch.zeros(1, 1).to(self.device)
-            gae = [torch.zeros(1, 1).to(self.device) for _ in range(self.model.n_agents)]
-            _critic.append([torch.zeros(1, 1).to(self.device) for _ in range(self.model.n_agents)])
-            for step in reversed(range(len(_rewards))):
-                step_reward = sum(_rewards[step])  # each agent maximizes team reward rather than local reward
-                R = self.discount * R + step_reward
-                for agent_i in range(self.model.n_agents):
-                    advantage = R - _critic[step][agent_i]
-                    critic_loss[agent_i] += 0.5 * advantage.pow(2)
-
-                    # Generalized Advantage Estimation
-                    delta_t = step_reward
-                    delta_t += self.discount * _critic[step + 1][agent_i].data - _critic[step][agent_i].data
-                    gae[agent_i] = gae[agent_i] * self.discount * self.gae_lambda + delta_t
+            # each agent maximizes team reward rather than local reward
+            _critic_loss, _policy_loss = actor_critic_losses(_rewards, _critic, _log_probs, _entropies, self.discount,
+                                                             self.gae_lambda, self.entropy_coef)
+            critic_loss = critic_loss + _critic_loss
+            policy_loss = policy_loss + _policy_loss
 
-                    policy_loss[agent_i] -= _log_probs[step][agent_i] * gae[agent_i].detach() - \
-                                            self.entropy_coef * _entropies[step][agent_i]
-
-        critic_loss = [c / self.batch_size for c in critic_loss]
-        policy_loss = [p / self.batch_size for p in policy_loss]
+        critic_loss = critic_loss / self.batch_size
+        policy_loss = policy_loss / self.batch_size
 
         self.optimizer.zero_grad()
-        loss = (sum(policy_loss) + self.critic_loss_coef * sum(critic_loss))
+        loss = (policy_loss.sum() + self.critic_loss_coef * critic_loss.sum())
         loss.backward()
         self.optimizer.step()
 
@@ -83,9 +76,9 @@ class SIHCADDPG(_Base):
                                    self._step_iter)
             self.writer.add_scalar('agent_{}/critic_loss'.format(agent_i), critic_loss[agent_i].item(),
                                    self._step_iter)
-        self.writer.add_scalar('_overall/critic_loss', sum(critic_loss).item(),
+        self.writer.add_scalar('_overall/critic_loss', critic_loss.sum().item(),
                                self._step_iter)
-        self.writer.add_scalar('_overall/actor_loss', sum(policy_loss).item(),
+        self.writer.add_scalar('_overall/actor_loss', policy_loss.sum().item(),
                                self._step_iter)
         self.writer.add_scalar('_overall/loss', loss.item(),
                                self._step_iter)
@@ -136,10 +129,7 @@ class SIHCADDPG(_Base):
                 for agent_i in range(self.model.n_agents):
                     thoughts.append(self.model.agent(agent_i).get_thought(torch_obs_n[:, agent_i]))
 
-                for i in range(self.share_iter):
-                    for agent_i in range(self.model.n_agents):
-                        thoughts[agent_i] = (thoughts[agent_i] + thoughts[(agent_i + 1) % len(thoughts)]) / 2
-                thoughts = torch.stack(thoughts)
+                thoughts = share_thoughts(thoughts, self.share_iter)
 
                 action_n = []
                 log_probs, critic_info, entropies, = [], [], []
@@ -231,10 +221,7 @@ class SIHCADDPG(_Base):
                     for agent_i in range(self.model.n_agents):
                         thoughts.append(self.model.agent(agent_i).get_thought(torch_obs_n[:, agent_i]))
 
-                    for i in range(self.share_iter):
-                        for agent_i in range(self.model.n_agents):
-                            thoughts[agent_i] = (thoughts[agent_i] + thoughts[(agent_i + 1) % len(thoughts)]) / 2
-                    thoughts = torch.stack(thoughts)
+                    thoughts = share_thoughts(thoughts, self.share_iter)
 
                     action_n = []
                     for agent_i in range(self.model.n_agents):
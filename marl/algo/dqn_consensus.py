@@ -3,7 +3,7 @@ import torch
 import random
 from ._base import _Base
 from marl.utils import ReplayMemory, Transition, PrioritizedReplayMemory, soft_update, hard_update
-from marl.utils import LinearDecay
+from marl.utils import LinearDecay, NStepAccumulator, to_tensor, share_thoughts
 from torch.nn import MSELoss
 import numpy as np
 # from ma_gym.wrappers import Monitor
@@ -18,9 +18,11 @@ class DQNConsensus(_Base):
     """
 
     def __init__(self, env_fn, model_fn, lr, discount, batch_size, device, mem_len, tau, train_episodes,
-                 episode_max_steps, path):
+                 episode_max_steps, path, mem_storage='array', mem_obs_dtype='float32', n_step=1):
+        self.n_step = NStepAccumulator(n_step, discount, storage=mem_storage)
         super().__init__(env_fn, model_fn, lr, discount, batch_size, device, train_episodes, episode_max_steps, path)
-        self.memory = PrioritizedReplayMemory(mem_len)
+        self.memory = PrioritizedReplayMemory(mem_len, storage=mem_storage, path=self.path,
+                                              device=self.device, obs_dtype=mem_obs_dtype)
         self.tau = tau
 
         self.target_model = model_fn().to(device)
@@ -57,38 +59,32 @@ class DQNConsensus(_Base):
         for agent_i in range(self.model.n_agents):
             og_thoughts.append(self.model.agent(agent_i).get_thought(obs_batch[:, agent_i]))
 
-        global_thoughts = [x.clone() for x in og_thoughts]
-        for i in range(self.share_iter):
-            for agent_i in range(self.model.n_agents):
-                global_thoughts[agent_i] = (global_thoughts[agent_i] +
-                                            global_thoughts[(agent_i + 1) % len(global_thoughts)]) / 2
-        global_thoughts = torch.stack(global_thoughts)
         og_thoughts = torch.stack(og_thoughts)
+        global_thoughts = share_thoughts(og_thoughts, self.share_iter)
 
         return og_thoughts, global_thoughts
 
     def __update(self, obs_n, action_n, next_obs_n, reward_n, done):
         self.model.train()
 
-        self.memory.push(obs_n, action_n, next_obs_n, reward_n, done)
+        for transition in self.n_step.push(obs_n, action_n, next_obs_n, reward_n, done):
+            self.memory.push(*transition)
 
         if self.batch_size > len(self.memory):
             self.model.eval()
             return None
 
-        # Todo: move this beta in the Prioritized Replay memory
-        beta_start = 0.4
-        beta = min(1.0, beta_start + (self.__update_iter + 1) * (1.0 - beta_start) / 5000)
+        beta = self.memory.beta
 
-        transitions, indices, weights = self.memory.sample(self.batch_size, beta)
-        batch = Transition(*zip(*transitions))
+        batch, indices, weights = self.memory.sample(self.batch_size)
 
-        obs_batch = torch.FloatTensor(list(batch.state)).to(self.device)
-        action_batch = torch.FloatTensor(list(batch.action)).to(self.device)
-        reward_batch = torch.FloatTensor(list(batch.reward)).to(self.device)
-        next_obs_batch = torch.FloatTensor(list(batch.next_state)).to(self.device)
-        weights = torch.FloatTensor(weights).to(self.device)
-        non_final_mask = 1 - torch.ByteTensor(list(batch.done)).to(self.device)
+        obs_batch = to_tensor(batch.state, self.device)
+        action_batch = to_tensor(batch.action, self.device)
+        reward_batch = to_tensor(batch.reward, self.device)
+        discount_batch = to_tensor(batch.discount, self.device).unsqueeze(1)
+        next_obs_batch = to_tensor(batch.next_state, self.device)
+        weights = to_tensor(weights, self.device)
+        non_final_mask = ~to_tensor(batch.done, self.device, dtype=torch.bool)
 
         # calc loss
         prios = 0
@@ -115,7 +111,7 @@ class DQNConsensus(_Base):
 
                 target_q = target_next_obs_q.detach()
 
-            target_q = (self.discount * target_q) + reward_batch.sum(dim=1, keepdim=True)
+            target_q = (discount_batch * target_q) + reward_batch.sum(dim=1, keepdim=True)
             loss = (pred_q - target_q).pow(2) * weights.unsqueeze(1)
             prios += loss + 1e-5
             loss = loss.mean()
@@ -126,7 +122,7 @@ class DQNConsensus(_Base):
         self.optimizer.zero_grad()
         overall_loss.backward()
         torch.nn.utils.clip_grad_norm_(self.model.parameters(), 5)
-        self.memory.update_priorities(indices, prios.data.cpu().numpy())
+        self.memory.update_priorities(indices, prios.detach())
         self.optimizer.step()
 
         # update target network
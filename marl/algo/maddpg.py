@@ -7,18 +7,21 @@ import numpy as np
 from ._base import _Base
 from marl.utils import PrioritizedReplayMemory, ReplayMemory, Transition, soft_update, onehot_from_logits, \
     gumbel_softmax
-from marl.utils import OUNoise, LinearDecay
+from marl.utils import OUNoise, LinearDecay, to_tensor, AgentBatchedNet
 from torch.nn import MSELoss
 
 
 class MADDPG(_Base):
     def __init__(self, env_fn, model_fn, lr, discount, batch_size, device, mem_len, tau, train_episodes,
-                 episode_max_steps, discrete_action_space, path):
+                 episode_max_steps, discrete_action_space, path, mem_storage='array', mem_obs_dtype='float32',
+                 compiled_actions=False):
         """ Todo: Write note about usage or if anything specific is required to run"""
         super().__init__(env_fn, model_fn, lr, discount, batch_size, device, train_episodes, episode_max_steps, path)
-        self.memory = ReplayMemory(mem_len)
+        self.memory = ReplayMemory(mem_len, storage=mem_storage, path=self.path, device=self.device,
+                                   obs_dtype=mem_obs_dtype)
         # self.memory = PrioritizedReplayMemory(mem_len)
         self.tau = tau
+        self.compiled_actions = compiled_actions
 
         self.target_model = model_fn().to(device)
         self.target_model.load_state_dict(self.model.state_dict())
@@ -34,7 +37,7 @@ class MADDPG(_Base):
 
     def __update(self, obs_n, action_n, next_obs_n, reward_n, done):
         self.model.train()
-        self.memory.push(obs_n, action_n, next_obs_n, reward_n, done)
+        self.memory.push(obs_n, action_n, next_obs_n, reward_n, done, self.discount)
 
         if self.batch_size > len(self.memory):
             self.model.eval()
@@ -46,57 +49,68 @@ class MADDPG(_Base):
         # beta = min(1.0, beta_start + (self.__update_iter + 1) * (1.0 - beta_start) / 5000)
 
         # transitions, indices, weights = self.memory.sample(self.batch_size, beta)
-        transitions = self.memory.sample(self.batch_size)
-        batch = Transition(*zip(*transitions))
-
-        obs_batch = torch.FloatTensor(list(batch.state)).to(self.device)
-        action_batch = torch.FloatTensor(list(batch.action)).to(self.device)
-        reward_batch = torch.FloatTensor(list(batch.reward)).to(self.device)
-        next_obs_batch = torch.FloatTensor(list(batch.next_state)).to(self.device)
-        non_final_mask = 1 - torch.ByteTensor(list(batch.done)).to(self.device)
+        batch = self.memory.sample(self.batch_size)
+
+        obs_batch = to_tensor(batch.state, self.device)
+        action_batch = to_tensor(batch.action, self.device)
+        reward_batch = to_tensor(batch.reward, self.device)
+        discount_batch = to_tensor(batch.discount, self.device)
+        next_obs_batch = to_tensor(batch.next_state, self.device)
+        non_final_mask = ~to_tensor(batch.done, self.device, dtype=torch.bool)
         # weights = torch.FloatTensor(weights).to(self.device)
 
         comb_obs_batch = obs_batch.flatten(1)
         comb_action_batch = action_batch.flatten(1)
         comb_next_obs_batch = next_obs_batch.flatten(1)
 
+        # target joint action, computed once for the critics of all agents
+        with torch.no_grad():
+            target_action_batch = self.__select_action(self.target_model, next_obs_batch).flatten(1).to(self.device)
+
         # calculate loss
-        q_loss_n, actor_loss_n = 0, 0
-        # prios_n = 0
-        for i in range(self.model.n_agents):
-            # critic
-            pred_q_value = self.model.agent(i).critic(comb_obs_batch, comb_action_batch)
-
-            target_next_obs_q = torch.zeros(pred_q_value.shape).to(self.device)
-            target_action_batch = self.__select_action(self.target_model, next_obs_batch)
-            target_action_batch = target_action_batch.flatten(1).to(self.device)
-            _next_q = self.target_model.agent(i).critic(comb_next_obs_batch, target_action_batch)
-            target_next_obs_q[non_final_mask[:, i]] = _next_q[non_final_mask[:, i]]
-            target_q_value = (self.discount * target_next_obs_q).squeeze(1) + reward_batch[:, i]
-            q_loss = MSELoss()(pred_q_value.squeeze(1), target_q_value).mean()
-            q_loss_n += q_loss
-
-            # q_loss = (pred_q_value.squeeze(1) - target_q_value).pow(2) * weights
-            # prios_n += q_loss + 1e-5
-            # q_loss = q_loss.mean()
-            # q_loss_n += q_loss
-
-            # actor
-            actor_i = self.model.agent(i).actor(obs_batch[:, i])
-            _action_batch = action_batch.clone()
-            if self.discrete_action_space:
-                _action_batch[:, i] = gumbel_softmax(actor_i, hard=True)
-            else:
-                _action_batch[:, i] = actor_i
+        if isinstance(self.model, AgentBatchedNet):
+            q_loss, actor_loss = self.__batched_losses(obs_batch, action_batch, reward_batch, discount_batch,
+                                                       non_final_mask, target_action_batch, comb_next_obs_batch)
+            q_loss_n, actor_loss_n = q_loss.sum(), actor_loss.sum()
+            for i in range(self.model.n_agents):
+                self.writer.add_scalar('agent_{}/critic_loss'.format(i), q_loss[i], self.__update_iter)
+                self.writer.add_scalar('agent_{}/actor_loss'.format(i), actor_loss[i], self.__update_iter)
+        else:
+            q_loss_n, actor_loss_n = 0, 0
+            # prios_n = 0
+            for i in range(self.model.n_agents):
+                # critic
+                pred_q_value = self.model.agent(i).critic(comb_obs_batch, comb_action_batch)
+
+                target_next_obs_q = torch.zeros(pred_q_value.shape).to(self.device)
+                with torch.no_grad():
+                    _next_q = self.target_model.agent(i).critic(comb_next_obs_batch, target_action_batch)
+                target_next_obs_q[non_final_mask[:, i]] = _next_q[non_final_mask[:, i]]
+                target_q_value = discount_batch * target_next_obs_q.squeeze(1) + reward_batch[:, i]
+                q_loss = MSELoss()(pred_q_value.squeeze(1), target_q_value).mean()
+                q_loss_n += q_loss
+
+                # q_loss = (pred_q_value.squeeze(1) - target_q_value).pow(2) * weights
+                # prios_n += q_loss + 1e-5
+                # q_loss = q_loss.mean()
+                # q_loss_n += q_loss
+
+                # actor
+                actor_i = self.model.agent(i).actor(self.obs_layout.agent(obs_batch, i))
+                _action_batch = action_batch.clone()
+                if self.discrete_action_space:
+                    _action_batch[:, i] = gumbel_softmax(actor_i, hard=True)
+                else:
+                    _action_batch[:, i] = actor_i
 
-            _action_batch = _action_batch.flatten(1)
-            actor_loss = - self.model.agent(i).critic(comb_obs_batch, _action_batch).mean()
-            actor_loss += (actor_i ** 2).mean() * 1e-3
-            actor_loss_n += actor_loss
+                _action_batch = _action_batch.flatten(1)
+                actor_loss = - self.model.agent(i).critic(comb_obs_batch, _action_batch).mean()
+                actor_loss += (actor_i ** 2).mean() * 1e-3
+                actor_loss_n += actor_loss
 
-            # log
-            self.writer.add_scalar('agent_{}/critic_loss'.format(i), q_loss, self.__update_iter)
-            self.writer.add_scalar('agent_{}/actor_loss'.format(i), actor_loss, self.__update_iter)
+                # log
+                self.writer.add_scalar('agent_{}/critic_loss'.format(i), q_loss, self.__update_iter)
+                self.writer.add_scalar('agent_{}/actor_loss'.format(i), actor_loss, self.__update_iter)
 
         # Overall loss
         loss = actor_loss_n + q_loss_n
@@ -124,11 +138,47 @@ class MADDPG(_Base):
 
         return loss.item()
 
+    def __batched_losses(self, obs_batch, action_batch, reward_batch, discount_batch, non_final_mask,
+                         target_action_batch, comb_next_obs_batch):
+        """
+        Critic and actor losses of all agents at once, for agent-batched models
+
+        Returns:
+            critic loss and actor loss of every agent, each shaped (n_agents,)
+        """
+        comb_obs_batch = obs_batch.flatten(1)
+
+        # critic
+        pred_q_value = self.model.critic(comb_obs_batch, action_batch.flatten(1)).squeeze(2)
+        with torch.no_grad():
+            _next_q = self.target_model.critic(comb_next_obs_batch, target_action_batch).squeeze(2)
+        target_q_value = discount_batch.unsqueeze(1) * (_next_q * non_final_mask) + reward_batch
+        q_loss = (pred_q_value - target_q_value).pow(2).mean(dim=0)
+
+        # actor: the critic of agent i gets the joint action with the action of agent i from its current policy
+        actor_n = self.model.actor(obs_batch)
+        if self.discrete_action_space:
+            policy_action = gumbel_softmax(actor_n.flatten(0, 1), hard=True).view_as(actor_n)
+        else:
+            policy_action = actor_n
+        own_action = torch.eye(self.model.n_agents, dtype=torch.bool, device=self.device)[None, :, :, None]
+        _action_batch = torch.where(own_action, policy_action.unsqueeze(1), action_batch.unsqueeze(1))
+        actor_loss = - self.model.critic(comb_obs_batch, _action_batch.flatten(2)).squeeze(2).mean(dim=0)
+        actor_loss = actor_loss + (actor_n ** 2).mean(dim=(0, 2)) * 1e-3
+
+        return q_loss, actor_loss
+
     def __select_action(self, model, obs_n, explore=False):
+        if self.compiled_actions and not explore:
+            return self._compiled_actions(model, obs_n, action='onehot' if self.discrete_action_space else 'clamp',
+                                          head='actor')
+        if isinstance(model, AgentBatchedNet):
+            return self.__batched_select_action(model, obs_n, explore)
+
         act_n = []
 
         for i in range(model.n_agents):
-            action = model.agent(i).actor(obs_n[:, i])
+            action = model.agent(i).actor(self.obs_layout.agent(obs_n, i))
             if self.discrete_action_space:
                 if explore:  # TODO: Exploration rate needs to be corrected over here
                     action = gumbel_softmax(action, temperature=self.exploration.eps, hard=True)
@@ -146,6 +196,23 @@ class MADDPG(_Base):
 
         return torch.cat(act_n, dim=1)
 
+    def __batched_select_action(self, model, obs_n, explore=False):
+        """ same as `__select_action`, with the actors of all agents evaluated at once"""
+        logits = model.actor(obs_n)
+        if self.discrete_action_space:
+            flat_logits = logits.flatten(0, 1)
+            if explore:
+                action = gumbel_softmax(flat_logits, temperature=self.exploration.eps, hard=True)
+            else:
+                action = onehot_from_logits(flat_logits)
+            return action.view_as(logits)
+
+        action = logits  # continuous action
+        if explore:
+            _noise = torch.FloatTensor(np.stack([noise.noise() for noise in self.exploration]))
+            action = action + _noise.to(action.device)
+        return action.clamp(-1, 1)
+
     def _train(self, episodes):
         self.model.eval()
         train_rewards = []
@@ -153,17 +220,18 @@ class MADDPG(_Base):
 
         for ep in range(episodes):
             terminal = False
-            obs_n = self.env.reset()
+            obs_n = self._pack_obs(self.env.reset())
             step = 0
             ep_reward = [0 for _ in range(self.model.n_agents)]
             while not terminal:
                 # self.env.render()
 
-                torch_obs_n = torch.FloatTensor(obs_n).to(self.device).unsqueeze(0)
+                torch_obs_n = torch.from_numpy(obs_n).to(self.device).unsqueeze(0)
                 action_n = self.__select_action(self.model, torch_obs_n, explore=True)
                 action_n = action_n.cpu().detach().numpy().tolist()[0]
                 # print(action_n)
                 next_obs_n, reward_n, done_n, info = self.env.step(action_n)
+                next_obs_n = self._pack_obs(next_obs_n)
                 terminal = all(done_n) or step >= self.episode_max_steps
                 done_n = [terminal for _ in range(self.env.n_agents)]
                 loss = self.__update(obs_n, action_n, next_obs_n, reward_n, done_n)
@@ -196,7 +264,7 @@ class MADDPG(_Base):
         with torch.no_grad():
             for ep in range(episodes):
                 terminal = False
-                obs_n = self.env.reset()
+                obs_n = self._pack_obs(self.env.reset())
                 step = 0
 
                 ep_reward = [0 for _ in range(self.model.n_agents)]
@@ -204,11 +272,12 @@ class MADDPG(_Base):
                     if render:
                         self.env.render()
 
-                    torch_obs_n = torch.FloatTensor(obs_n).to(self.device).unsqueeze(0)
+                    torch_obs_n = torch.from_numpy(obs_n).to(self.device).unsqueeze(0)
                     action_n = self.__select_action(self.model, torch_obs_n, explore=False)
                     action_n = action_n.cpu().numpy().tolist()[0]
 
                     next_obs_n, reward_n, done_n, info = self.env.step(action_n)
+                    next_obs_n = self._pack_obs(next_obs_n)
                     terminal = all(done_n) or step >= self.episode_max_steps
 
                     obs_n = next_obs_n
@@ -2,7 +2,7 @@ import torch
 import random
 from ._base import _Base
 from marl.utils import ReplayMemory, Transition, PrioritizedReplayMemory, soft_update, hard_update
-from marl.utils import LinearDecay
+from marl.utils import LinearDecay, NStepAccumulator, to_tensor, BatchPrefetcher, AgentBatchedNet
 from torch.nn import MSELoss
 import numpy as np
 
@@ -15,10 +15,16 @@ class VDN(_Base):
     """
 
     def __init__(self, env_fn, model_fn, lr, discount, batch_size, device, mem_len, tau, train_episodes,
-                 episode_max_steps, path):
+                 episode_max_steps, path, mem_storage='array', mem_obs_dtype='float32', n_step=1, prefetch=False,
+                 compiled_actions=False):
+        self.n_step = NStepAccumulator(n_step, discount, storage=mem_storage)
         super().__init__(env_fn, model_fn, lr, discount, batch_size, device, train_episodes, episode_max_steps, path)
-        self.memory = PrioritizedReplayMemory(mem_len)
+        self.memory = PrioritizedReplayMemory(mem_len, storage=mem_storage, path=self.path,
+                                              device=self.device, obs_dtype=mem_obs_dtype)
+        if prefetch:
+            self.memory = BatchPrefetcher(self.memory, self.batch_size, self.device, pin_memory=True)
         self.tau = tau
+        self.compiled_actions = compiled_actions
 
         self.target_model = model_fn().to(device)
         self.target_model.load_state_dict(self.model.state_dict())
@@ -30,45 +36,33 @@ class VDN(_Base):
     def __update(self, obs_n, action_n, next_obs_n, reward_n, done):
         self.model.train()
 
-        self.memory.push(obs_n, action_n, next_obs_n, reward_n, done)
+        for transition in self.n_step.push(obs_n, action_n, next_obs_n, reward_n, done):
+            self.memory.push(*transition)
 
         if self.batch_size > len(self.memory):
             self.model.eval()
             return None
 
-        # Todo: move this beta in the Prioritized Replay memory
-        beta_start = 0.4
-        beta = min(1.0, beta_start + (self._update_iter + 1) * (1.0 - beta_start) / 5000)
+        beta = self.memory.beta
 
-        transitions, indices, weights = self.memory.sample(self.batch_size, beta)
-        batch = Transition(*zip(*transitions))
+        batch, indices, weights = self.memory.sample(self.batch_size)
 
-        obs_batch = torch.FloatTensor(np.array(batch.state)).to(self.device)
-        action_batch = torch.FloatTensor(np.array(batch.action)).to(self.device)
-        reward_batch = torch.FloatTensor(np.array(batch.reward)).to(self.device)
-        next_obs_batch = torch.FloatTensor(np.array(batch.next_state)).to(self.device)
-        weights = torch.FloatTensor(weights).to(self.device)
+        obs_batch = to_tensor(batch.state, self.device)
+        action_batch = to_tensor(batch.action, self.device)
+        reward_batch = to_tensor(batch.reward, self.device)
+        discount_batch = to_tensor(batch.discount, self.device).unsqueeze(1)
+        next_obs_batch = to_tensor(batch.next_state, self.device)
+        weights = to_tensor(weights, self.device)
         # non_final_mask = 1 - torch.ByteTensor(list(batch.done)).to(self.device)
-        non_final_mask = ~torch.tensor(batch.done, dtype=torch.bool).to(self.device)
+        non_final_mask = ~to_tensor(batch.done, self.device, dtype=torch.bool)
 
         # calc loss
-        overall_pred_q, target_q = 0, 0
-        for i in range(self.model.n_agents):
-            q_val_i = self.model.agent(i)(obs_batch[:, i])
-            overall_pred_q += q_val_i.gather(1, action_batch[:, i].long().unsqueeze(1))
-
-            target_next_obs_q = torch.zeros(overall_pred_q.shape).to(self.device)
-            non_final_next_obs_batch = next_obs_batch[:, i][non_final_mask]
-
-            # Double DQN update
-            if not (non_final_next_obs_batch.shape[0] == 0):
-                _max_actions = self.model.agent(i)(non_final_next_obs_batch).max(1, keepdim=True)[1].detach()
-                _max_q = self.target_model.agent(i)(non_final_next_obs_batch).gather(1, _max_actions)
-                target_next_obs_q[non_final_mask] = _max_q
-
-                target_q += target_next_obs_q.detach()
+        if isinstance(self.model, AgentBatchedNet):
+            overall_pred_q, target_q = self.__batched_q(obs_batch, action_batch, next_obs_batch, non_final_mask)
+        else:
+            overall_pred_q, target_q = self.__agent_wise_q(obs_batch, action_batch, next_obs_batch, non_final_mask)
 
-        target_q = (self.discount * target_q) + reward_batch.sum(dim=1, keepdim=True)
+        target_q = (discount_batch * target_q) + reward_batch.sum(dim=1, keepdim=True)
         loss = (overall_pred_q - target_q).pow(2) * weights.unsqueeze(1)
         prios = loss + 1e-5
         loss = loss.mean()
@@ -77,7 +71,7 @@ class VDN(_Base):
         self.optimizer.zero_grad()
         loss.backward()
         torch.nn.utils.clip_grad_norm_(self.model.parameters(), 5)
-        self.memory.update_priorities(indices, prios.data.cpu().numpy())
+        self.memory.update_priorities(indices, prios.detach())
         self.optimizer.step()
 
         # update target network
@@ -98,16 +92,53 @@ class VDN(_Base):
 
         return loss.item()
 
+    def __agent_wise_q(self, obs_batch, action_batch, next_obs_batch, non_final_mask):
+        """ returns the summed predicted q and the summed next state q ( Double DQN) of the agents, one by one"""
+        overall_pred_q, target_q = 0, 0
+        for i in range(self.model.n_agents):
+            q_val_i = self.model.agent(i)(self.obs_layout.agent(obs_batch, i))
+            overall_pred_q += q_val_i.gather(1, action_batch[:, i].long().unsqueeze(1))
+
+            target_next_obs_q = torch.zeros(overall_pred_q.shape).to(self.device)
+            non_final_next_obs_batch = self.obs_layout.agent(next_obs_batch, i)[non_final_mask]
+
+            # Double DQN update
+            if not (non_final_next_obs_batch.shape[0] == 0):
+                _max_actions = self.model.agent(i)(non_final_next_obs_batch).max(1, keepdim=True)[1].detach()
+                _max_q = self.target_model.agent(i)(non_final_next_obs_batch).gather(1, _max_actions)
+                target_next_obs_q[non_final_mask] = _max_q
+
+                target_q += target_next_obs_q.detach()
+
+        return overall_pred_q, target_q
+
+    def __batched_q(self, obs_batch, action_batch, next_obs_batch, non_final_mask):
+        """ same as `__agent_wise_q`, with a single forward pass over all agents for each network"""
+        q_val = self.model(obs_batch)
+        overall_pred_q = q_val.gather(2, action_batch.long().unsqueeze(2)).squeeze(2).sum(dim=1, keepdim=True)
+
+        # Double DQN update
+        with torch.no_grad():
+            _max_actions = self.model(next_obs_batch).max(2, keepdim=True)[1]
+            _max_q = self.target_model(next_obs_batch).gather(2, _max_actions).squeeze(2).sum(dim=1, keepdim=True)
+            target_q = _max_q * non_final_mask.unsqueeze(1)
+
+        return overall_pred_q, target_q
+
     def _select_action(self, model, obs_n, explore=False):
         """ selects epsilon greedy action for the state """
         if explore and self.exploration.eps > random.random():
             # act_n = self.env.action_space.sample()
             act_n = [space.sample() for space in self.env.action_space]
             # act_n = [np.eye(space.n)[np.random.choice(space.n)] for space in self.env.action_space]
+        elif self.compiled_actions:
+            act_n = self._compiled_actions(model, obs_n)[0].tolist()
+        elif isinstance(model, AgentBatchedNet):
+            act_n = model(obs_n).argmax(2)[0].tolist()
         else:
             act_n = []
             for i in range(model.n_agents):
-                act_n.append(model.agent(i)(obs_n[:, i]).argmax(1).item())
+                act_n.append(model.agent(i)(self.obs_layout.agent(obs_n, i)).argmax(1).item())
 
         return act_n
 
@@ -118,11 +149,11 @@ class VDN(_Base):
 
         for ep in range(episodes):
             terminal = False
-            obs_n = self.env.reset()
+            obs_n = self._pack_obs(self.env.reset())
             ep_step = 0
             ep_reward = [0 for _ in range(self.model.n_agents)]
             while not terminal:
-                torch_obs_n = torch.FloatTensor(np.array(obs_n)).to(self.device).unsqueeze(0)
+                torch_obs_n = torch.from_numpy(obs_n).to(self.device).unsqueeze(0)
                 action_n = self._select_action(self.model, torch_obs_n, explore=True)
 
                 # -------- amend action_n to one-hot form ---------
@@ -131,6 +162,7 @@ class VDN(_Base):
                 # --------end of amend action_n to one-hot form ---------
 
                 next_obs_n, reward_n, done_n, info = self.env.step(action_n_adjusted)
+                next_obs_n = self._pack_obs(next_obs_n)
                 terminal = all(done_n) or ep_step >= self.episode_max_steps
 
                 loss = self.__update(obs_n, action_n, next_obs_n, reward_n, terminal)
@@ -1,5 +1,13 @@
 from __future__ import absolute_import
 
-from .replay_buffer import ReplayMemory, Transition, PrioritizedReplayMemory
+from .replay_buffer import ReplayMemory, Transition, PrioritizedReplayMemory, SequenceReplayMemory, SequenceTransition
+from .storage import ListStorage, ArrayStorage, DedupArrayStorage, MemmapStorage, TensorStorage, ObservationCodec
+from .shared_storage import SharedMemoryStorage
+from .prefetch import BatchPrefetcher
+from .nstep import NStepAccumulator
+from .ragged import RaggedLayout
+from .batched import AgentBatchedLinear, AgentBatchedMLP, AgentSharedMLP, AgentBatchedNet, AgentView
+from .compiled import CompiledPolicy
 from .explore import LinearDecay, OUNoise
-from .misc import soft_update, onehot_from_logits, gumbel_softmax, hard_update
+from .misc import soft_update, onehot_from_logits, gumbel_softmax, hard_update, to_tensor
+from .misc import sharing_matrix, share_thoughts
@@ -0,0 +1,177 @@
+import math
+import torch
+import torch.nn as nn
+
+
+class AgentView:
+    """
+    View on a single agent of an agent-batched module, for code written against per-agent modules.
+
+    Calling the view evaluates the agent only ( `module(*args, agent=i)`). Sub-modules are returned as views on the
+    same agent, e.g. `net.agent(i).actor(obs)`; other attributes are the ones of the whole module.
+    """
+
+    def __init__(self, module, agent):
+        self.module = module
+        self.agent = agent
+
+    def __call__(self, *args, **kwargs):
+        return self.module(*args, agent=self.agent, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('module', 'agent'):
+            raise AttributeError(name)
+        value = getattr(self.module, name)
+        if isinstance(value, nn.Module):
+            return AgentView(value, self.agent)
+        return value
+
+
+class AgentBatchedLinear(nn.Module):
+    """
+    Linear layers of all agents, with weights stacked as a (n_agents, in_features, out_features) tensor.
+
+    Inputs are either per agent, of shape (batch, n_agents, in_features), or shared by all agents, of shape
+    (batch, in_features); the output is (batch, n_agents, out_features) and comes from a single batched matmul.
+    With `agent=i`, only agent i is evaluated on a (batch, in_features) input.
+    """
+
+    def __init__(self, n_agents, in_features, out_features):
+        super().__init__()
+        self.n_agents = n_agents
+        self.in_features = in_features
+        self.out_features = out_features
+        self.weight = nn.Parameter(torch.empty(n_agents, in_features, out_features))
+        self.bias = nn.Parameter(torch.empty(n_agents, out_features))
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        # same distribution as the default init of `nn.Linear`, for every agent
+        bound = 1 / math.sqrt(self.in_features) if self.in_features > 0 else 0
+        nn.init.uniform_(self.weight, -bound, bound)
+        nn.init.uniform_(self.bias, -bound, bound)
+
+    def forward(self, x, agent=None):
+        if agent is not None:
+            return torch.matmul(x, self.weight[agent]) + self.bias[agent]
+
+        if x.dim() == 2:  # shared input
+            x = x.unsqueeze(0).expand(self.n_agents, -1, -1)
+        else:
+            x = x.transpose(0, 1)
+        return torch.baddbmm(self.bias.unsqueeze(1), x, self.weight).transpose(0, 1)
+
+    def extra_repr(self):
+        return 'n_agents={}, in_features={}, out_features={}'.format(self.n_agents, self.in_features,
+                                                                      self.out_features)
+
+
+class AgentBatchedMLP(nn.Module):
+    """ Agent-batched counterpart of a `nn.Sequential` of linear layers, with `activation` between them"""
+
+    def __init__(self, n_agents, sizes, activation=nn.ReLU):
+        """
+
+        Args:
+            n_agents: no. of agents
+            sizes: input size followed by the output size of every layer
+            activation: activation module class ( not applied after the last layer)
+        """
+        super().__init__()
+        self.n_agents = n_agents
+        self.layers = nn.ModuleList([AgentBatchedLinear(n_agents, in_size, out_size)
+                                     for in_size, out_size in zip(sizes[:-1], sizes[1:])])
+        self.activation = activation()
+
+    def forward(self, x, agent=None):
+        for i, layer in enumerate(self.layers):
+            if i > 0:
+                x = self.activation(x)
+            x = layer(x, agent=agent)
+        return x
+
+
+class AgentSharedMLP(nn.Module):
+    """
+    Drop-in for `AgentBatchedMLP` whose agents share one set of weights ( parameter sharing), and are told apart
+    by an agent-ID appended to their input: a one-hot vector or a learned embedding. All the (batch, n_agents)
+    inputs go through the same linear layers as a single matrix multiply.
+    """
+
+    AGENT_IDS = ('onehot', 'embedding', None)
+
+    def __init__(self, n_agents, sizes, activation=nn.ReLU, agent_id='onehot', embedding_size=8):
+        """
+
+        Args:
+            n_agents: no. of agents
+            sizes: input size followed by the output size of every layer
+            activation: activation module class ( not applied after the last layer)
+            agent_id: 'onehot', 'embedding' ( learned) or None ( identical agents)
+            embedding_size: size of the learned agent-ID embedding
+        """
+        super().__init__()
+        if agent_id not in self.AGENT_IDS:
+            raise ValueError('agent_id should be one of {}, got {}'.format(self.AGENT_IDS, agent_id))
+        self.n_agents = n_agents
+        self.agent_id = agent_id
+        if agent_id == 'onehot':
+            self.register_buffer('_onehot', torch.eye(n_agents))
+            id_size = n_agents
+        elif agent_id == 'embedding':
+            self.embedding = nn.Embedding(n_agents, embedding_size)
+            id_size = embedding_size
+        else:
+            id_size = 0
+
+        sizes = [sizes[0] + id_size] + list(sizes[1:])
+        self.layers = nn.ModuleList([nn.Linear(in_size, out_size) for in_size, out_size in zip(sizes[:-1], sizes[1:])])
+        self.activation = activation()
+
+    def agent_ids(self):
+        """ Returns the ID input of every agent, as a (n_agents, id_size) tensor"""
+        if self.agent_id == 'onehot':
+            return self._onehot
+        if self.agent_id == 'embedding':
+            return self.embedding.weight
+        return self.layers[0].weight.new_zeros(self.n_agents, 0)
+
+    def forward(self, x, agent=None):
+        ids = self.agent_ids()
+        if agent is not None:
+            x = torch.cat((x, ids[agent].expand(x.shape[:-1] + (-1,))), dim=-1)
+        else:
+            if x.dim() == 2:  # shared input
+                x = x.unsqueeze(1).expand(-1, self.n_agents, -1)
+            x = torch.cat((x, ids.expand(x.shape[:-1] + (-1,))), dim=-1)
+
+        for i, layer in enumerate(self.layers):
+            if i > 0:
+                x = self.activation(x)
+            x = layer(x)
+        return x
+
+
+class AgentBatchedNet(nn.Module):
+    """
+    Base of networks evaluating all agents at once, built from `AgentBatchedMLP` ( per-agent weights stacked along a
+    leading agent dimension) or `AgentSharedMLP` ( weights shared by all agents) layers.
+
+    Agents must share the observation and action sizes. `forward` takes (batch, n_agents, ...) inputs and returns
+    (batch, n_agents, ...) outputs; `agent(i)` returns an `AgentView`, so that algorithms looping over
+    `model.agent(i)` keep working ( the parameters are the ones of the whole network though).
+    """
+
+    def __init__(self, obs_sizes, action_sizes):
+        super().__init__()
+        if len(set(obs_sizes)) > 1 or len(set(action_sizes)) > 1:
+            raise ValueError('agent-batched networks need the same observation and action size for all agents, '
+                             'got {} and {}'.format(list(obs_sizes), list(action_sizes)))
+        self.n_agents = len(obs_sizes)
+        self.obs_size = obs_sizes[0]
+        self.action_space = action_sizes[0]
+
+    def agent(self, i):
+        if not 0 <= i < self.n_agents:
+            raise IndexError('agent {} out of range [0, {})'.format(i, self.n_agents))
+        return AgentView(self, i)
@@ -0,0 +1,84 @@
+import warnings
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .batched import AgentBatchedNet
+
+
+class _ActionModule(nn.Module):
+    """ Multi-agent forward returning the greedy actions of all agents, written to be traced"""
+
+    def __init__(self, model, layout, action, head):
+        super().__init__()
+        self.model = model
+        self.layout = layout
+        self.action = action
+        self.head = head
+
+    def _net(self, module):
+        return module if self.head is None else getattr(module, self.head)
+
+    def _act(self, out, dim):
+        if self.action == 'argmax':
+            return out.argmax(dim)
+        if self.action == 'onehot':
+            return F.one_hot(out.argmax(dim), out.shape[dim]).to(out.dtype)
+        return out.clamp(-1, 1)
+
+    def forward(self, obs_n):
+        if isinstance(self.model, AgentBatchedNet):
+            return self._act(self._net(self.model)(obs_n), dim=2)
+
+        act_n = []
+        for i in range(self.model.n_agents):
+            obs = obs_n[:, i] if self.layout is None else self.layout.agent(obs_n, i)
+            act_n.append(self._act(self._net(self.model.agent(i))(obs), dim=1))
+        return torch.stack(act_n, dim=1)
+
+
+class CompiledPolicy:
+    """
+    TorchScript compiled greedy policy of a multi-agent model, for low latency action selection.
+
+    The forward pass of all agents ( and the action selection) is traced once into a single graph, which returns
+    the actions of all agents as one (batch, n_agents[, n_actions]) tensor, without the Python dispatch of the eager
+    modules. The graph shares the parameters of the model, hence it follows every in-place update ( optimizer steps,
+    soft updates, `load_state_dict`); it is traced again when called on a new input shape. When the parameters are
+    replaced instead ( e.g. the model is moved to another device), `refresh` has to be called.
+    """
+
+    ACTIONS = ('argmax', 'onehot', 'clamp')
+
+    def __init__(self, model, layout=None, action='argmax', head=None):
+        """
+
+        Args:
+            model: multi-agent model, with `n_agents` and `agent(i)`
+            layout: `RaggedLayout` of the observations ( None if agent i owns obs_n[:, i])
+            action: 'argmax' ( action indices), 'onehot' ( one-hot argmax) or 'clamp' ( continuous, in [-1, 1])
+            head: attribute of the agent networks to evaluate ( e.g. 'actor'), the networks themselves if None
+        """
+        if action not in self.ACTIONS:
+            raise ValueError('action should be one of {}, got {}'.format(self.ACTIONS, action))
+        self.model = model
+        self.layout = layout
+        self.action = action
+        self.head = head
+        self._graphs = {}  # input shape -> traced graph
+
+    def refresh(self):
+        """ Drops the traced graphs, which are traced again from the model on the next call"""
+        self._graphs.clear()
+
+    def __call__(self, obs_n):
+        shape = tuple(obs_n.shape)
+        with torch.no_grad():
+            graph = self._graphs.get(shape)
+            if graph is None:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')  # deprecation and tracer warnings
+                    graph = torch.jit.trace(_ActionModule(self.model, self.layout, self.action, self.head), obs_n,
+                                            check_trace=False)
+                self._graphs[shape] = graph
+            return graph(obs_n)
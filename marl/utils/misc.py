@@ -1,3 +1,4 @@
+import functools
 import torch
 import torch.nn.functional as F
 import numpy as np
@@ -91,3 +92,42 @@ def gumbel_softmax(logits, temperature=1.0, hard=False):
         y_hard = onehot_from_logits(y)
         y = (y_hard - y).detach() + y
     return y
+
+
+def to_tensor(x, device, dtype=torch.float32):
+    """ Returns `x` ( array-like or tensor) as a tensor of the given dtype on device, copying only when required"""
+    if torch.is_tensor(x):
+        return x.to(device=device, dtype=dtype)
+    return torch.as_tensor(np.asarray(x), dtype=dtype, device=device)
+
+
+@functools.lru_cache(maxsize=None)
+def sharing_matrix(n_agents, share_iter, device=None, dtype=torch.float32):
+    """
+    Returns the (n_agents, n_agents) matrix of `share_iter` in-place averaging sweeps over the agents ( agent i takes
+    the mean of its thought and the current thought of agent i + 1, in turn), cached per arguments.
+
+    The sweep is applied to the rows of the identity in float64, hence the matrix is the linear operator of the
+    sequential sweep up to float64 precision; mixed thoughts only differ from the sweep by float rounding.
+    """
+    rows = list(torch.eye(n_agents, dtype=torch.float64))
+    for _ in range(share_iter):
+        for agent_i in range(n_agents):
+            rows[agent_i] = (rows[agent_i] + rows[(agent_i + 1) % n_agents]) / 2
+    return torch.stack(rows).to(device=device, dtype=dtype)
+
+
+def share_thoughts(thoughts, share_iter):
+    """
+    Iterative thought sharing of all agents, as a single matmul with the cached `sharing_matrix`
+
+    Args:
+        thoughts: thoughts of all agents, as a (n_agents, ...) tensor or a list of n_agents tensors
+        share_iter: no. of averaging sweeps over the agents
+    Returns:
+        shared thoughts as a (n_agents, ...) tensor
+    """
+    if not torch.is_tensor(thoughts):
+        thoughts = torch.stack(thoughts)
+    mix = sharing_matrix(len(thoughts), share_iter, thoughts.device, thoughts.dtype)
+    return torch.matmul(mix, thoughts.flatten(1)).view_as(thoughts)
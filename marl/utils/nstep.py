@@ -0,0 +1,60 @@
+from collections import deque
+import numpy as np
+
+from .storage import Transition, DedupArrayStorage
+
+
+class NStepAccumulator:
+    """
+    Turns the one-step transitions of an episode into n-step ones, ahead of the replay memory.
+
+    Every emitted transition holds the discounted sum of the next ( up to) `n_step` rewards,
+    R_t = r_t + gamma * r_{t+1} + ... + gamma^(k-1) * r_{t+k-1}, the observation k steps later and its bootstrap
+    discount gamma^k. Steps are buffered until n are available; at the end of an episode, every buffered step is
+    flushed with the final observation ( k <= n) and the terminal `done`.
+    """
+
+    def __init__(self, n_step, discount, storage=None):
+        """
+
+        Args:
+            n_step: no. of steps summed per transition ( 1 gives the usual one-step transitions)
+            discount: discount factor ( aka gamma)
+            storage (optional): storage of the memory fed with the transitions ( name or instance, see
+                `make_storage`), checked for n-step support before the memory is built
+        """
+        if n_step < 1:
+            raise ValueError('n_step should be at least 1, got {}'.format(n_step))
+        if n_step > 1 and (storage == 'dedup' or isinstance(storage, DedupArrayStorage)):
+            raise ValueError('dedup storage keeps one-step transitions only, use another storage with n_step > 1')
+        self.n_step = n_step
+        self.discount = discount
+        self._steps = deque()  # (state, action, reward) of the steps not emitted yet
+
+    def push(self, state, action, next_state, reward, done):
+        """
+        Adds a step of the running episode and returns the transitions completed by it ( a list of `Transition`,
+        ready to be pushed into a memory)
+        """
+        self._steps.append((state, action, np.asarray(reward, dtype=np.float64)))
+        if np.all(done):
+            transitions = []
+            while len(self._steps) > 0:
+                transitions.append(self._emit(next_state, done))
+            return transitions
+        if len(self._steps) == self.n_step:
+            return [self._emit(next_state, done)]
+        return []
+
+    def _emit(self, next_state, done):
+        state, action, _ = self._steps[0]
+        n_step_return = 0
+        for k, (_, _, reward) in enumerate(self._steps):
+            n_step_return = n_step_return + (self.discount ** k) * reward
+        transition = Transition(state, action, next_state, n_step_return, done, self.discount ** len(self._steps))
+        self._steps.popleft()
+        return transition
+
+    def reset(self):
+        """ Drops the buffered steps ( e.g. when an episode is cut without a terminal step)"""
+        self._steps.clear()
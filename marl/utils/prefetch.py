@@ -0,0 +1,121 @@
+import queue
+import threading
+import numpy as np
+import torch
+
+from .storage import Transition
+
+
+class BatchPrefetcher:
+    """
+    Wraps a prioritized replay memory and samples batches on a background thread, keeping a small queue of batches
+    already converted to tensors on the training device. This overlaps batch assembly with environment stepping and
+    the optimizer step of the main thread.
+
+    It exposes the memory interface ( push, sample, update_priorities, __len__), so that learners can use it in place
+    of the memory. Every access to the wrapped memory goes through a lock, hence pushes and priority updates from
+    the main thread are safely interleaved with sampling. Priorities of a prefetched batch are applied whenever the
+    learner is done with it.
+    """
+
+    def __init__(self, memory, batch_size, device, queue_size=2, pin_memory=False):
+        """
+
+        Args:
+            memory: prioritized replay memory to sample from
+            batch_size: size of the prefetched batches
+            device: device where batches are moved to
+            queue_size: no. of batches kept ready
+            pin_memory: if True, batches are staged in page-locked memory for asynchronous copies to a cuda device
+        """
+        self.memory = memory
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.pin_memory = pin_memory and self.device.type == 'cuda'
+
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._error = None
+
+    def push(self, *args):
+        with self._lock:
+            self.memory.push(*args)
+
+    @property
+    def beta(self):
+        return self.memory.beta
+
+    def sample(self, batch_size):
+        """
+        Returns the next prefetched batch. Batches are weighted with the annealed beta of the memory at the time they
+        are sampled, hence it reaches the learner with a lag of up to `queue_size` batches. An error of the background
+        thread ( e.g. while sampling or moving the batch to the device) is raised here once its batches are consumed.
+        """
+        assert batch_size == self.batch_size, 'prefetcher was built for batches of {}'.format(self.batch_size)
+        if self._thread is None:
+            self._error = None
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+        while True:
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self._thread.is_alive():
+                    # the next call starts a new thread
+                    self._thread = None
+                    raise self._error from None
+
+    def update_priorities(self, batch_indices, batch_priorities):
+        with self._lock:
+            self.memory.update_priorities(batch_indices, batch_priorities)
+
+    def save(self, directory):
+        with self._lock:
+            self.memory.save(directory)
+
+    def load(self, directory, mmap=True):
+        with self._lock:
+            self.memory.load(directory, mmap)
+            # batches prefetched from the previous contents are dropped
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+    def _to_tensor(self, x, dtype):
+        if not torch.is_tensor(x):
+            x = torch.as_tensor(np.asarray(x), dtype=dtype)
+        if self.pin_memory and not x.is_cuda:
+            x = x.pin_memory()
+        return x.to(device=self.device, dtype=dtype, non_blocking=self.pin_memory)
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                with self._lock:
+                    batch, indices, weights = self.memory.sample(self.batch_size, None)
+
+                batch = Transition(*[self._to_tensor(field, torch.bool if name == 'done' else torch.float32)
+                                     for name, field in zip(Transition._fields, batch)])
+                weights = self._to_tensor(weights, torch.float32)
+            except Exception as error:
+                # handed over to `sample`, which would wait forever on the queue otherwise
+                self._error = error
+                return
+
+            while not self._stop.is_set():
+                try:
+                    self._queue.put((batch, indices, weights), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def close(self):
+        """ Stops the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __len__(self):
+        return len(self.memory)
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class RaggedLayout:
+    """
+    Layout of the observations of all agents in a single float32 array.
+
+    Observations of the same size are stacked as (n_agents, obs_dim). When sizes differ ( e.g. adversaries and good
+    agents of a particle scenario), they are packed one after the other in a flat (sum of sizes,) array instead,
+    and agent i owns the slice [offsets[i], offsets[i + 1]). In both cases, `agent` returns the observations of an
+    agent from a batch as a view, without copies or padding.
+    """
+
+    def __init__(self, sizes):
+        """
+
+        Args:
+            sizes: observation size of every agent
+        """
+        self.sizes = [int(size) for size in sizes]
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes))).astype(int).tolist()
+        self.ragged = len(set(self.sizes)) > 1
+
+    @classmethod
+    def from_obs(cls, obs_n):
+        """ Returns the layout of the given observations of all agents"""
+        return cls([np.size(obs) for obs in obs_n])
+
+    def pack(self, obs_n):
+        """ Returns the observations of all agents as a single float32 array"""
+        if self.ragged:
+            return np.concatenate([np.asarray(obs, dtype=np.float32).reshape(-1) for obs in obs_n])
+        return np.asarray(obs_n, dtype=np.float32)
+
+    def agent(self, batch, i):
+        """ Returns a view on the observations of agent i in a batch ( numpy array or tensor) of packed observations"""
+        if self.ragged:
+            return batch[:, self.offsets[i]:self.offsets[i + 1]]
+        return batch[:, i]
+
+    def __len__(self):
+        return len(self.sizes)
@@ -1,74 +1,284 @@
 from collections import namedtuple
-import random
 import numpy as np
+import torch
 
-Transition = namedtuple('Transition',
-                        ('state', 'action', 'next_state', 'reward', 'done'))
+from .storage import Transition, make_storage, save_snapshot, load_snapshot
+from .segment_tree import SumSegmentTree, MinSegmentTree
 
 
 class ReplayMemory:
 
-    def __init__(self, capacity):
+    def __init__(self, capacity, storage='list', path=None, device=None, obs_dtype='float32'):
+        """
+
+        Args:
+            capacity: maximum no. of transitions to be kept
+            storage: 'list' ( python list of namedtuples), 'array' ( preallocated numpy arrays per field),
+                     'dedup' ( numpy arrays, each observation written once; steps of an episode must be pushed in
+                     order), 'memmap' ( numpy memmap files per field under `path`) or 'tensor' ( preallocated torch
+                     tensors per field on `device`)
+            path: directory for on-disk storages
+            device: torch device for tensor storages
+            obs_dtype: 'float32', 'float16', 'int8' or 'uint8' ( affine-quantized per feature), or an
+                       `ObservationCodec`, for the observations of numpy storages ( batches are always float32)
+        """
         self.capacity = capacity
-        self.memory = []
-        self.position = 0
+        self.storage = make_storage(storage, capacity, path, device, obs_dtype)
 
     def push(self, *args):
         """Saves a transition."""
-        if len(self.memory) < self.capacity:
-            self.memory.append(None)
-        self.memory[self.position] = Transition(*args)
-        self.position = (self.position + 1) % self.capacity
+        self.storage.add(*args)
+        self.storage.pop_invalidated()  # only sampled among valid transitions by the storage itself
 
     def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
+        """ Returns a batch as `Transition` holding one sequence per field"""
+        return self.storage.get(self.storage.sample_indices(batch_size))
+
+    def save(self, directory):
+        """ Writes a snapshot of the contents under `directory`"""
+        save_snapshot(directory, {'storage': self.storage.state_dict()})
+
+    def load(self, directory, mmap=True):
+        """ Restores a snapshot written by `save`; with `mmap`, contents are paged in lazily from the snapshot files"""
+        self.storage.load_state_dict(load_snapshot(directory, mmap)['storage'])
 
     def __len__(self):
-        return len(self.memory)
+        return len(self.storage)
 
 
 class PrioritizedReplayMemory(object):
-    def __init__(self, capacity, prob_alpha=0.6):
+    """
+    Proportional prioritized replay ( https://arxiv.org/abs/1511.05952)
+
+    Priorities are kept in a sum-tree ( for sampling) and a min-tree ( for the importance weights normalization),
+    hence push, sample and update_priorities cost O(batch * log(capacity)).
+
+    Priorities stay with the process owning the memory: with a `SharedMemoryStorage`, transitions written by actor
+    processes get the max priority when the next batch is sampled.
+
+    With a tensor storage, the trees live on the storage device as well: sampled indices, importance weights and
+    priority updates are then torch tensors and never leave the device.
+
+    The importance sampling exponent `beta` is annealed linearly from `beta_start` to 1 over `beta_steps` priority
+    updates.
+    """
+
+    def __init__(self, capacity, prob_alpha=0.6, storage='list', path=None, device=None, obs_dtype='float32',
+                 beta_start=0.4, beta_steps=5000):
         self.prob_alpha = prob_alpha
+        self.beta_start = beta_start
+        self.beta_steps = beta_steps
+        self._beta_iter = 0  # no. of priority updates
         self.capacity = capacity
-        self.memory = []
-        self.position = 0
-        self.priorities = np.zeros((capacity,), dtype=np.float32)
-
-    def push(self, state, action, next_state, reward, done):
+        self.storage = make_storage(storage, capacity, path, device, obs_dtype)
+        self.device = getattr(self.storage, 'device', None)
 
-        max_prio = self.priorities.max() if self.memory else 1.0
+        self._sum_tree = SumSegmentTree(capacity, device=self.device)
+        self._min_tree = MinSegmentTree(capacity, device=self.device)
+        if self.device is None:
+            self._max_priority = 1.0
+        else:
+            self._max_priority = torch.ones((), dtype=torch.float64, device=self.device)
 
+    def push(self, state, action, next_state, reward, done, discount):
         """Saves a transition."""
-        if len(self.memory) < self.capacity:
-            self.memory.append(None)
-        self.memory[self.position] = Transition(state, action, next_state, reward, done)
-        self.priorities[self.position] = max_prio
+        position = self.storage.add(state, action, next_state, reward, done, discount)
+        self._set_priorities(position, self._max_priority)
 
-        self.position = (self.position + 1) % self.capacity
+        self._clear_priorities(self.storage.pop_invalidated())
 
-    def sample(self, batch_size, beta=0.4):
-        if len(self.memory) == self.capacity:
-            prios = self.priorities
+    def _set_priorities(self, indices, priorities):
+        if self.device is None:
+            priorities = np.asarray(priorities, dtype=np.float64)
         else:
-            prios = self.priorities[:self.position]
+            priorities = torch.as_tensor(priorities, dtype=torch.float64, device=self.device)
+        priorities = priorities ** self.prob_alpha
+        self._sum_tree[indices] = priorities
+        self._min_tree[indices] = priorities
+
+    def _clear_priorities(self, indices):
+        # invalid transitions get no mass and are ignored by the min-tree
+        if len(indices) > 0:
+            self._sum_tree[indices] = 0.0
+            self._min_tree[indices] = float('inf')
 
-        probs = prios ** self.prob_alpha
-        probs /= probs.sum()
+    @property
+    def beta(self):
+        return min(1.0, self.beta_start + (self._beta_iter + 1) * (1.0 - self.beta_start) / self.beta_steps)
 
-        indices = np.random.choice(len(self.memory), batch_size, p=probs)
-        batch = [self.memory[idx] for idx in indices]
+    def sample(self, batch_size, beta=None):
+        """ Returns (batch, indices, importance weights); `beta` defaults to the annealed one"""
+        beta = self.beta if beta is None else beta
+        external = self.storage.pop_external()
+        if len(external) > 0:
+            # transitions pushed by other processes ( shared storages) enter with the max priority
+            self._set_priorities(external, self._max_priority)
+        total = len(self.storage)
+        p_total = self._sum_tree.sum()
 
-        total = len(self.memory)
-        weights = (total * probs[indices]) ** (-beta)
-        weights /= weights.max()
-        weights = np.array(weights, dtype=np.float32)
+        # stratified sampling: one proportional draw in each of the `batch_size` equal segments of the mass
+        if self.device is None:
+            mass = (np.arange(batch_size) + np.random.random(batch_size)) * (p_total / batch_size)
+            indices = self._sum_tree.find_prefixsum_idx(mass)
+        else:
+            mass = torch.arange(batch_size, dtype=torch.float64, device=self.device)
+            mass = (mass + torch.rand(batch_size, dtype=torch.float64, device=self.device)) * (p_total / batch_size)
+            indices = self._sum_tree.find_prefixsum_idx(mass)
+        batch = self.storage.get(indices)
+
+        probs = self._sum_tree[indices] / p_total
+        max_weight = (total * self._min_tree.min() / p_total) ** (-beta)
+        weights = (total * probs) ** (-beta) / max_weight
+        if self.device is None:
+            weights = np.array(weights, dtype=np.float32)
+        else:
+            weights = weights.float()
 
         return batch, indices, weights
 
     def update_priorities(self, batch_indices, batch_priorities):
-        for idx, prio in zip(batch_indices, batch_priorities):
-            self.priorities[idx] = prio
+        if self.device is None:
+            if torch.is_tensor(batch_priorities):
+                batch_priorities = batch_priorities.detach().cpu().numpy()
+            batch_priorities = np.reshape(batch_priorities, -1)
+            self._max_priority = max(self._max_priority, float(batch_priorities.max()))
+        else:
+            # kept as a tensor on device, to avoid a synchronization per update
+            batch_priorities = torch.as_tensor(batch_priorities, device=self.device).detach().reshape(-1).double()
+            self._max_priority = torch.max(self._max_priority, batch_priorities.max())
+        self._set_priorities(batch_indices, batch_priorities)
+        self._beta_iter += 1
+
+        valid = getattr(self.storage, 'valid', None)
+        if valid is not None:
+            # transitions invalidated since they were sampled must not get a priority back
+            batch_indices = np.asarray(batch_indices)
+            self._clear_priorities(batch_indices[~valid[batch_indices]])
+
+    def save(self, directory):
+        """ Writes a snapshot of the contents, priorities and beta schedule under `directory`"""
+        leaves = self._sum_tree[np.arange(self.capacity)]
+        if self.device is not None:
+            leaves = leaves.cpu().numpy()
+        save_snapshot(directory, {'storage': self.storage.state_dict(),
+                                  'priorities': {'priorities': leaves, 'max_priority': float(self._max_priority),
+                                                 'beta_iter': self._beta_iter}})
+
+    def load(self, directory, mmap=True):
+        """ Restores a snapshot written by `save`; with `mmap`, contents are paged in lazily from the snapshot files"""
+        parts = load_snapshot(directory, mmap)
+        self.storage.load_state_dict(parts['storage'])
+
+        priorities = parts['priorities']
+        self._beta_iter = int(priorities['beta_iter'])
+        leaves = np.asarray(priorities['priorities'], dtype=np.float64)
+        indices = np.arange(self.capacity)
+        if self.device is None:
+            self._max_priority = float(priorities['max_priority'])
+        else:
+            self._max_priority = torch.tensor(float(priorities['max_priority']), dtype=torch.float64,
+                                              device=self.device)
+            leaves, indices = torch.as_tensor(leaves, device=self.device), torch.as_tensor(indices, device=self.device)
+        # leaves are stored already raised to `prob_alpha`; empty ones ( zero) are ignored by the min-tree
+        self._sum_tree[indices] = leaves
+        self._min_tree[indices] = leaves
+        self._clear_priorities(indices[leaves == 0])
+
+    def __len__(self):
+        return len(self.storage)
+
+
+SequenceTransition = namedtuple('SequenceTransition',
+                                ('state', 'action', 'reward', 'done', 'mask', 'hx', 'cx'))
+
+
+class SequenceReplayMemory:
+    """
+    Replay of fixed-length chunks of multi-agent episodes, along with the recurrent state at the start of each chunk.
+
+    Every chunk spans `burn_in + seq_len` steps. Consecutive chunks of an episode overlap by `burn_in` steps, hence
+    the burn-in prefix ( used only to warm up the recurrent state) of a chunk is the tail of the previous one and
+    every step after the first `burn_in` steps of an episode is learned on once. Chunks cut by the end of an episode
+    are zero padded and `mask` marks valid steps.
+
+    Sampled fields are shaped (batch, time, n_agents, ...), with `state` holding one more step than the others
+    ( the observation following the last step) for bootstrapping.
+    """
+
+    def __init__(self, capacity, seq_len, burn_in=0):
+        """
+
+        Args:
+            capacity: maximum no. of chunks to be kept
+            seq_len: no. of steps learned on in each chunk
+            burn_in: no. of leading steps per chunk only used to warm up the recurrent state
+        """
+        self.capacity = capacity
+        self.seq_len = seq_len
+        self.burn_in = burn_in
+        self.chunk_len = burn_in + seq_len
+
+        self.fields = None
+        self.position = 0
+        self._size = 0
+        self._episode = []  # steps of the chunk under construction
+
+    def _allocate(self, state, action, reward, hidden):
+        hx, cx = hidden
+        self.fields = SequenceTransition(
+            state=np.zeros((self.capacity, self.chunk_len + 1) + np.shape(state), dtype=np.float32),
+            action=np.zeros((self.capacity, self.chunk_len) + np.shape(action), dtype=np.float32),
+            reward=np.zeros((self.capacity, self.chunk_len) + np.shape(reward), dtype=np.float32),
+            done=np.zeros((self.capacity, self.chunk_len), dtype=np.bool_),
+            mask=np.zeros((self.capacity, self.chunk_len), dtype=np.bool_),
+            hx=np.zeros((self.capacity,) + np.shape(hx), dtype=np.float32),
+            cx=np.zeros((self.capacity,) + np.shape(cx), dtype=np.float32))
+
+    def push(self, state, action, next_state, reward, done, hidden):
+        """
+        Saves a step of the running episode.
+
+        Args:
+            state: observations of all agents
+            action: actions of all agents
+            next_state: observations of all agents after the step
+            reward: rewards of all agents
+            done: True, if the episode terminates with this step
+            hidden: (hx, cx) of all agents *before* the step, each shaped (n_agents, hidden_size)
+        """
+        if self.fields is None:
+            self._allocate(state, action, reward, hidden)
+
+        self._episode.append((state, action, next_state, reward, done, hidden))
+        if done or len(self._episode) == self.chunk_len:
+            self._store_chunk()
+            # keep the tail as burn-in for the next chunk of the same episode
+            self._episode = [] if (done or self.burn_in == 0) else self._episode[-self.burn_in:]
+
+    def _store_chunk(self):
+        idx = self.position
+        for field in self.fields:
+            field[idx] = 0
+
+        steps = len(self._episode)
+        for t, (state, action, next_state, reward, done, _) in enumerate(self._episode):
+            self.fields.state[idx, t] = state
+            self.fields.action[idx, t] = action
+            self.fields.reward[idx, t] = reward
+            self.fields.done[idx, t] = done
+        self.fields.state[idx, steps] = self._episode[-1][2]
+        self.fields.mask[idx, :steps] = True
+
+        hx, cx = self._episode[0][5]
+        self.fields.hx[idx] = hx
+        self.fields.cx[idx] = cx
+
+        self.position = (self.position + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        indices = np.random.randint(0, self._size, size=batch_size)
+        return SequenceTransition(*[field[indices] for field in self.fields])
 
     def __len__(self):
-        return len(self.memory)
+        return self._size
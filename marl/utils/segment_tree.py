@@ -0,0 +1,93 @@
+import operator
+import numpy as np
+import torch
+
+
+# inspired from https://github.com/openai/baselines/blob/master/baselines/common/segment_tree.py
+# ( vectorized over batches of indices)
+class SegmentTree:
+    """
+    Binary tree stored in a flat array, where every internal node holds `operation` applied over its children.
+
+    Leaves live at [capacity, 2 * capacity), the root at index 1. Reads and writes are vectorized over batches
+    of indices and cost O(batch * log(capacity)). The tree is a numpy array, or a torch tensor kept on `device`
+    when one is given ( then, indices and values are expected as tensors).
+    """
+
+    def __init__(self, capacity, operation, neutral_element, device=None):
+        tree_capacity = 1
+        while tree_capacity < capacity:
+            tree_capacity *= 2
+        self.capacity = tree_capacity
+        self.device = device
+        self._depth = tree_capacity.bit_length() - 1
+        self._operation = operation
+        if device is None:
+            self._value = np.full(2 * tree_capacity, neutral_element, dtype=np.float64)
+        else:
+            self._value = torch.full((2 * tree_capacity,), neutral_element, dtype=torch.float64, device=device)
+
+    def _as_indices(self, indices):
+        if self.device is None:
+            return np.asarray(indices, dtype=np.int64).reshape(-1)
+        return torch.as_tensor(indices, dtype=torch.long, device=self.device).reshape(-1)
+
+    def __setitem__(self, indices, values):
+        idx = self._as_indices(indices) + self.capacity
+        self._value[idx] = values
+
+        # all leaves have the same depth, hence every level is refreshed at once
+        for _ in range(self._depth):
+            idx = idx // 2
+            self._value[idx] = self._operation(self._value[2 * idx], self._value[2 * idx + 1])
+
+    def __getitem__(self, indices):
+        return self._value[self._as_indices(indices) + self.capacity]
+
+    def reduce(self):
+        """ Returns `operation` over all the leaves"""
+        return self._value[1]
+
+
+class SumSegmentTree(SegmentTree):
+    def __init__(self, capacity, device=None):
+        super().__init__(capacity, operation=operator.add, neutral_element=0.0, device=device)
+
+    def sum(self):
+        return self.reduce()
+
+    def find_prefixsum_idx(self, prefixsum):
+        """
+        For every given prefix sum, finds the highest index i such that sum(leaves[:i]) <= prefixsum. Subtrees
+        summing to zero are never entered, hence rounding errors can't lead to an empty leaf.
+
+        Args:
+            prefixsum: array ( or tensor) of prefix sums, each in [0, sum())
+        Returns:
+            array ( or tensor) of leaf indices
+        """
+        if self.device is None:
+            where = np.where
+            prefixsum = np.array(prefixsum, dtype=np.float64)
+            idx = np.ones(prefixsum.shape, dtype=np.int64)
+        else:
+            where = torch.where
+            prefixsum = torch.as_tensor(prefixsum, dtype=torch.float64, device=self.device)
+            idx = torch.ones(prefixsum.shape, dtype=torch.long, device=self.device)
+
+        for _ in range(self._depth):
+            left = 2 * idx
+            left_sum = self._value[left]
+            go_right = (prefixsum >= left_sum) & (self._value[left + 1] > 0)
+            prefixsum = where(go_right, prefixsum - left_sum, prefixsum)
+            idx = left + go_right
+        return idx - self.capacity
+
+
+class MinSegmentTree(SegmentTree):
+    def __init__(self, capacity, device=None):
+        operation = np.minimum if device is None else torch.min
+        super().__init__(capacity, operation=operation, neutral_element=float('inf'), device=device)
+
+    def min(self):
+        return self.reduce()
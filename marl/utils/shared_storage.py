@@ -0,0 +1,178 @@
+import os
+import sys
+import uuid
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+from .storage import Transition, _Storage
+
+
+_inherited_tracker = {}  # pid -> whether the process got the resource tracker of its parent, see `_attach`
+
+
+def _attach(name):
+    """ Attaches to an existing shared memory block, leaving its lifetime to the process which created it"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    # older versions register every opened block with the resource tracker, which unlinks it once its processes exit.
+    # Processes started by multiprocessing share the tracker of the creator, where the block is registered already
+    # ( registering again is a no-op, unregistering would drop the creator's registration); any other process starts
+    # its own tracker at its first attach, hence the registration of every block is dropped there
+    pid = os.getpid()
+    if pid not in _inherited_tracker:
+        _inherited_tracker[pid] = resource_tracker._resource_tracker._fd is not None
+    block = shared_memory.SharedMemory(name=name)
+    if not _inherited_tracker[pid]:
+        resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+
+class SharedMemoryStorage(_Storage):
+    """
+    Keeps transitions in `multiprocessing.shared_memory` blocks ( one per field), so that several actor processes
+    can write transitions while a learner process samples them.
+
+    The capacity is split into `n_shards` equal regions, each with its own write cursor: every shard must have a
+    single writer, hence writes need no lock. A write fills the fields of a slot first and then publishes it by
+    advancing the shard cursor ( a shared counter of written transitions). Readers only look at published slots,
+    although a slot overwritten while being sampled may be read half-written.
+
+    Usage: the learner creates the storage ( from an example transition, for shapes and dtypes) and hands
+    `storage.for_shard(i)` to the actor process i, e.g. as an argument of `multiprocessing.Process`; the actor
+    attaches to the same blocks and pushes with `add`. The creator has to call `unlink()` once everyone is done.
+    """
+
+    def __init__(self, capacity, example, n_shards=1, name=None):
+        """
+
+        Args:
+            capacity: maximum no. of transitions, a multiple of `n_shards`
+            example: example transition ( state, action, next_state, reward, done, discount)
+            n_shards: no. of independent writers
+            name: prefix of the shared memory blocks ( random by default)
+        """
+        if capacity % n_shards != 0:
+            raise ValueError('capacity {} should be a multiple of n_shards {}'.format(capacity, n_shards))
+        super().__init__(capacity)
+        self.n_shards = n_shards
+        self.shard_capacity = capacity // n_shards
+        self.shard = 0  # shard written by `add`
+        self.name = 'marl_{}'.format(uuid.uuid4().hex[:12]) if name is None else name
+
+        self._specs = []
+        for value in Transition(*example):
+            value = np.asarray(value)
+            dtype = np.bool_ if value.dtype == np.bool_ else np.float32
+            self._specs.append(((capacity,) + value.shape, np.dtype(dtype).str))
+        self._creator = True
+        self._open(create=True)
+
+        # no. of transitions of each shard seen by `pop_external`
+        self._seen = np.zeros(n_shards, dtype=np.int64)
+
+    def _open(self, create):
+        self._blocks, self.fields = [], []
+        for field_name, (shape, dtype) in zip(Transition._fields + ('written',),
+                                              self._specs + [((self.n_shards,), np.dtype(np.int64).str)]):
+            block_name = '{}_{}'.format(self.name, field_name)
+            if create:
+                size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+                block = shared_memory.SharedMemory(name=block_name, create=True, size=size)
+            else:
+                block = _attach(block_name)
+            self._blocks.append(block)
+            self.fields.append(np.ndarray(shape, dtype=dtype, buffer=block.buf))
+        self.written = self.fields.pop()  # no. of transitions written to each shard so far
+        if create:
+            self.written[:] = 0
+
+    def __getstate__(self):
+        # only the layout is pickled, the other process attaches to the same blocks
+        state = self.__dict__.copy()
+        for key in ('_blocks', 'fields', 'written'):
+            del state[key]
+        state['_creator'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open(create=False)
+
+    def for_shard(self, shard):
+        """ Returns a view of this storage whose `add` writes to the given shard ( pickled to the actor process)"""
+        if not 0 <= shard < self.n_shards:
+            raise ValueError('shard should be in [0, {}), got {}'.format(self.n_shards, shard))
+        view = self.__class__.__new__(self.__class__)
+        view.__dict__.update(self.__dict__)
+        view.shard = shard
+        view._creator = False
+        view._seen = self._seen.copy()
+        return view
+
+    def add(self, *args):
+        written = int(self.written[self.shard])
+        index = self.shard * self.shard_capacity + written % self.shard_capacity
+        for field, value in zip(self.fields, args):
+            field[index] = value
+        self.written[self.shard] = written + 1  # publishes the slot
+        if self._seen[self.shard] == written:
+            self._seen[self.shard] = written + 1  # own writes aren't external
+        return index
+
+    def get(self, indices):
+        return Transition(*[field[indices] for field in self.fields])
+
+    def _filled(self):
+        return np.minimum(self.written, self.shard_capacity)
+
+    def sample_indices(self, batch_size):
+        # uniform over the published slots, which form a prefix of every shard region
+        filled = self._filled()
+        offsets = np.cumsum(filled) - filled
+        draws = np.random.randint(0, int(filled.sum()), size=batch_size)
+        shards = np.searchsorted(offsets, draws, side='right') - 1
+        return shards * self.shard_capacity + (draws - offsets[shards])
+
+    def pop_external(self):
+        written = self.written.copy()
+        indices = []
+        for shard in range(self.n_shards):
+            new = int(written[shard] - self._seen[shard])
+            if new > 0:
+                start = self._seen[shard] if new < self.shard_capacity else written[shard] - self.shard_capacity
+                slots = np.arange(start, written[shard]) % self.shard_capacity
+                indices.append(shard * self.shard_capacity + slots)
+        self._seen = written
+        return np.concatenate(indices) if len(indices) > 0 else []
+
+    def state_dict(self):
+        state = {'capacity': self.capacity, 'position': 0, 'size': len(self), 'written': self.written.copy()}
+        state.update(zip(Transition._fields, self.fields))
+        return state
+
+    def load_state_dict(self, state):
+        if int(state['capacity']) != self.capacity:
+            raise ValueError('snapshot capacity {} differs from {}'.format(int(state['capacity']), self.capacity))
+        for field, name in zip(self.fields, Transition._fields):
+            field[:] = state[name]
+        self.written[:] = state['written']
+        self._seen = self.written.copy()  # priorities of restored transitions are restored by the memory
+
+    def close(self):
+        """ Detaches this process from the shared blocks"""
+        self.fields, self.written = [], None
+        for block in self._blocks:
+            block.close()
+        self._blocks = []
+
+    def unlink(self):
+        """ Frees the shared blocks ( creator only, once every process is done)"""
+        if self._creator:
+            blocks = self._blocks
+            self.close()
+            for block in blocks:
+                block.unlink()
+
+    def __len__(self):
+        return int(self._filled().sum())
@@ -0,0 +1,550 @@
+import os
+import random
+import shutil
+import warnings
+from collections import namedtuple
+import numpy as np
+import torch
+
+Transition = namedtuple('Transition',
+                        ('state', 'action', 'next_state', 'reward', 'done', 'discount'))
+
+
+class ObservationCodec:
+    """
+    Encodes observations for compact storage, as float32, float16, or int8/uint8 with a per-feature affine scaling
+    ( value = low + (code - code_min) * scale), and decodes them back to float32.
+
+    For the integer dtypes, the per-feature range starts from `obs_range` when given, otherwise from the first
+    observations, and is widened ( with a margin) whenever a value falls outside of it; the stored codes are then
+    re-encoded with the new range.
+
+    With a `tolerance`, every write ( and re-encoding) is decoded back and the maximum absolute error seen so far is
+    kept in `error`; a warning is raised the first time it exceeds the tolerance. Each re-encoding rounds the stored
+    codes once more, hence passing `obs_range` keeps the error closest to half a quantization step.
+    """
+
+    DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8, 'uint8': np.uint8}
+
+    def __init__(self, dtype='float32', obs_range=None, tolerance=None, margin=0.25):
+        """
+
+        Args:
+            dtype: one of `DTYPES` keys
+            obs_range: (low, high) of the observations, scalars or per-feature arrays ( integer dtypes only)
+            tolerance: maximum absolute error expected from the encoding; None disables the accuracy check
+            margin: fraction of the observed extent added on both sides, when the range is widened
+        """
+        if dtype not in self.DTYPES:
+            raise ValueError('Unknown observation dtype: {}. Choose from {}'.format(dtype, list(self.DTYPES.keys())))
+        self.dtype = np.dtype(self.DTYPES[dtype])
+        self.quantized = self.dtype.kind in 'iu'
+        self.tolerance = tolerance
+        self.margin = margin
+        self.error = 0.0
+        self._warned = False
+
+        self.low, self.high, self.scale = None, None, None
+        if obs_range is not None:
+            self._set_range(np.asarray(obs_range[0], dtype=np.float32), np.asarray(obs_range[1], dtype=np.float32))
+        self._seen = (self.low, self.high)  # extent of the observations, without margin
+
+    def _set_range(self, low, high):
+        info = np.iinfo(self.dtype)
+        self.low, self.high = low, high
+        self.scale = np.maximum(high - low, 1e-8) / (int(info.max) - int(info.min))
+
+    def fit(self, values, codes):
+        """
+        Widens the range to cover all the given observations and re-encodes the stored codes accordingly
+        ( integer dtypes only)
+
+        Args:
+            values: list of observations about to be written
+            codes: list of arrays holding codes of this codec
+        """
+        if not self.quantized:
+            return
+        values = [np.asarray(value, dtype=np.float32) for value in values]
+        low, high = np.min(values, axis=0), np.max(values, axis=0)
+        if self.low is not None:
+            if np.all(low >= self.low) and np.all(high <= self.high):
+                return
+            low, high = np.minimum(self._seen[0], low), np.maximum(self._seen[1], high)
+        self._seen = (low, high)
+
+        # the margin is relative to the values seen so far, hence widening happens a few times at most
+        pad = np.maximum(self.margin * np.maximum(high - low, np.maximum(np.abs(low), np.abs(high))), 1e-3)
+        decoded = None if self.low is None else [self.decode(array) for array in codes]
+        self._set_range((low - pad).astype(np.float32), (high + pad).astype(np.float32))
+        if decoded is not None:
+            for array, values in zip(codes, decoded):
+                array[:] = self.encode(values)
+                if array.size > 0:
+                    self._check(self.decode(array), values)
+
+    def encode(self, value):
+        value = np.asarray(value, dtype=np.float32)
+        if not self.quantized:
+            return value.astype(self.dtype)
+        info = np.iinfo(self.dtype)
+        codes = np.rint((value - self.low) / self.scale) + int(info.min)
+        return np.clip(codes, info.min, info.max).astype(self.dtype)
+
+    def decode(self, codes):
+        if not self.quantized:
+            return np.asarray(codes, dtype=np.float32)
+        info = np.iinfo(self.dtype)
+        return ((codes.astype(np.float32) - int(info.min)) * self.scale + self.low).astype(np.float32)
+
+    def write(self, array, index, value):
+        """ Encodes `value` into `array[index]`; the range has to cover it already ( see `fit`)"""
+        value = np.asarray(value, dtype=np.float32)
+        array[index] = self.encode(value)
+        self._check(self.decode(array[index]), value)
+
+    def state_dict(self):
+        """ Returns the fitted range and the measured error, prefixed by 'codec_' ( empty if nothing was fitted)"""
+        if self.low is None:
+            return {}
+        return {'codec_low': self.low, 'codec_high': self.high, 'codec_seen_low': self._seen[0],
+                'codec_seen_high': self._seen[1], 'codec_error': self.error}
+
+    def load_state_dict(self, state):
+        if 'codec_low' in state:
+            self._set_range(np.asarray(state['codec_low']), np.asarray(state['codec_high']))
+            self._seen = (np.asarray(state['codec_seen_low']), np.asarray(state['codec_seen_high']))
+            self.error = float(state['codec_error'])
+
+    def _check(self, decoded, value):
+        if self.tolerance is not None:
+            self.error = max(self.error, float(np.max(np.abs(decoded - value))))
+            if self.error > self.tolerance and not self._warned:
+                self._warned = True
+                warnings.warn('observation encoding error {:.3g} exceeds the tolerance {:.3g} ( dtype: {})'
+                              .format(self.error, self.tolerance, self.dtype.name))
+
+
+def make_codec(obs_dtype):
+    """ Returns an `ObservationCodec` for the given dtype name ( or the codec itself)"""
+    return obs_dtype if isinstance(obs_dtype, ObservationCodec) else ObservationCodec(obs_dtype)
+
+
+class _Storage:
+    """ Base class for the transition storages backing the replay memories"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.position = 0
+        self._size = 0
+
+    def add(self, *args):
+        """ Writes a transition at the write position and returns its index"""
+        raise NotImplementedError
+
+    def get(self, indices):
+        """ Returns the transitions at the given indices as a batch ( one sequence per field)"""
+        raise NotImplementedError
+
+    def sample_indices(self, batch_size):
+        """ Returns indices of `batch_size` stored transitions, drawn uniformly"""
+        return random.sample(range(len(self)), batch_size)
+
+    def pop_invalidated(self):
+        """ Returns ( and forgets) indices of transitions made invalid by the last writes, apart from overwrites"""
+        return []
+
+    def pop_external(self):
+        """ Returns ( and forgets) indices of transitions written by other processes since the last call"""
+        return []
+
+    def state_dict(self):
+        """ Returns the storage contents as a dict of numpy arrays and scalars ( see `save_snapshot`)"""
+        return {'capacity': self.capacity, 'position': self.position, 'size': self._size}
+
+    def load_state_dict(self, state):
+        """ Restores the contents from `state_dict()`; arrays are used as given ( e.g. memory-mapped)"""
+        if int(state['capacity']) != self.capacity:
+            raise ValueError('snapshot capacity {} differs from {}'.format(int(state['capacity']), self.capacity))
+        self.position = int(state['position'])
+        self._size = int(state['size'])
+
+    def _advance(self):
+        index = self.position
+        self.position = (self.position + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        return index
+
+    def __len__(self):
+        return self._size
+
+
+class ListStorage(_Storage):
+    """ Keeps every transition as a `Transition` namedtuple in a python list"""
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.memory = []
+
+    def add(self, *args):
+        if len(self.memory) < self.capacity:
+            self.memory.append(None)
+        self.memory[self.position] = Transition(*args)
+        return self._advance()
+
+    def get(self, indices):
+        return Transition(*zip(*[self.memory[idx] for idx in indices]))
+
+    def state_dict(self):
+        state = super().state_dict()
+        if len(self.memory) > 0:
+            for name, values in zip(Transition._fields, zip(*self.memory)):
+                state[name] = np.stack([np.asarray(value) for value in values])
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        if 'state' in state:
+            self.memory = [Transition(*values) for values in zip(*[state[name] for name in Transition._fields])]
+        else:
+            self.memory = []
+
+
+class ArrayStorage(_Storage):
+    """
+    Keeps transitions in preallocated numpy arrays, one per field, shaped (capacity, *field_shape).
+
+    Arrays are allocated on the first write, from the shapes of the first transition. Boolean fields ( e.g. done)
+    keep their dtype, observations ( state, next_state) are stored as encoded by `obs_dtype` and everything else is
+    stored as float32.
+    """
+
+    _OBS_FIELDS = (0, 2)  # state, next_state
+
+    def __init__(self, capacity, obs_dtype='float32'):
+        super().__init__(capacity)
+        self.fields = None
+        self.codec = make_codec(obs_dtype)
+
+    def _field_dtype(self, i, value):
+        if i in self._OBS_FIELDS:
+            return self.codec.dtype
+        return np.bool_ if value.dtype == np.bool_ else np.float32
+
+    def _allocate(self, transition):
+        self.fields = []
+        for i, value in enumerate(transition):
+            value = np.asarray(value)
+            self.fields.append(np.zeros((self.capacity,) + value.shape, dtype=self._field_dtype(i, value)))
+
+    def add(self, *args):
+        if self.fields is None:
+            self._allocate(args)
+        self.codec.fit([args[i] for i in self._OBS_FIELDS], [self.fields[i][:self._size] for i in self._OBS_FIELDS])
+        for i, (field, value) in enumerate(zip(self.fields, args)):
+            if i in self._OBS_FIELDS:
+                self.codec.write(field, self.position, value)
+            else:
+                field[self.position] = value
+        return self._advance()
+
+    def _decode(self, batch):
+        return Transition(*[self.codec.decode(values) if i in self._OBS_FIELDS else values
+                            for i, values in enumerate(batch)])
+
+    def get(self, indices):
+        return self._decode([field[indices] for field in self.fields])
+
+    def state_dict(self):
+        state = super().state_dict()
+        if self.fields is not None:
+            state.update(zip(Transition._fields, self.fields))
+        state.update(self.codec.state_dict())
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.fields = [state[name] for name in Transition._fields] if 'state' in state else None
+        self.codec.load_state_dict(state)
+
+
+class DedupArrayStorage(_Storage):
+    """
+    Array storage writing each observation once: within an episode, `next_state` of a step is `state` of the
+    following one, hence observations live in a single (capacity, *obs_shape) ring and `next_state[i]` is read from
+    slot i + 1.
+
+    Steps of an episode have to be pushed in order, as one-step transitions. After a terminal step ( all `done`), its `next_state` is kept in
+    the following slot, which holds no transition of its own ( a pad slot), and the next episode starts right after.
+    Transitions whose observations get overwritten this way are marked invalid and never sampled. Observations are
+    encoded by `obs_dtype`, as in `ArrayStorage`.
+    """
+
+    def __init__(self, capacity, obs_dtype='float32'):
+        super().__init__(capacity)
+        self.codec = make_codec(obs_dtype)
+        self.obs = None
+        self.fields = None  # action, reward, done, discount
+        self.valid = np.zeros(capacity, dtype=np.bool_)
+        self._filled = 0  # no. of slots written at least once
+        self._continues = False  # True, if the next push continues the episode of the last one
+        self._invalidated = []
+
+    def _allocate(self, state, *values):
+        self.obs = np.zeros((self.capacity,) + np.shape(state), dtype=self.codec.dtype)
+        self.fields = []
+        for value in values:
+            value = np.asarray(value)
+            dtype = np.bool_ if value.dtype == np.bool_ else np.float32
+            self.fields.append(np.zeros((self.capacity,) + value.shape, dtype=dtype))
+
+    def _invalidate(self, index):
+        if self.valid[index]:
+            self.valid[index] = False
+            self._size -= 1
+            self._invalidated.append(index)
+
+    def add(self, state, action, next_state, reward, done, discount):
+        if self.obs is None:
+            self._allocate(state, action, reward, done, discount)
+
+        index = self.position
+        next_index = (index + 1) % self.capacity
+        self.codec.fit([next_state] if self._continues else [state, next_state], [self.obs[:self._filled]])
+        if not self._continues:
+            # first step of an episode; the slot before can't keep pointing to it
+            self.codec.write(self.obs, index, state)
+            self._invalidate((index - 1) % self.capacity)
+        self.codec.write(self.obs, next_index, next_state)
+        self._invalidate(next_index)
+
+        for field, value in zip(self.fields, (action, reward, done, discount)):
+            field[index] = value
+        if not self.valid[index]:
+            self.valid[index] = True
+            self._size += 1
+
+        terminal = bool(np.all(done))
+        self._continues = not terminal
+        self.position = (next_index + 1) % self.capacity if terminal else next_index
+        self._filled = min(max(self._filled, index + 2), self.capacity)
+        return index
+
+    def get(self, indices):
+        indices = np.asarray(indices)
+        action, reward, done, discount = [field[indices] for field in self.fields]
+        return Transition(self.codec.decode(self.obs[indices]), action,
+                          self.codec.decode(self.obs[(indices + 1) % self.capacity]), reward, done, discount)
+
+    def sample_indices(self, batch_size):
+        # rejection sampling over the written slots; only pad slots and the slots after them are invalid
+        indices = np.random.randint(0, self._filled, size=batch_size)
+        rejected = ~self.valid[indices]
+        while rejected.any():
+            indices[rejected] = np.random.randint(0, self._filled, size=rejected.sum())
+            rejected = ~self.valid[indices]
+        return indices
+
+    def pop_invalidated(self):
+        invalidated, self._invalidated = self._invalidated, []
+        return invalidated
+
+    def state_dict(self):
+        state = super().state_dict()
+        state.update({'valid': self.valid, 'filled': self._filled, 'continues': self._continues})
+        if self.obs is not None:
+            state.update(zip(('obs', 'action', 'reward', 'done', 'discount'), [self.obs] + self.fields))
+        state.update(self.codec.state_dict())
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.valid = state['valid']
+        self._filled = int(state['filled'])
+        self._continues = bool(state['continues'])
+        if 'obs' in state:
+            self.obs = state['obs']
+            self.fields = [state[name] for name in ('action', 'reward', 'done', 'discount')]
+        else:
+            self.obs, self.fields = None, None
+        self.codec.load_state_dict(state)
+        self._invalidated = []
+
+
+class MemmapStorage(ArrayStorage):
+    """
+    Keeps transitions in `np.memmap` files ( one per field) under the given directory, so that the capacity is
+    bounded by disk rather than RAM. Sampled batches are read straight from the mapped pages.
+    """
+
+    def __init__(self, capacity, directory, obs_dtype='float32'):
+        super().__init__(capacity, obs_dtype)
+        self.directory = directory
+
+    def _allocate(self, transition):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        self.fields = []
+        for i, (name, value) in enumerate(zip(Transition._fields, transition)):
+            value = np.asarray(value)
+            self.fields.append(np.memmap(os.path.join(self.directory, '{}.dat'.format(name)),
+                                         dtype=self._field_dtype(i, value), mode='w+',
+                                         shape=(self.capacity,) + value.shape))
+
+    def get(self, indices):
+        # reading in ascending order keeps the page accesses sequential
+        indices = np.asarray(indices)
+        order = np.argsort(indices)
+        batch = []
+        for field in self.fields:
+            values = np.empty((len(indices),) + field.shape[1:], dtype=field.dtype)
+            values[order] = field[indices[order]]
+            batch.append(values)
+        return self._decode(batch)
+
+    def load_state_dict(self, state):
+        # contents are copied into the own files of the storage, leaving the snapshot untouched
+        _Storage.load_state_dict(self, state)
+        self.fields = None
+        if 'state' in state:
+            self._allocate([state[name][0] for name in Transition._fields])
+            for field, name in zip(self.fields, Transition._fields):
+                field[:] = state[name]
+        self.codec.load_state_dict(state)
+
+    def flush(self):
+        """ Writes pending changes of the mapped pages to disk"""
+        if self.fields is not None:
+            for field in self.fields:
+                field.flush()
+
+
+class TensorStorage(_Storage):
+    """
+    Keeps transitions in preallocated torch tensors on `device`, one per field. Batches are gathered on the device,
+    so learners get ready-to-use tensors without any numpy round-trip.
+    """
+
+    def __init__(self, capacity, device):
+        super().__init__(capacity)
+        self.device = torch.device(device)
+        self.fields = None
+
+    def _allocate(self, transition):
+        self.fields = []
+        for value in transition:
+            value = np.asarray(value)
+            dtype = torch.bool if value.dtype == np.bool_ else torch.float32
+            self.fields.append(torch.zeros((self.capacity,) + value.shape, dtype=dtype, device=self.device))
+
+    def add(self, *args):
+        if self.fields is None:
+            self._allocate(args)
+        for field, value in zip(self.fields, args):
+            field[self.position] = torch.as_tensor(np.asarray(value), dtype=field.dtype)
+        return self._advance()
+
+    def get(self, indices):
+        indices = torch.as_tensor(indices, dtype=torch.long, device=self.device)
+        return Transition(*[field[indices] for field in self.fields])
+
+    def state_dict(self):
+        state = super().state_dict()
+        if self.fields is not None:
+            state.update(zip(Transition._fields, [field.cpu().numpy() for field in self.fields]))
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.fields = None
+        if 'state' in state:
+            self.fields = [torch.as_tensor(np.asarray(state[name]), device=self.device) for name in Transition._fields]
+
+
+STORAGES = {'list': ListStorage, 'array': ArrayStorage, 'dedup': DedupArrayStorage, 'memmap': MemmapStorage,
+            'tensor': TensorStorage}
+
+
+def make_storage(storage, capacity, path=None, device=None, obs_dtype='float32'):
+    """
+    Returns a storage instance for the given storage name ( or the instance itself)
+
+    Args:
+        storage: one of `STORAGES` keys or a storage instance
+        capacity: maximum no. of transitions
+        path: directory for on-disk storages ( files are kept in its 'replay' sub-directory)
+        device: torch device for tensor storages
+        obs_dtype: observation encoding ( `ObservationCodec.DTYPES` key or codec) of the numpy storages
+    """
+    if isinstance(storage, _Storage):
+        return storage
+    if storage not in STORAGES:
+        raise ValueError('Unknown storage: {}. Choose from {}'.format(storage, list(STORAGES.keys())))
+    if storage in ('list', 'tensor'):
+        if obs_dtype != 'float32':
+            raise ValueError('{} storage keeps observations as given; use a numpy storage for obs_dtype {}'
+                             .format(storage, obs_dtype))
+        if storage == 'tensor':
+            return TensorStorage(capacity, 'cpu' if device is None else device)
+        return ListStorage(capacity)
+    if storage == 'memmap':
+        if path is None:
+            raise ValueError('path is required for memmap storage')
+        return MemmapStorage(capacity, os.path.join(path, 'replay'), obs_dtype)
+    return STORAGES[storage](capacity, obs_dtype)
+
+
+def save_snapshot(directory, parts):
+    """
+    Writes a snapshot under `directory`, replacing any previous one only once the new one is complete.
+
+    Args:
+        directory: snapshot directory
+        parts: dict of states ( dicts of numpy arrays and scalars), each written to a sub-directory of its key, with
+               one .npy file per array and every scalar in meta.npz
+    """
+    tmp_directory = directory.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+
+    for part, state in parts.items():
+        part_directory = os.path.join(tmp_directory, part)
+        os.makedirs(part_directory)
+        scalars = {}
+        for name, value in state.items():
+            if np.ndim(value) == 0:
+                scalars[name] = value
+            else:
+                np.save(os.path.join(part_directory, '{}.npy'.format(name)), np.asarray(value))
+        np.savez(os.path.join(part_directory, 'meta.npz'), **scalars)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(tmp_directory, directory)
+
+
+def load_snapshot(directory, mmap=True):
+    """
+    Reads a snapshot written by `save_snapshot`
+
+    Args:
+        directory: snapshot directory
+        mmap: if True, arrays are memory-mapped copy-on-write ( pages are read lazily and changes never reach the
+              snapshot files)
+    Returns:
+        dict of states, one per sub-directory ( other files are ignored)
+    """
+    parts = {}
+    for part in sorted(os.listdir(directory)):
+        part_directory = os.path.join(directory, part)
+        if not os.path.isdir(part_directory):
+            continue
+        with np.load(os.path.join(part_directory, 'meta.npz')) as meta:
+            state = {name: meta[name][()] for name in meta.files}
+        for file_name in os.listdir(part_directory):
+            name, ext = os.path.splitext(file_name)
+            if ext == '.npy':
+                state[name] = np.load(os.path.join(part_directory, file_name), mmap_mode='c' if mmap else None)
+        parts[part] = state
+    return parts